@@ -13,67 +13,165 @@ Description:
         - occurences
         - used_by_buildings
 
+    A folder of osm files can also be catalogued at once (catalog_folder) : every file is read by a streaming
+    tag counter (no geometry is built) in a process pool, then the counts are merged in a combined csv file
+    and a csv file with the breakdown per file.
+
 Usage:
-    None
+    - python Ident_tag.py
+    - python main.py catalog folder_of_osm_files
+    - tag_catalog(gdf) with a GeoDataFrame already loaded by functions.load_osm
 
 
 Dependencies:
     - Python 3.13+
-    - library used : os, osmnx, pandas
+    - library used : collections, concurrent.futures, glob, numpy, os, pandas, xml
+
+Notes:
+    - The streaming counter counts every tagged osm element (node, way, relation), tag_catalog counts the
+      features of the loaded GeoDataFrame : the occurences could differ a bit for the same file.
 
 """
 
 
 # Library import
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+import glob
 import os
-import osmnx as ox
-import pandas as pd 
+import xml.etree.ElementTree as ET
+import numpy as np
+import pandas as pd
 
 # function/variable import
-from configuration import full_path, Save_osm_to_csv_path, Name_OSM_File
-
-
-# Initialization of variables
-gdf = ox.features_from_xml(full_path)
+from configuration import full_path, path, Save_osm_to_csv_path, Name_OSM_File, CATALOG_WORKERS
 
-rows = []
 
+def tag_catalog(gdf):
+    """
+    Build the table of the tags used in an already loaded OSM GeoDataFrame (see functions.load_osm),
+    so the file does not need to be parsed again.
+    The non-null matrix of every column is computed once : occurences and use by the buildings come from
+    column sums of it, no copy of the frame per tag.
+    """
+    notnull = gdf.notna().to_numpy(dtype=bool)
+    counts = notnull.sum(axis=0)
 
-# Building of tags' table
-for col in gdf.columns:
-    count = gdf[col].notnull().sum()
-    if count == 0:
-        continue
-
-    # Tags/subtags ? 
-    if ":" in col:
-        parent, child = col.split(":", 1)
-    else:
-        parent, child = col, ""
-
-    # Use for buildings ? 
+    # Use for buildings ? (one mask of the building rows for every column)
     if "building" in gdf.columns:
-        used_by_buildings = gdf[gdf["building"].notnull()][col].notnull().sum() > 0
+        used_by_buildings = notnull[notnull[:, gdf.columns.get_loc("building")]].any(axis=0)
     else:
-        used_by_buildings = False
+        used_by_buildings = np.zeros(len(gdf.columns), dtype=bool)
+
+    # Tags/subtags ?
+    used = counts > 0
+    full_keys = gdf.columns[used].astype(str)
+    split = full_keys.str.split(":", n=1)
 
     # Creation of table
-    rows.append({
-        "tag": parent,
-        "subtag": child,
-        "full_key": col,
-        "occurences": count,
-        "used_by_buildings": used_by_buildings
+    return pd.DataFrame({
+        "tag": split.str[0],
+        "subtag": split.str[1].fillna(""),
+        "full_key": full_keys,
+        "occurences": counts[used],
+        "used_by_buildings": used_by_buildings[used],
     })
 
-# Convert to DataFrame
-df_tags = pd.DataFrame(rows)
-
-
-# Export to CSV
-output_file = os.path.join(Save_osm_to_csv_path, f"osm_tag_catalog_{Name_OSM_File}.csv")
-df_tags.to_csv(output_file, index=False)
-
-print("File 'osm_tag_catalog.csv'succesfully generated")
-
 
+def export_tag_catalog(df_tags, name_osm_file=Name_OSM_File, save_path=Save_osm_to_csv_path):
+    """Export the tags' table to a csv file."""
+    output_file = os.path.join(save_path, f"osm_tag_catalog_{name_osm_file}.csv")
+    df_tags.to_csv(output_file, index=False)
+
+    print("File 'osm_tag_catalog.csv'succesfully generated")
+    return output_file
+
+
+####### Folder of osm files #######
+
+def _split_keys(df, key_column="full_key"):
+    """Insert the tag and subtag columns (key split on the first ':') just before the key column of df."""
+    split = df[key_column].astype(str).str.split(":", n=1)
+    position = df.columns.get_loc(key_column)
+    df.insert(position, "subtag", split.str[1].fillna(""))
+    df.insert(position, "tag", split.str[0])
+    return df
+
+
+def count_tags(osm_path):
+    """
+    Streaming tag counter of an osm file : number of elements carrying every key, and number of building
+    elements carrying it. Only the keys of the current element are kept in memory, no geometry is built.
+    """
+    occurences, building = Counter(), Counter()
+    keys = []
+    context = ET.iterparse(osm_path, events=("start", "end"))
+    _, root = next(context)
+
+    for event, elem in context:
+        if event != "end":
+            continue
+        if elem.tag == "tag":
+            keys.append(elem.get("k"))
+        elif elem.tag in ("node", "way", "relation"):
+            if keys:
+                occurences.update(keys)
+                if "building" in keys:
+                    building.update(keys)
+                keys = []
+            root.clear()
+    return os.path.basename(osm_path), occurences, building
+
+
+def catalog_folder(folder=path, workers=CATALOG_WORKERS):
+    """
+    Tag catalog of every osm file of folder, counted in a process pool (workers=1 : in this process).
+    Returns the combined table (same columns as tag_catalog, plus the number of files using the key)
+    and the per-file table (one row per file and key).
+    """
+    files = sorted(glob.glob(os.path.join(folder, "*.osm")))
+    if not files:
+        raise FileNotFoundError(f"No osm file in {folder}")
+
+    workers = min(workers or os.cpu_count() or 1, len(files))
+    if workers == 1:
+        counts = [count_tags(file) for file in files]
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            counts = list(executor.map(count_tags, files))
+
+    # Per-file breakdown
+    by_file = pd.DataFrame(
+        [(name, key, n, building[key]) for name, occurences, building in counts for key, n in occurences.items()],
+        columns=["file", "full_key", "occurences", "building_occurences"],
+    )
+    by_file = _split_keys(by_file.sort_values(["file", "full_key"], ignore_index=True))
+
+    # Merged counts
+    combined = by_file.groupby("full_key", sort=True).agg(
+        occurences=("occurences", "sum"),
+        used_by_buildings=("building_occurences", "sum"),
+        files=("file", "nunique"),
+    ).reset_index()
+    combined["used_by_buildings"] = combined["used_by_buildings"] > 0
+    combined = _split_keys(combined.sort_values("occurences", ascending=False, kind="stable", ignore_index=True))
+    return combined, by_file
+
+
+def export_folder_catalog(combined, by_file, save_path=Save_osm_to_csv_path):
+    """Export the combined table and the per-file table of catalog_folder to two csv files."""
+    os.makedirs(save_path, exist_ok=True)
+    combined_file = os.path.join(save_path, "osm_tag_catalog_all.csv")
+    by_file_file = os.path.join(save_path, "osm_tag_catalog_by_file.csv")
+    combined.to_csv(combined_file, index=False)
+    by_file.to_csv(by_file_file, index=False)
+
+    print(f"{by_file['file'].nunique()} files, {len(combined)} tags → {combined_file}, {by_file_file}")
+    return combined_file, by_file_file
+
+
+if __name__ == "__main__":
+    from functions import load_osm
+
+    gdf = load_osm(full_path)
+    export_tag_catalog(tag_catalog(gdf))
@@ -0,0 +1,135 @@
+"""
+File: aoi.py
+Author: TORREGROSSA Dylan
+Repository: https://github.com/P-Joss-P/map-to-3d.git
+License: GNU GENERAL PUBLIC LICENSE Version 3 (see LICENSE file)
+
+Description:
+    This file will allow users to extract an area of interest (AOI) from the filtered GeoDataFrame made by
+    load_and_filter_osm, instead of meshing the whole osm file :
+        - the area is a bbox (minx, miny, maxx, maxy) or any shapely geometry (polygon, or a line with a buffer
+          for a corridor), given in lon/lat, in projected metres (crs of the scene) or in scene coordinates
+        - the features are selected with an STRtree query (only the candidates of the tree are tested)
+        - the selected features are clipped to the area, the ones fully inside are kept as they are
+    The tree is built once, so many areas can be extracted from a single load (extract_areas).
+
+Usage:
+    - python main.py build file.osm --bbox 5.70 45.17 5.74 45.20
+    - python main.py build file.osm --area corridor.geojson --buffer 1000
+    - extract_area(gdf, (5.70, 45.17, 5.74, 45.20))
+
+Dependencies:
+    - Python 3.13+
+    - library used : geopandas, numpy, shapely
+
+Notes:
+    - The extracted frames keep the origin of the loaded frame (gdf.attrs["origin"]), so the scenes of
+      several areas stay aligned with each other.
+    - Area crs :
+        - "lonlat" : EPSG:4326 (default)
+        - "projected" : metres in the crs of the loaded frame (UTM zone), before centring
+        - "scene" : metres in the centred scene coordinates
+        - any other string (e.g. "EPSG:2154") is given to geopandas as a crs
+
+"""
+
+# library import
+import geopandas as gpd
+import numpy as np
+import shapely
+
+# function/variable import
+from configuration import AREA_BUFFER, AREA_CLIP, AREA_CRS
+
+
+def area_geometry(area, gdf, area_crs=AREA_CRS, buffer=AREA_BUFFER):
+    """
+    Area in the scene coordinates of gdf (projected and centred by load_and_filter_osm).
+    area is a (minx, miny, maxx, maxy) bbox or a shapely geometry, buffered by buffer metres once projected.
+    """
+    if not isinstance(area, shapely.Geometry):
+        area = shapely.box(*area)
+
+    origin = gdf.attrs.get("origin", {"x": 0.0, "y": 0.0})
+    if area_crs == "lonlat":
+        area_crs = "EPSG:4326"
+    if area_crs not in ("projected", "scene"):
+        area = gpd.GeoSeries([area], crs=area_crs).to_crs(gdf.crs).iloc[0]
+    if area_crs != "scene":
+        area = shapely.transform(area, lambda coords: coords - [origin["x"], origin["y"]])
+
+    if buffer:
+        area = shapely.buffer(area, buffer)
+    if shapely.get_dimensions(area) < 2:
+        raise ValueError("The area of interest has no surface : give a polygon, a bbox, or a buffer for lines/points")
+    return area
+
+
+def build_index(gdf):
+    """STRtree of the geometries of gdf, to be shared between several extractions."""
+    return shapely.STRtree(np.asarray(gdf.geometry.values, dtype=object))
+
+
+def _clip(geoms, areas):
+    """
+    Intersection of every geometry with its area (element-wise). The features fully inside are not touched,
+    the collections made by the clipping keep only the parts of the dimension of their feature
+    (a polygon touching the border doesn't become a polygon + a line).
+    """
+    shapely.prepare(areas)
+    inside = shapely.contains_properly(areas, geoms)
+    clipped = geoms.copy()
+    clipped[~inside] = shapely.intersection(geoms[~inside], areas[~inside])
+
+    dimension = shapely.get_dimensions(geoms)
+    for i in np.flatnonzero(shapely.get_type_id(clipped) == 7):      # GeometryCollection
+        parts = shapely.get_parts(clipped[i])
+        parts = parts[shapely.get_dimensions(parts) == dimension[i]]
+        clipped[i] = shapely.union_all(parts) if len(parts) else shapely.Polygon()
+    return clipped
+
+
+def _subset(gdf, selected, geoms, area):
+    """Rows selected of gdf with the (clipped) geoms, the empty ones removed."""
+    keep = ~shapely.is_empty(geoms)
+    subset = gdf.iloc[selected[keep]]       # a single take of the columns
+    subset = subset.set_geometry(gpd.GeoSeries(geoms[keep], index=subset.index, crs=gdf.crs))
+    subset.attrs = {**gdf.attrs, "aoi": [float(v) for v in area.bounds]}
+    return subset
+
+
+def extract_area(gdf, area, area_crs=AREA_CRS, buffer=AREA_BUFFER, clip=AREA_CLIP, tree=None):
+    """
+    Features of gdf intersecting the area (see area_geometry), clipped to it when clip=True.
+    tree is the build_index(gdf) STRtree, built here when it is not given.
+    """
+    return extract_areas(gdf, [area], area_crs, buffer, clip, tree)[0]
+
+
+def extract_areas(gdf, areas, area_crs=AREA_CRS, buffer=AREA_BUFFER, clip=AREA_CLIP, tree=None):
+    """
+    One extract_area frame per area. The tree is queried once with every area and the (area, feature)
+    pairs are clipped in a single vectorized intersection, only the take of the rows is done per area.
+    """
+    areas = np.array([area_geometry(area, gdf, area_crs, buffer) for area in areas], dtype=object)
+    tree = tree if tree is not None else build_index(gdf)
+    geoms = np.asarray(gdf.geometry.values, dtype=object)
+
+    area_index, selected = tree.query(areas, predicate="intersects")
+    order = np.lexsort((selected, area_index))      # features in the order of gdf for every area
+    area_index, selected = area_index[order], selected[order]
+    clipped = _clip(geoms[selected], areas[area_index]) if clip else geoms[selected]
+
+    bounds = np.searchsorted(area_index, np.arange(len(areas) + 1))
+    subsets = []
+    for k, area in enumerate(areas):
+        part = slice(bounds[k], bounds[k + 1])
+        subsets.append(_subset(gdf, selected[part], clipped[part], area))
+        print(f"Area of interest : {len(subsets[-1])} / {len(gdf)} features")
+    return subsets
+
+
+def read_area(path):
+    """Union of the geometries of a vector file (GeoJSON, shapefile, ...) and its crs."""
+    areas = gpd.read_file(path)
+    return areas.geometry.union_all(), areas.crs.to_string() if areas.crs is not None else "scene"
@@ -0,0 +1,637 @@
+"""
+File: benchmark.py
+Author: TORREGROSSA Dylan
+Repository: https://github.com/P-Joss-P/map-to-3d.git
+License: GNU GENERAL PUBLIC LICENSE Version 3 (see LICENSE file)
+
+Description:
+    This file will allow developers to compare the speed of the optimized functions with the
+    previous implementations on the osm samples of the fichiers_osm folder.
+    Every benchmark checks that both implementations give the same result before printing the timings.
+
+Usage:
+    - python benchmark.py entity
+    - python benchmark.py entity --repeat 10
+    - python benchmark.py export
+    - python benchmark.py ribbon
+    - python benchmark.py glb
+    - python benchmark.py imports
+    - python benchmark.py plot
+    - python benchmark.py raster
+    - python benchmark.py catalog
+    - python benchmark.py aoi
+    - python benchmark.py index
+    - python benchmark.py terrain
+    - python benchmark.py heights
+    - python benchmark.py cache
+    - python benchmark.py lod
+
+Dependencies:
+    - Python 3.13+
+    - library used : argparse, glob, numpy, os, scipy, shapely, subprocess, sys, tempfile, time, trimesh
+
+"""
+
+# library import
+import argparse
+import glob
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import numpy as np
+import shapely
+import trimesh
+
+# function/variable import
+from configuration import path, interest_types, DEFAULT_CONFIG
+from aoi import extract_areas
+from functions import detect_entity_types, load_and_filter_osm, load_osm, osm2plot
+from heights import resolve_heights
+from Ident_tag import tag_catalog
+from lod import export_lods
+from meshing import LINE_TYPES, buffer_lines, extrude_polygons, load_rules, ribbon_prisms
+from raster_preview import polygon_mask, render_preview, write_png
+from scene_builder import build_scene
+from scene_export import export_scene, flatten_scene
+from spatial_index import build_index_store, query_index
+from terrain import elevation, open_dem, terrain_sampler
+
+
+def osm_samples(folder=path):
+    """List the osm files used as benchmark samples."""
+    return sorted(glob.glob(os.path.join(folder, "*.osm")))
+
+
+def best_time(func, repeat):
+    """Best execution time of func (in seconds) over repeat runs, and its last result."""
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def print_result(name, n_rows, t_before, t_after):
+    print(f"{name:<40} {n_rows:>8} rows   before {t_before * 1e3:9.2f} ms   after {t_after * 1e3:9.2f} ms   x{t_before / t_after:6.1f}")
+
+
+##########################
+####### entity_type ######
+##########################
+
+def detect_entity_apply(gdf, available_tags):
+    """Previous row-wise implementation of the entity_type detection (gdf.apply)."""
+    def detect_entity(row):
+        for tag in available_tags:
+            val = row.get(tag, None)
+            if val is not None and val != "" and not (isinstance(val, float) and np.isnan(val)):
+                return tag
+        return None
+
+    return gdf.apply(detect_entity, axis=1)
+
+
+def bench_entity(files, repeat):
+    """Row-wise apply versus columnar detect_entity_types."""
+    for file in files:
+        gdf = load_osm(file)
+        available_tags = [col for col in interest_types if col in gdf.columns]
+
+        t_before, before = best_time(lambda: detect_entity_apply(gdf, available_tags), repeat)
+        t_after, after = best_time(lambda: detect_entity_types(gdf, available_tags), repeat)
+
+        if before.fillna("").tolist() != after.fillna("").tolist():
+            raise AssertionError(f"entity_type differs for {file}")
+
+        print_result(os.path.basename(file), len(gdf), t_before, t_after)
+
+
+########################
+####### glb export #####
+########################
+
+def bench_export(files, repeat):
+    """Export of the per-feature scene versus export of the flattened scene (nodes, time and size)."""
+    for file in files:
+        gdf = load_and_filter_osm(file, save_filtered=False, use_cache=False)
+        scene = build_scene(gdf, batched=False)
+
+        t_before, glb_before = best_time(lambda: scene.export(file_type="glb"), repeat)
+        t_after, glb_after = best_time(lambda: flatten_scene(scene, feature_ids=False).export(file_type="glb"), repeat)
+        flat = flatten_scene(scene, feature_ids=False)
+        glb_ids = flatten_scene(scene, feature_ids=True).export(file_type="glb")
+
+        if abs(flat.volume - scene.volume) > 1e-3 * abs(scene.volume):
+            raise AssertionError(f"flattened scene differs for {file}")
+        if len(glb_after) >= len(glb_before):
+            raise AssertionError(f"flattened glb of {file} is not lighter ({len(glb_after)} ≥ {len(glb_before)} bytes)")
+
+        print_result(os.path.basename(file), len(gdf), t_before, t_after)
+        print(f"{'':<40} nodes {len(scene.graph.nodes_geometry)} → {len(flat.graph.nodes_geometry)}   "
+              f"size {len(glb_before) / 1e6:.2f} MB → {len(glb_after) / 1e6:.2f} MB "
+              f"({len(glb_ids) / 1e6:.2f} MB with the feature ids)")
+
+
+########################
+####### line meshes ####
+########################
+
+def prism_volume(vertices, faces):
+    """Volume of a closed triangle mesh (sum of the signed tetrahedra)."""
+    a, b, c = (vertices[faces[:, i]] for i in range(3))
+    return float(np.einsum("ij,ij->i", a, np.cross(b, c)).sum() / 6)
+
+
+def bench_ribbon(files, repeat, width=3.0, height=3.0):
+    """Buffer + triangulation of the lines versus direct ribbon prisms (time, triangles and volume)."""
+    for file in files:
+        gdf = load_and_filter_osm(file, save_filtered=False, use_cache=False)
+        geoms = np.asarray(gdf.geometry.values, dtype=object)
+        lines = geoms[np.isin(shapely.get_type_id(geoms), LINE_TYPES)]
+        heights = np.full(len(lines), height)
+
+        t_before, before = best_time(
+            lambda: extrude_polygons(buffer_lines(lines, width, "mitre"), heights), repeat)
+        t_after, after = best_time(lambda: ribbon_prisms(lines, width, heights), repeat)
+
+        # Same volume, except the overlaps of the sharp turns which the buffer dissolves
+        v_before, v_after = prism_volume(*before[:2]), prism_volume(*after[:2])
+        if abs(v_after - v_before) > 0.1 * abs(v_before):
+            raise AssertionError(f"ribbon volume differs for {file} : {v_before:.0f} / {v_after:.0f}")
+
+        print_result(os.path.basename(file), len(lines), t_before, t_after)
+        print(f"{'':<40} triangles {len(before[1])} → {len(after[1])}   volume {v_before:.0f} → {v_after:.0f} m³")
+
+
+#########################
+####### compact glb #####
+#########################
+
+def bench_glb(files, repeat):
+    """
+    trimesh glb export versus compact glb (file size, trimesh load time and triangle area).
+    The gain of the compact glb is its size : the load time is only printed to check it doesn't get worse.
+    """
+    for file in files:
+        gdf = load_and_filter_osm(file, save_filtered=False, use_cache=False)
+        scene = build_scene(gdf)
+
+        with tempfile.TemporaryDirectory() as folder:
+            before_path, after_path = os.path.join(folder, "before.glb"), os.path.join(folder, "after.glb")
+            export_scene(scene, before_path, compact=False)
+            export_scene(scene, after_path, compact=True)
+
+            t_before, before = best_time(lambda: trimesh.load(before_path), repeat)
+            t_after, after = best_time(lambda: trimesh.load(after_path), repeat)
+
+            # Same surface, except the triangles made degenerated by the quantization
+            area_before, area_after = before.to_mesh().area, after.to_mesh().area
+            if abs(area_after - area_before) > 1e-3 * area_before:
+                raise AssertionError(f"compact glb differs for {file} : {area_before:.0f} / {area_after:.0f} m²")
+
+            print_result(os.path.basename(file), len(gdf), t_before, t_after)
+            print(f"{'':<40} size {os.path.getsize(before_path) / 1e6:.2f} MB → {os.path.getsize(after_path) / 1e6:.2f} MB")
+
+
+#####################
+####### imports #####
+#####################
+
+# Modules which must never be loaded by the scene creation (scene_builder.py, meshing.py)
+HEAVY_MODULES = ("geopandas", "matplotlib", "osmnx", "pandas", "pyglet")
+SCRIPTS_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def import_profile(module):
+    """
+    Import module in a new interpreter with python -X importtime.
+    Returns its cumulative import time (s) and the set of every imported module.
+    """
+    process = subprocess.run([sys.executable, "-X", "importtime", "-c", f"import {module}"],
+                             cwd=SCRIPTS_DIR, capture_output=True, text=True, check=True)
+
+    total, imported = 0.0, set()
+    for line in process.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line.split("|")
+        name = name.strip()
+        imported.add(name)
+        if name == module:
+            total = int(cumulative) * 1e-6
+    return total, imported
+
+
+def bench_imports(files, repeat):
+    """Cold import time of the modules (-X importtime), the scene creation must not load HEAVY_MODULES."""
+    for module in ("scene_builder", "meshing", "functions", "main"):
+        profiles = [import_profile(module) for _ in range(repeat)]
+        best = min(total for total, _ in profiles)
+        heavy = sorted({name.split(".")[0] for name in profiles[-1][1]} & set(HEAVY_MODULES))
+
+        print(f"{module:<40} {best * 1e3:9.1f} ms   heavy modules : {', '.join(heavy) or '-'}")
+        if module in ("scene_builder", "meshing") and heavy:
+            raise AssertionError(f"{module} imports {', '.join(heavy)}")
+
+
+####################
+####### plots ######
+####################
+
+def osm2plot_previous(gdf, interest_types, save_folder_path):
+    """Previous osm2plot : one pyplot figure and one GeoDataFrame.plot call per type (figures closed at the end)."""
+    import matplotlib
+    matplotlib.use("Agg")
+    import matplotlib.colors as mcolors
+    import matplotlib.patches as mpatches
+    import matplotlib.pyplot as plt
+
+    colormap = matplotlib.colormaps["jet"].resampled(len(interest_types))
+    colors = [mcolors.to_hex(colormap(i)) for i in range(len(interest_types))]
+    for color, type_name in zip(colors, interest_types):
+        mask = gdf[type_name].notnull() if type_name in gdf.columns else np.zeros(len(gdf), dtype=bool)
+        if mask.any():
+            fig, ax = plt.subplots(figsize=(10, 10))
+            gdf[mask].plot(ax=ax, color=color)
+            plt.title(type_name)
+            fig.savefig(os.path.join(save_folder_path, type_name))
+
+    fig, ax = plt.subplots(figsize=(10, 10))
+    legend_patches = []
+    for color, type_name in zip(colors, interest_types):
+        mask = gdf[type_name].notnull() if type_name in gdf.columns else np.zeros(len(gdf), dtype=bool)
+        if mask.any():
+            gdf[mask].plot(ax=ax, color=color, label=type_name)
+        legend_patches.append(mpatches.Patch(color=color, label=type_name))
+    ax.legend(handles=legend_patches, title="Categories", loc="upper left", bbox_to_anchor=(1, 1))
+    plt.title("Final plot type colored")
+    fig.savefig(os.path.join(save_folder_path, "Final plot type colored"))
+    plt.close("all")
+
+
+def bench_plot(files, repeat):
+    """Previous osm2plot versus masks in one pass, collections and process pool (same png files)."""
+    for file in files:
+        gdf = load_osm(file)
+
+        with tempfile.TemporaryDirectory() as before, tempfile.TemporaryDirectory() as after:
+            t_before, _ = best_time(lambda: osm2plot_previous(gdf, interest_types, before), repeat)
+            t_after, _ = best_time(lambda: osm2plot(gdf, interest_types, True, after, show_setting=False), repeat)
+
+            if sorted(os.listdir(before)) != sorted(os.listdir(after)):
+                raise AssertionError(f"png files differ for {file} : {sorted(os.listdir(before))} / {sorted(os.listdir(after))}")
+
+        print_result(os.path.basename(file), len(gdf), t_before, t_after)
+
+
+#####################
+####### raster ######
+#####################
+
+def preview_matplotlib(gdf, png_path, rules):
+    """Previous way to look at the filtered data : one GeoDataFrame.plot call per entity_type, saved in a png file."""
+    import matplotlib
+    matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+
+    fig, ax = plt.subplots(figsize=(10, 10))
+    for typ, group in gdf.groupby("entity_type"):
+        if typ in rules:
+            color = np.clip(rules[typ].get("color", [128, 128, 128, 255])[:3], 0, 255) / 255
+            group.plot(ax=ax, color=tuple(color))
+    fig.savefig(png_path, dpi=200)
+    plt.close(fig)
+
+
+def bench_raster(files, repeat, size=2048):
+    """matplotlib figure versus numpy rasterizer (same png size), the polygon pixels must match the shapely area."""
+    rules = load_rules(DEFAULT_CONFIG)
+    for file in files:
+        gdf = load_and_filter_osm(file, save_filtered=False, use_cache=False)
+
+        # Pixel count of the polygons versus their area (tolerance : the pixels cut by the outlines)
+        image, (minx, miny, maxx, maxy, resolution) = render_preview(gdf, size=size)
+        parts = shapely.get_parts(np.asarray(gdf.geometry.values, dtype=object))
+        polygons = parts[shapely.get_type_id(parts) == 3]
+        def to_pixels(coords):
+            return (coords[:, 0] - minx) / resolution, (maxy - coords[:, 1]) / resolution
+        covered = polygon_mask(polygons, to_pixels, image.shape[:2]).sum() * resolution ** 2
+        union = shapely.union_all(polygons).area
+        outline = shapely.union_all(polygons).length * resolution
+        if abs(covered - union) > outline:
+            raise AssertionError(f"raster preview differs for {file} : {covered:.0f} / {union:.0f} m²")
+
+        with tempfile.TemporaryDirectory() as folder:
+            t_before, _ = best_time(lambda: preview_matplotlib(gdf, os.path.join(folder, "before.png"), rules), repeat)
+            t_after, _ = best_time(lambda: write_png(os.path.join(folder, "after.png"), render_preview(gdf, size=size)[0]), repeat)
+
+        print_result(os.path.basename(file), len(gdf), t_before, t_after)
+
+
+######################
+####### catalog ######
+######################
+
+def tag_catalog_loop(gdf):
+    """Previous tag catalog : one loop over the columns, with a copy of the building rows for every column."""
+    import pandas as pd
+
+    rows = []
+    for col in gdf.columns:
+        count = gdf[col].notnull().sum()
+        if count == 0:
+            continue
+        parent, child = col.split(":", 1) if ":" in col else (col, "")
+        if "building" in gdf.columns:
+            used_by_buildings = gdf[gdf["building"].notnull()][col].notnull().sum() > 0
+        else:
+            used_by_buildings = False
+        rows.append({"tag": parent, "subtag": child, "full_key": col, "occurences": count,
+                     "used_by_buildings": used_by_buildings})
+    return pd.DataFrame(rows)
+
+
+def bench_catalog(files, repeat):
+    """Loop over the columns versus one non-null matrix (same csv table)."""
+    for file in files:
+        gdf = load_osm(file)
+
+        t_before, before = best_time(lambda: tag_catalog_loop(gdf), repeat)
+        t_after, after = best_time(lambda: tag_catalog(gdf), repeat)
+
+        if before.astype(str).values.tolist() != after.astype(str).values.tolist():
+            raise AssertionError(f"tag catalogs differ for {file}")
+
+        print_result(os.path.basename(file), len(gdf), t_before, t_after)
+
+
+##################
+####### aoi ######
+##################
+
+def bench_aoi(files, repeat, width=400.0):
+    """
+    Whole scene versus the scene of a corridor of width metres along the diagonal of the extract
+    (STRtree selection and clipping included). The clipped corridor must be the one of geopandas clip.
+    """
+    for file in files:
+        gdf = load_and_filter_osm(file, save_filtered=False, use_cache=False)
+        minx, miny, maxx, maxy = gdf.total_bounds
+        corridor = shapely.LineString([(minx, miny), (maxx, maxy)])
+
+        t_before, _ = best_time(lambda: build_scene(gdf), repeat)
+        t_after, _ = best_time(lambda: build_scene(extract_areas(gdf, [corridor], "scene", width / 2)[0]), repeat)
+
+        area = extract_areas(gdf, [corridor], "scene", width / 2)[0]
+        reference = gdf.clip(shapely.buffer(corridor, width / 2))
+        if not np.allclose([area.area.sum(), area.length.sum()], [reference.area.sum(), reference.length.sum()]):
+            raise AssertionError(f"area of interest differs for {file}")
+
+        print_result(f"{os.path.basename(file)} ({len(area)} in corridor)", len(gdf), t_before, t_after)
+
+
+####################
+####### index ######
+####################
+
+def bench_index(files, repeat, size=400.0):
+    """
+    Parsing of the osm file and extraction of the middle third of its extent versus a query of the tiled index
+    (tiles of size metres). The results must be the same, with and without clipping, and not empty.
+    """
+    for file in files:
+        load = lambda: load_and_filter_osm(file, save_filtered=False, use_cache=False)
+        gdf = load()
+        minx, miny, maxx, maxy = gdf.total_bounds
+        box = (minx + (maxx - minx) / 3, miny + (maxy - miny) / 3, maxx - (maxx - minx) / 3, maxy - (maxy - miny) / 3)
+
+        with tempfile.TemporaryDirectory() as folder:
+            build_index_store(gdf, folder, tile_size=size, source=file)
+            t_before, before = best_time(lambda: extract_areas(load(), [box], "scene")[0], repeat)
+            t_after, after = best_time(lambda: query_index(folder, box, "scene"), repeat)
+
+            for clip in (False, True):
+                before = extract_areas(gdf, [box], "scene", clip=clip)[0]
+                after = query_index(folder, box, "scene", clip=clip)
+                if len(after) == 0:
+                    raise AssertionError(f"the query area of {file} has no feature : nothing is compared")
+                if sorted(before.index) != sorted(after.index) or not np.isclose(before.area.sum(), after.area.sum()) \
+                        or not np.isclose(before.length.sum(), after.length.sum()):
+                    raise AssertionError(f"index query differs for {file} (clip={clip})")
+
+        print_result(f"{os.path.basename(file)} ({len(after)} in query)", len(gdf), t_before, t_after)
+
+
+######################
+####### terrain ######
+######################
+
+def write_ascii_dem(file_path, bounds, cell):
+    """Synthetic ESRI ASCII grid (slope + waves) covering bounds."""
+    minx, miny, maxx, maxy = bounds
+    ncols, nrows = int(np.ceil((maxx - minx) / cell)), int(np.ceil((maxy - miny) / cell))
+    x = minx + (np.arange(ncols) + 0.5) * cell
+    y = maxy - (np.arange(nrows) + 0.5) * cell
+    z = 100.0 + 0.02 * x[None, :] + 30.0 * np.sin(y[:, None] / 500.0)
+    with open(file_path, "w", encoding="ascii") as f:
+        f.write(f"ncols {ncols}\nnrows {nrows}\nxllcorner {minx}\nyllcorner {maxy - nrows * cell}\ncellsize {cell}\n")
+        np.savetxt(f, z, fmt="%.3f")
+
+
+def elevation_scipy(file_path, x, y):
+    """Previous way : the whole grid read with numpy.loadtxt, then a scipy interpolator at every vertex."""
+    from scipy.interpolate import RegularGridInterpolator
+    with open(file_path, encoding="ascii") as f:
+        header = {name.lower(): float(value) for name, value in (next(f).split() for _ in range(5))}
+    grid = np.loadtxt(file_path, skiprows=5, dtype=np.float32)
+    cell = header["cellsize"]
+    xs = header["xllcorner"] + (np.arange(grid.shape[1]) + 0.5) * cell
+    ys = header["yllcorner"] + (np.arange(grid.shape[0]) + 0.5) * cell
+    interpolator = RegularGridInterpolator((ys, xs), grid[::-1], bounds_error=False, fill_value=None)
+    return interpolator(np.column_stack([y, x]))
+
+
+def bench_terrain(files, repeat, cell=10.0):
+    """
+    Elevation of every vertex of the scene on a DEM three times larger than the scene : whole grid read and
+    scipy interpolator versus the window of the memory-mapped grid (converted once) and the vectorized bilinear.
+    """
+    for file in files:
+        gdf = load_and_filter_osm(file, save_filtered=False, use_cache=False)
+        vertices = np.concatenate([mesh.vertices for mesh in build_scene(gdf).geometry.values()])
+        minx, miny, maxx, maxy = gdf.total_bounds
+        width, height = maxx - minx, maxy - miny
+
+        with tempfile.TemporaryDirectory() as folder:
+            dem_path = os.path.join(folder, "dem.asc")
+            write_ascii_dem(dem_path, (minx - width, miny - height, maxx + width, maxy + height), cell)
+
+            def sample():
+                sampler = terrain_sampler(open_dem(dem_path, cache_dir=folder), gdf.total_bounds)
+                return elevation(sampler, *vertices[:, :2].T)
+
+            sample()        # conversion of the grid in the cache (once per DEM)
+
+            t_before, before = best_time(lambda: elevation_scipy(dem_path, *vertices[:, :2].T), repeat)
+            t_after, after = best_time(sample, repeat)
+
+        if not np.allclose(before, after, atol=1e-3):
+            raise AssertionError(f"elevations differ for {file}")
+
+        print_result(f"{os.path.basename(file)} ({len(vertices)} vertices)", len(gdf), t_before, t_after)
+
+
+######################
+####### heights ######
+######################
+
+def heights_loop(gdf, rules):
+    """Previous way : the height_from_tag of every row read in the loop of build_scene."""
+    heights = []
+    for _, row in gdf.iterrows():
+        rule = rules.get(row["entity_type"], {})
+        tag = rule.get("height_from_tag", None)
+        try:
+            heights.append(float(row[tag]) if tag and tag in row and isinstance(row[tag], str) else float("nan"))
+        except ValueError:
+            heights.append(float("nan"))
+        if heights[-1] != heights[-1]:      # NaN
+            heights[-1] = float(rule.get("default_height", 5.0))
+    return np.array(heights)
+
+
+def bench_heights(files, repeat, copies=50):
+    """
+    Row by row height tag versus resolve_heights, on random numeric height tags of the building features
+    (copies times, for a city sized frame). Only the height tag is kept : the loop doesn't read the other ones.
+    """
+    rules = load_rules(DEFAULT_CONFIG)
+    rng = np.random.default_rng(0)
+    for file in files:
+        gdf = load_and_filter_osm(file, save_filtered=False, use_cache=False)
+        gdf = gdf.loc[gdf["entity_type"] == "building", ["entity_type", gdf.geometry.name]]
+        gdf = gdf.iloc[np.tile(np.arange(len(gdf)), copies)]
+        gdf = gdf.assign(height=rng.choice(np.array(["6", "9.5", "12", None], dtype=object), len(gdf)))
+
+        t_before, before = best_time(lambda: heights_loop(gdf, rules), repeat)
+        t_after, after = best_time(lambda: resolve_heights(gdf, rules)["mesh_height"].to_numpy(), repeat)
+
+        if not np.allclose(before, after):
+            raise AssertionError(f"heights differ for {file}")
+
+        print_result(os.path.basename(file), len(gdf), t_before, t_after)
+
+
+####################
+####### cache ######
+####################
+
+# main.py with the folders of the caches and of the filtered data moved to the folder given before its arguments
+PATCHED_MAIN = ("import os, runpy, sys, configuration; "
+                "configuration.CACHE_DIR = configuration.FILTERED_DIR = sys.argv.pop(1); "
+                "configuration.MESH_CACHE_DIR = os.path.join(configuration.CACHE_DIR, 'mesh_cache'); "
+                "sys.argv[0] = 'main.py'; runpy.run_path('main.py', run_name='__main__')")
+
+
+def run_build(file, folder):
+    """python main.py build file in a new interpreter, with its caches in folder, returns its output."""
+    process = subprocess.run([sys.executable, "-c", PATCHED_MAIN, folder, "build", file, "-o",
+                              os.path.join(folder, "map3d.glb"), "--config", DEFAULT_CONFIG],
+                             cwd=SCRIPTS_DIR, capture_output=True, text=True, check=True)
+    return process.stdout
+
+
+def bench_cache(files, repeat):
+    """
+    Whole loading of the osm file (parsing, reprojection, centre, classification and filtered.geojson written)
+    versus a cache hit, whose time must stay under a second. Then the build command is run twice : the
+    second run must read the filtered data from the cache instead of parsing the osm file again.
+    """
+    for file in files:
+        with tempfile.TemporaryDirectory() as folder:
+            filtered_path = os.path.join(folder, "filtered.geojson")
+            load = lambda use_cache: load_and_filter_osm(file, filtered_path=filtered_path, use_cache=use_cache,
+                                                         cache_dir=folder)
+            t_before, gdf = best_time(lambda: load(False), repeat)
+            load(True)      # cache entry written
+            t_after, cached = best_time(lambda: load(True), repeat)
+
+            if not cached.geom_equals(gdf).all() or cached.attrs.get("origin") != gdf.attrs.get("origin"):
+                raise AssertionError(f"cached data of {file} differs from the loaded data")
+            if t_after > 1.0:
+                raise AssertionError(f"cache hit of {file} takes {t_after:.2f} s (more than a second)")
+
+            cli_folder = os.path.join(folder, "cli")     # empty cache for the first run
+            os.makedirs(cli_folder)
+            start = time.perf_counter()
+            run_build(file, cli_folder)
+            t_first = time.perf_counter() - start
+            start = time.perf_counter()
+            output = run_build(file, cli_folder)
+            t_next = time.perf_counter() - start
+
+            if "loaded from cache" not in output or "streamed" in output:
+                raise AssertionError(f"second build of {file} didn't read the cache :\n{output}")
+
+        print_result(os.path.basename(file), len(gdf), t_before, t_after)
+        print(f"{'':<40} cache hit {t_after * 1e3:.1f} ms   build command : first run {t_first:.2f} s, "
+              f"next run {t_next:.2f} s")
+
+
+##################
+####### lod ######
+##################
+
+LOD_TARGET = 10.0       # The farthest level must have at least LOD_TARGET times less triangles than the first one
+
+
+def bench_lod(files, repeat):
+    """
+    Features, triangles, ratio to the first level and file size of every level of LOD_LEVELS (configuration.py),
+    the farthest level must reach LOD_TARGET.
+    """
+    for file in files:
+        gdf = load_and_filter_osm(file, save_filtered=False, use_cache=False)
+
+        with tempfile.TemporaryDirectory() as folder:
+            manifest = export_lods(gdf, folder, mesh_cache=False)
+            levels = manifest["levels"]
+            for level in levels:
+                size = os.path.getsize(os.path.join(folder, level["file"]))
+                print(f"{os.path.basename(file) + ' ' + level['name']:<40} {level['features']:>8} features   "
+                      f"{level['triangles']:>8} triangles   x{level['ratio']:6.1f}   size {size / 1e6:.2f} MB")
+
+        if levels[-1]["ratio"] < LOD_TARGET:
+            raise AssertionError(f"{levels[-1]['name']} of {file} has only x{levels[-1]['ratio']} less triangles "
+                                 f"than {levels[0]['name']} (target x{LOD_TARGET})")
+
+
+BENCHMARKS = {
+    "entity": bench_entity,
+    "export": bench_export,
+    "ribbon": bench_ribbon,
+    "glb": bench_glb,
+    "imports": bench_imports,
+    "plot": bench_plot,
+    "raster": bench_raster,
+    "catalog": bench_catalog,
+    "aoi": bench_aoi,
+    "index": bench_index,
+    "terrain": bench_terrain,
+    "heights": bench_heights,
+    "cache": bench_cache,
+    "lod": bench_lod,
+}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmarks of map-to-3d optimizations")
+    parser.add_argument("name", choices=sorted(BENCHMARKS), help="benchmark to run")
+    parser.add_argument("--folder", default=path, help="folder of the osm samples")
+    parser.add_argument("--repeat", type=int, default=5, help="number of runs (best time is kept)")
+    args = parser.parse_args()
+
+    BENCHMARKS[args.name](osm_samples(args.folder), args.repeat)
@@ -0,0 +1,102 @@
+"""
+File: cache.py
+Author: TORREGROSSA Dylan
+Repository: https://github.com/P-Joss-P/map-to-3d.git
+License: GNU GENERAL PUBLIC LICENSE Version 3 (see LICENSE file)
+
+Description:
+    This file will allow users to keep on disk the filtered and centred GeoDataFrame made by
+    load_and_filter_osm, so that the next runs on the same osm file don't need to parse, reproject,
+    centre and classify it again.
+    The cache is content-addressed : the key is a hash of the osm file content, of the interest_types
+    list and of LOADER_VERSION (constant.py). Entries are stored as GeoParquet files.
+
+Usage:
+    - python main.py (with USE_CACHE = True in configuration.py)
+
+Dependencies:
+    - Python 3.13+
+    - library used : geopandas, hashlib, os, pyarrow
+
+Notes:
+    - When the folder is bigger than CACHE_MAX_SIZE, the least recently used entries are removed.
+
+"""
+
+# library import
+import hashlib
+import os
+import geopandas as gpd
+
+# function/variable import
+from configuration import CACHE_DIR, CACHE_MAX_SIZE
+from constant import LOADER_VERSION
+
+
+def cache_key(path, interest_types, *options):
+    """
+    Hash of the osm file content, of the interest_types list, of LOADER_VERSION and of any other
+    option changing the result of the loading.
+    """
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            h.update(chunk)
+
+    h.update("\0".join(interest_types).encode("utf-8"))
+    h.update(f"loader={LOADER_VERSION}".encode("utf-8"))
+    for option in options:
+        h.update(f"\0{option}".encode("utf-8"))
+    return h.hexdigest()
+
+
+def _entry_path(key, cache_dir=CACHE_DIR):
+    return os.path.join(cache_dir, f"{key}.parquet")
+
+
+def load_cached(key, cache_dir=CACHE_DIR):
+    """Read the GeoDataFrame of a cache entry, None if there is no entry for this key."""
+    entry = _entry_path(key, cache_dir)
+    if not os.path.exists(entry):
+        return None
+
+    try:
+        gdf = gpd.read_parquet(entry)
+    except Exception as e:      # damaged file or pyarrow not installed
+        print(f"Cache entry {entry} could not be read : {e}")
+        return None
+
+    os.utime(entry)     # last use, for the eviction
+    return gdf
+
+
+def save_cached(key, gdf, cache_dir=CACHE_DIR, max_size=CACHE_MAX_SIZE):
+    """Write gdf as the cache entry of key, then remove the oldest entries above max_size."""
+    os.makedirs(cache_dir, exist_ok=True)
+    entry = _entry_path(key, cache_dir)
+    tmp = entry + ".tmp"
+
+    try:
+        gdf.to_parquet(tmp)
+    except Exception as e:      # pyarrow not installed, or a column type that parquet refuses
+        print(f"Filtered data could not be cached : {e}")
+        if os.path.exists(tmp):
+            os.remove(tmp)
+        return None
+
+    os.replace(tmp, entry)      # never leave a half written entry
+    evict(cache_dir, max_size)
+    return entry
+
+
+def evict(cache_dir=CACHE_DIR, max_size=CACHE_MAX_SIZE):
+    """Remove the least recently used entries until the cache folder is smaller than max_size (bytes)."""
+    entries = [os.path.join(cache_dir, name) for name in os.listdir(cache_dir) if name.endswith(".parquet")]
+    entries.sort(key=os.path.getmtime)
+
+    total = sum(os.path.getsize(entry) for entry in entries)
+    for entry in entries[:-1]:      # the newest entry is always kept
+        if total <= max_size:
+            break
+        total -= os.path.getsize(entry)
+        os.remove(entry)
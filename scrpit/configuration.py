@@ -23,27 +23,101 @@ Dependencies:
 # library import
 import os
 
+# Root of the repository (the folder of scrpit), so the paths are the same on every computer and working directory
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
 # General settings path
-savepath = r"C:\data\Ecole\ENSE3\Cours\2A\Semestre1\Parcours_numerique\Projet_MapTo3D\map-to-3d\fichiers_osm\phase_de_developpement\filtered_data"
+savepath = os.path.join(REPO_DIR, "fichiers_osm", "phase_de_developpement", "filtered_data")
 FILTERED_DIR = os.path.join(savepath, "filtrered_data")
 
 
 # osm files path 
-path = r"C:\data\Ecole\ENSE3\Cours\2A\Semestre1\Parcours_numerique\Projet_MapTo3D\map-to-3d\fichiers_osm\phase_de_developpement"
+path = os.path.join(REPO_DIR, "fichiers_osm", "phase_de_developpement")
 Name_OSM_File = "echantillon_premiers_tests.osm"
 full_path = os.path.join(path, Name_OSM_File)
 
 # Ident_tags usefull paths
-Save_osm_to_csv_path = r"C:\data\Ecole\ENSE3\Cours\2A\Semestre1\Parcours_numerique\Projet_MapTo3D\map-to-3d\fichiers_osm\phase_de_developpement\csv_export"
+Save_osm_to_csv_path = os.path.join(path, "csv_export")
+CATALOG_WORKERS = None  # Processes counting the tags of the osm files of a folder (None : every core, 1 : no process pool)
 
 
 # Osm2plot usefull paths 
 Name_Fig_save_Folder = "Fig_save"
 save_folder_path = os.path.join(path, Name_Fig_save_Folder)
+PLOT_WORKERS = None     # Processes rendering the png file of every type (None : every core, 1 : no process pool)
 
 # Build_scene usefull paths 
-BASE_DIR = r"C:\data\Ecole\ENSE3\Cours\2A\Semestre1\Parcours_numerique\Projet_MapTo3D\map-to-3d\Config"
+BASE_DIR = os.path.join(REPO_DIR, "Config")
 DEFAULT_CONFIG = os.path.join(BASE_DIR, "mapping_entities.json")
+CENTER_STRATEGY = "bounds"  # Origin of the scene : "bounds", "area_weighted", "origin" or "union" (see functions.scene_origin)
+CENTER_ORIGIN = None        # (lon, lat) of the origin, used by CENTER_STRATEGY = "origin"
+STREAMING_LOAD = True   # Keep only interest_types elements while reading the osm file (osm_stream.py)
+BATCHED_SCENE = True    # One mesh per entity_type (True) or one node per feature (False)
+FLATTEN_EXPORT = True   # Merge the scene by entity_type and color before the glb export (scene_export.py)
+FEATURE_IDS = False     # Keep the feature of every vertex (_FEATURE_ID_0 attribute) for picking : 4 more bytes per vertex
+
+# Cache of the filtered data (cache.py)
+USE_CACHE = True
+CACHE_DIR = os.path.join(savepath, "cache")
+CACHE_MAX_SIZE = 2 * 1024**3    # Maximum size of the cache folder (bytes), the oldest entries are removed
+
+# Cache of the meshes of every feature (mesh_cache.py)
+USE_MESH_CACHE = True
+MESH_CACHE_DIR = os.path.join(savepath, "mesh_cache")
+
+# Levels of detail (lod.py) : tolerance of the simplification (m), polygons smaller than box_area (m²) become boxes,
+# join_style of the lines buffers, features lower than min_wall_height (m) keep only their top face,
+# step of the ground mesh (terrain_step, m). The far levels can also remove the entity_types of drop_types and
+# the polygons / lines smaller than min_area (m²) / min_length (m), and turn all the polygons of box_types in boxes
+EXPORT_LOD = False
+LOD_DIR = os.path.join(savepath, "lod")
+LOD_LEVELS = [
+    {"name": "lod0", "tolerance": 0.0, "box_area": 0.0},
+    {"name": "lod1", "tolerance": 2.0, "box_area": 50.0, "join_style": "mitre", "terrain_step": 20.0},
+    {"name": "lod2", "tolerance": 8.0, "box_area": 400.0, "join_style": "mitre", "min_wall_height": 1.0,
+     "terrain_step": 50.0},
+    {"name": "lod3", "tolerance": 15.0, "box_types": ["building"], "drop_types": ["barrier", "electrified"],
+     "min_area": 150.0, "min_length": 100.0, "join_style": "mitre", "min_wall_height": 1.0, "terrain_step": 100.0},
+]
+
+# Tiled scene usefull settings (tiling.py)
+TILED_SCENE = False     # Build the scene tile by tile in a process pool
+TILE_SIZE = 500.0       # Size of a square tile (m)
+TILE_WORKERS = None     # Number of processes (None : every core)
+SPLIT_TILES = False     # One GLB per tile + manifest.json (True) or a single merged GLB (False)
+TILES_DIR = os.path.join(savepath, "tiles")
+
+# Streamed glb export (glb_writer.py) : the scene is built tile by tile (TILE_SIZE, TILE_WORKERS) and every tile
+# is written on disk as soon as it is built, so the whole scene is never in memory (no preview window)
+STREAMING_EXPORT = False
+
+# Compact glb export (glb_writer.py) : positions quantized in 16 bits integers local to every mesh
+# (KHR_mesh_quantization), one material per color instead of the vertex colors, 16 bits indices when possible.
+# Smaller files (4 to 5 times), not a faster load (see the notes of glb_writer.py)
+COMPACT_EXPORT = False
+QUANTIZATION_STEP = 0.05    # Coarsest step of the quantized positions (m), larger meshes keep float positions
+REORDER_MESHES = True       # Reorder triangles and vertices for locality (GPU caches, later compression)
+
+# Area of interest (aoi.py) : only the features intersecting the area are meshed
+AREA_OF_INTEREST = None     # None (whole file), (minx, miny, maxx, maxy) bbox or path of a vector file (GeoJSON...)
+AREA_CRS = "lonlat"         # crs of the bbox : "lonlat", "projected" (UTM metres), "scene" (centred metres) or "EPSG:..."
+AREA_BUFFER = 0.0           # Buffer around the area (m), e.g. half the width of a corridor around a line
+AREA_CLIP = True            # Clip the features to the area (True) or keep the intersecting features whole (False)
+
+# Tiled index on disk of an osm extract (spatial_index.py) : one GeoParquet file per tile, read by the queries
+INDEX_DIR = os.path.join(savepath, "index")
+INDEX_TILE_SIZE = 1000.0    # Size of a square tile of the index (m)
+INDEX_TILES_DIR = os.path.join(savepath, "index_tiles")     # One glb per tile of the index, patched by the update command
+
+# Heights of the features (heights.py)
+STOREY_HEIGHT = 3.0         # Height of a storey (m) : building:levels × STOREY_HEIGHT when no height tag is given
+
+# Terrain (terrain.py) : the scene is draped on a local DEM (GeoTIFF or ESRI ASCII grid) with a ground mesh
+DEM_PATH = None             # None (flat scene) or path of the DEM file
+DEM_CRS = None              # crs of the DEM when its file doesn't give it (None : crs of the file, else of the scene)
+DEM_CACHE_DIR = os.path.join(savepath, "dem_cache")     # ASCII grids converted in memory-mapped .npy files
+TERRAIN_STEP = 10.0         # Distance between the vertices of the ground mesh (m)
+TERRAIN_COLOR = [150, 140, 120, 255]
 
 
 
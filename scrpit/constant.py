@@ -23,4 +23,20 @@ Z_LAYERS = {
     "highway": 1.5,
     "railway": 2.0,
     "building": 0.0
-}
\ No newline at end of file
+}
+
+# Version of the loading/filtering steps (load_and_filter_osm). Increase it when they change
+# so that the cached filtered data (cache.py) made by the previous version are not used anymore.
+LOADER_VERSION = 1
+
+
+# Version of the triangulation (meshing.py). Increase it when it changes so that the cached
+# meshes (mesh_cache.py) made by the previous version are built again.
+MESHING_VERSION = 1
+
+# Size (m) of the cells in which a dissolved line network is cut before its triangulation (meshing.network_polygons)
+NETWORK_CELL_SIZE = 1000.0
+
+# Columns of the heights resolved once for the whole GeoDataFrame (heights.py), read by meshing.entity_arrays
+HEIGHT_COLUMN = "mesh_height"     # extruded height (m)
+BASE_COLUMN = "mesh_base"         # altitude of the bottom of the feature (m), min_height tag
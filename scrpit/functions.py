@@ -12,98 +12,61 @@ Usage:
 
 Dependencies:
     - Python 3.13+
-    - library used : genericpath, json, numpy, matplotlib, os, osmnx, shapely, trimesh
+    - library used : genericpath, geopandas, numpy, matplotlib, os, osmnx, pandas, shapely
 
 Notes:
-    - Add any implementation detail important for developers.
-    - Keep this section optional.
+    - matplotlib and osmnx are imported inside osm2plot and load_osm only (headless build, see main.py).
+    - build_scene and the mesh_from_* functions are in scene_builder.py (imported here for the old scripts) :
+      the scripts which only build scenes should import scene_builder, which doesn't load geopandas.
 
 """
 
 # library import
 from genericpath import exists
-import json
+import geopandas as gpd
 import numpy as np
-import matplotlib.cm as cm
-import matplotlib.colors as mcolors
-import matplotlib.patches as mpatches
-import matplotlib.pyplot as plt
 import os
-import osmnx as ox
-from shapely.geometry import LineString, MultiLineString, MultiPolygon, Polygon
-import trimesh
-from trimesh.creation import extrude_polygon
+import pandas as pd
+from shapely.geometry import Point
 
 # function/variable import
-from configuration import DEFAULT_CONFIG, FILTERED_DIR, interest_types
-from constant import Z_LAYERS
+from cache import cache_key, load_cached, save_cached
+from configuration import CACHE_DIR, FILTERED_DIR, STREAMING_LOAD, USE_CACHE, interest_types
+from configuration import CENTER_ORIGIN, CENTER_STRATEGY, PLOT_WORKERS
+from osm_stream import read_osm_filtered
+from scene_builder import build_scene, force_polygon, mesh_from_flat_surface, mesh_from_line, mesh_from_polygon
 
 
 ###########################
 ####### OSM to plot #######
 ###########################
 
-def osm2plot(gdf, interest_types, save_setting, save_folder_path, show_setting):
+def osm2plot(gdf, interest_types, save_setting, save_folder_path, show_setting, workers=PLOT_WORKERS):
 
     """
     This function will allow users to plot figures which will contain the extracted values of osm files. 
     The values which are print could be modified thank's to configuration.py files throught the list interest_types.
+    The png file of every type is rendered in a process pool of workers (see plotting.py), the combined plot
+    is shown if show_setting=True.
+    matplotlib is imported here only, so the 3D scene creation never loads it. Without show_setting, the
+    figures are matplotlib.figure.Figure objects saved without pyplot : the backend of the process is not
+    changed and no display is needed.
     """
+    if not save_setting and not show_setting:
+        return
 
-    nb_types = len(interest_types)
+    from plotting import combined_figure, render_layers
 
-    # Automaticly select nb_types colors thank's to matplotlib.colors methode
-    colormap = cm.get_cmap("jet", nb_types)
-    colors = [mcolors.to_hex(colormap(i)) for i in range(nb_types)]
-    legend_patches = []
-
-
-    # Each type plot 
-    for i in range(nb_types):
-        color = colors[i]
-        type_name = interest_types[i]
-
-        mask = gdf[type_name].notnull()
-        
-        if mask.any():
-            fig, ax = plt.subplots(figsize=(10, 10))
-            gdf[mask].plot(
-                ax = ax,
-                color=color
-            )
-        plt.title(type_name)
-        if save_setting == True:
-            if not exists(save_folder_path):
-                os.mkdir(save_folder_path)
-
-            fig.savefig(os.path.join(save_folder_path, type_name))
+    # Each type plot
+    if save_setting == True:
+        render_layers(gdf, interest_types, save_folder_path, workers)
 
     # Global plot
-    fig, ax = plt.subplots(figsize=(10, 10))
-
-    for i in range(nb_types):
-        color = colors[i]
-        type_name = interest_types[i]
-
-        mask = gdf[type_name].notnull()
-        
-        if mask.any():
-            gdf[mask].plot(
-                ax = ax,
-                color=color, 
-                label=type_name
-            )
-
-        legend_patches.append(mpatches.Patch(color=color, label=type_name))
-
-
-    ax.legend(handles=legend_patches, title="Categories",
-            loc="upper left", bbox_to_anchor=(1, 1))
-
-    plt.title("Final plot type colored")
-
-    fig = plt.figure()
-
+    if show_setting == True:
+        import matplotlib.pyplot as plt
+        fig = combined_figure(gdf, interest_types, plt.figure(figsize=(10, 10)))
+    else:
+        fig = combined_figure(gdf, interest_types)
 
     # Save plot as png files in save_folder_path folder
     if save_setting == True:
@@ -111,33 +74,75 @@ def osm2plot(gdf, interest_types, save_setting, save_folder_path, show_setting):
             os.mkdir(save_folder_path)
 
         fig.savefig(os.path.join(save_folder_path, "Final plot type colored"))
-    
+
     # Show condition
     if show_setting == True:
         plt.show()
+        plt.close(fig)
 
 
 ########################
-####### 3D scene #######
+####### OSM data #######
 ########################
 
-def load_and_filter_osm(path, save_filtered=True, filtered_path=None):
+def load_osm(path):
+    """
+    Parse an OSM/XML file only once thank's OSMnx lib.
+    The returned GeoDataFrame could be shared between osm2plot, tag_catalog (Ident_tag.py)
+    and load_and_filter_osm without reading the file again.
+    """
+    import osmnx as ox      # imported here only : osmnx imports matplotlib.pyplot (headless build, see main.py)
+
+    print("OSM file is loading...")
+    return ox.features_from_xml(path)
+
+
+def load_and_filter_osm(path, save_filtered=True, filtered_path=None, gdf=None, streaming=STREAMING_LOAD,
+                        use_cache=USE_CACHE, center_strategy=CENTER_STRATEGY, center_origin=CENTER_ORIGIN,
+                        cache_dir=CACHE_DIR):
     """
     Load an OSM/XML file thank's OSMnx lib, automaticly filtered the values  
     relative to interest_types list. 
     This function will also normalized tags in a single data field 'entity_type'.
+    If gdf is given (result of load_osm or read_osm_filtered), the file is not parsed again and gdf is not modified.
+    With streaming=True, the file is read by osm_stream.read_osm_filtered which keeps in memory
+    only the elements carrying an interest tag.
+    With use_cache=True, the result is kept in the cache folder cache_dir (cache.py) and read back from it as
+    long as the osm file and interest_types don't change.
+    The scene is centred following center_strategy (see scene_origin), the origin is kept in gdf.attrs["origin"].
     """
-
-    # Load osm file 
-    print("OSM file is loading...")
-    gdf = ox.features_from_xml(path)    
+    if filtered_path is None:
+        filtered_path = os.path.join(FILTERED_DIR, "filtered.geojson")
+
+    # Cached result of a previous run
+    key = None
+    if use_cache and gdf is None:
+        key = cache_key(path, interest_types, "streaming" if streaming else "osmnx", center_strategy, center_origin)
+        filtered = load_cached(key, cache_dir)
+        if filtered is not None:
+            print(f"Filtered data loaded from cache ({len(filtered)} elements)")
+            if save_filtered and not exists(filtered_path):
+                filtered.to_file(filtered_path, driver="GeoJSON")
+            return filtered
+
+    # Load osm file (only if it has not been loaded yet)
+    if gdf is None and streaming:
+        print("OSM file is streamed...")
+        gdf = read_osm_filtered(path, interest_types)
+    elif gdf is None:
+        gdf = load_osm(path)
 
 
     # Graphics settings    
-    gdf = gdf.to_crs(gdf.estimate_utm_crs())    # Convert to metrical units
+    if center_strategy == "origin" and center_origin is not None:
+        utm_crs = gpd.GeoSeries([Point(center_origin)], crs="EPSG:4326").estimate_utm_crs()   # same crs for every run
+    else:
+        utm_crs = gdf.estimate_utm_crs()
+    gdf = gdf.to_crs(utm_crs)    # Convert to metrical units
 
-    center = gdf.geometry.unary_union.centroid      #Center the scene
-    gdf["geometry"] = gdf.translate(xoff=-center.x, yoff=-center.y)
+    center_x, center_y = scene_origin(gdf, center_strategy, center_origin)     #Center the scene
+    gdf["geometry"] = gdf.translate(xoff=-center_x, yoff=-center_y)
+    gdf.attrs["origin"] = origin_record(gdf.crs, center_x, center_y, center_strategy)
 
     # Rescale (if desired)
     # scale = 0.1  # 1 Blender unit = 10 m
@@ -151,17 +156,7 @@ def load_and_filter_osm(path, save_filtered=True, filtered_path=None):
 
     print("Founded columns :", available_tags)
 
-    def detect_entity(row):
-        """
-        Creating a unique field : entity_type
-        """
-        for tag in available_tags:
-            val = row.get(tag, None)
-            if val is not None and val != "" and not (isinstance(val, float) and np.isnan(val)):
-                return tag
-        return None
-
-    gdf["entity_type"] = gdf.apply(detect_entity, axis=1)
+    gdf["entity_type"] = detect_entity_types(gdf, available_tags)
 
     # Filter only those for which a type has been identified
     filtered = gdf[gdf["entity_type"].notnull()].copy()
@@ -169,135 +164,71 @@ def load_and_filter_osm(path, save_filtered=True, filtered_path=None):
 
     # Option : Save cleaned file
     if save_filtered:
-        if filtered_path is None:
-            filtered_path = os.path.join(FILTERED_DIR, "filtered.geojson")
         print(f"Cleaned file has been saved → {filtered_path}")
         filtered.to_file(filtered_path, driver="GeoJSON")
 
+    if key is not None:
+        save_cached(key, filtered, cache_dir)
+
     return filtered
 
 
-def build_scene(gdf, config_path=DEFAULT_CONFIG):
+def scene_origin(gdf, strategy=CENTER_STRATEGY, origin=None):
     """
-    Build a 3D scene from a GeoDataFrame already filtered and which contain 
-    'entity_type' columns.
+    Origin (x, y) of the scene in the projected crs of gdf :
+        - "bounds" : centre of the total bounds (default, linear in the number of features)
+        - "area_weighted" : mean of the centroids of every geometry weighted by their area
+        - "origin" : origin given as (lon, lat), so that several runs share the same origin
+        - "union" : centroid of the union of every geometry (previous behaviour, slow on dense data)
     """
+    if strategy == "bounds":
+        minx, miny, maxx, maxy = gdf.total_bounds
+        return (minx + maxx) / 2, (miny + maxy) / 2
+
+    if strategy == "area_weighted":
+        centroids = gdf.geometry.centroid
+        weights = gdf.geometry.area.to_numpy()
+        if weights.sum() == 0:      # only points and lines
+            weights = np.ones(len(gdf))
+        return np.average(centroids.x, weights=weights), np.average(centroids.y, weights=weights)
+
+    if strategy == "origin":
+        if origin is None:
+            raise ValueError("center_strategy 'origin' needs CENTER_ORIGIN = (lon, lat) in configuration.py")
+        point = gpd.GeoSeries([Point(origin)], crs="EPSG:4326").to_crs(gdf.crs).iloc[0]
+        return point.x, point.y
+
+    if strategy == "union":
+        center = gdf.geometry.union_all().centroid
+        return center.x, center.y
+
+    raise ValueError(f"Unknown center_strategy '{strategy}'")
+
+
+def origin_record(crs, x, y, strategy):
+    """Origin of the scene as saved with the outputs (filtered data, glb, tiles manifest)."""
+    lonlat = gpd.GeoSeries([Point(x, y)], crs=crs).to_crs("EPSG:4326").iloc[0]
+    return {
+        "strategy": strategy,
+        "crs": crs.to_string(),
+        "x": float(x),
+        "y": float(y),
+        "lon": float(lonlat.x),
+        "lat": float(lonlat.y),
+    }
+
+
+def detect_entity_types(gdf, available_tags):
+    """
+    Creating a unique field : entity_type.
+    The entity_type of a row is the first tag of available_tags (priority order) which has a value
+    (not None, NaN or ""). The detection is done on the whole columns at once.
+    """
+    values = gdf[available_tags]
+    present = (values.notna() & values.ne("")).to_numpy(dtype=bool, na_value=False)
 
-    # Load and read json file
-    with open(config_path, "r", encoding="utf-8") as f:
-        rules = json.load(f)    
-
-    # Variable and scene initialization 
-    scene = trimesh.Scene()
-    counter = 0
-
-    for idx, row in gdf.iterrows():
-        typ = row["entity_type"]
-        geom = row.geometry
-
-        # Select only types which are in json file
-        if typ not in rules:
-            continue
-
-        rule = rules[typ]
-        color_3Dobject = rule["color"]
-
-        mesh_type = rule.get("mesh_type", "extrusion")
-
-        z_offset = 0 # default value
-        z_offset = Z_LAYERS.get(typ, 0.0) # values taken in constant.py file
-
-
-        try:
-            if mesh_type == "extrusion":
-                if not isinstance(geom, (Polygon, MultiPolygon)):
-                    continue
-                # priority height : The value of the tag indicated in rules
-
-                height_tag = rule.get("height_from_tag", None)
-                if height_tag and height_tag in row and row.get(height_tag) not in [None, "", float("nan")]:
-                    h = float(row[height_tag])
-                else:
-                    h = float(rule.get("default_height", 5.0))
-                mesh = mesh_from_polygon(geom, height=h, color=tuple(rule.get("color")))
-
-            elif mesh_type == "extrusion_line":
-                if not isinstance(geom, (LineString, MultiLineString)):
-                    continue
-                w = float(rule.get("width", 3.0))
-                h = float(rule.get("height", 0.1))
-                mesh = mesh_from_line(geom, width=w, height=h, color=tuple(rule.get("color")))
-
-            elif mesh_type == "flat":
-                if not isinstance(geom, (Polygon, MultiPolygon)):
-                    continue
-                mesh = mesh_from_flat_surface(geom, color=tuple(rule.get("color")))
-
-            else:
-                print(f"Unknown mesh_type '{mesh_type}' for type '{typ}' — skipping")
-                continue
-            
-            # Secure the export 
-            mesh.apply_translation([0, 0, z_offset])
-            mesh.apply_transform(trimesh.transformations.identity_matrix())
-
-            scene.add_geometry(mesh, node_name=f"{typ}_{counter}")
-            counter += 1
-
-        except Exception as e:
-            print(f"Error creating mesh for {typ} (index OSM {idx} (index {counter})) : {e}")
-            print("mesh_type =", mesh_type)
-            print("geom type =", geom.geom_type)
-            print("rule =", rule)
-            continue
-
-    return scene
-
-
-def mesh_from_polygon(poly, height, color):
-    """This function will create a new mesh for a polygon type osm object."""
-    meshes = []
-
-    if isinstance(poly, MultiPolygon):
-        for p in poly.geoms:
-            meshes.append(mesh_from_polygon(p, height, color))
-        return trimesh.util.concatenate(meshes)
-
-    mesh = extrude_polygon(poly, height=height)     # Extrude the geometry of a given height
-
-    # Color the vertex of the mesh
-    n_vertices = mesh.vertices.shape[0]
-    mesh.visual.vertex_colors = np.tile(np.array(color, dtype=np.uint8), (n_vertices, 1))
-    return mesh
-
-def mesh_from_line(line:LineString, width:float, height:float, color=[255, 255, 0, 255]):
-    """Extrude line to small prism"""
-    if line.is_empty:
-        raise ValueError("Empty LineString")
-
-    poly = line.buffer(width / 2, cap_style=2)
-
-    if poly.is_empty:
-        raise ValueError("Buffer resulted in empty geometry")
-
-    if not isinstance(poly, (Polygon, MultiPolygon)):
-        raise TypeError(f"Buffered line produced {poly.geom_type}")
-
-    return mesh_from_polygon(poly, height, color=color)
-
-def mesh_from_flat_surface(poly:Polygon, color=[100, 100, 255, 150]):
-    """Extrude Flat mesh from z = 0"""
-    height = 0.1 # default heignt for flat surface
-    poly = force_polygon(poly)
-    if poly is None:
-        raise ValueError("Geometry is not a polygon")
-
-    return mesh_from_polygon(poly, height, color=color)
+    first = present.argmax(axis=1)      # first tag with a value, in priority order
+    entity = np.array(available_tags, dtype=object)[first]
+    entity[~present.any(axis=1)] = None
 
-def force_polygon(geom):
-    if isinstance(geom, Polygon):
-        return geom
-    elif isinstance(geom, MultiPolygon):
-        return max(geom.geoms, key=lambda g: g.area)
-    else:
-        return None
\ No newline at end of file
+    return pd.Series(entity, index=gdf.index, dtype=object)
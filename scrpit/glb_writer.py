@@ -0,0 +1,400 @@
+"""
+File: glb_writer.py
+Author: TORREGROSSA Dylan
+Repository: https://github.com/P-Joss-P/map-to-3d.git
+License: GNU GENERAL PUBLIC LICENSE Version 3 (see LICENSE file)
+
+Description:
+    This file will allow users to export a large area in a glb file without keeping the whole scene in memory.
+    The meshes are written one by one : their vertex, color, feature id and index arrays are appended to a
+    temporary binary file as soon as they are built, and only their glTF description (accessors, buffer views,
+    meshes, nodes) is kept. The JSON chunk is written at the end, followed by a copy of the binary file.
+    tiling.stream_scene builds the scene tile by tile and writes every tile as soon as it is ready,
+    so the peak memory depends on the tile size and not on the size of the area.
+
+Usage:
+    - python main.py (with STREAMING_EXPORT = True in configuration.py)
+
+Dependencies:
+    - Python 3.13+
+    - library used : json, numpy, os, shutil, struct
+
+Notes:
+    - The glb file has the same layout as the trimesh export : POSITION, COLOR_0 and _FEATURE_ID_0 attributes,
+      uint32 indices, entity_type in the extras of every mesh and the scene metadata in the scene extras.
+    - The coordinates are written as they are (Z up), like scene.export does.
+    - A mesh too large for a quantization step of QUANTIZATION_STEP is split in chunks of about 65536 steps,
+      a chunk which is still too large (huge triangles) keeps float positions.
+    - The benefit of the compact mode is the size of the file (4 to 5 times smaller on the samples, so a shorter
+      download) and of the vertex buffers. It doesn't load faster : the "glb" benchmark measures the trimesh
+      load time from 0.6x to 1.3x of the trimesh export, and no viewer side gain was measured.
+    - The reordering is the preprocessing of meshopt (triangles sorted along a Morton curve, vertices in order
+      of first use) : it helps the GPU caches and any later compression, but no EXT_meshopt_compression
+      encoding is done here.
+
+"""
+
+# library import
+import json
+import os
+import shutil
+import struct
+import numpy as np
+
+# function/variable import
+from configuration import COMPACT_EXPORT, FEATURE_IDS, QUANTIZATION_STEP, REORDER_MESHES
+
+
+GLB_MAGIC = 0x46546C67        # "glTF"
+CHUNK_JSON = 0x4E4F534A       # "JSON"
+CHUNK_BIN = 0x004E4942        # "BIN\0"
+COPY_SIZE = 16 * 1024 * 1024   # size of the blocks of the binary copy
+
+
+####### Writer #######
+
+def open_glb(path, compact=COMPACT_EXPORT):
+    """
+    Start a streamed glb file : returns the writer (a dict) given to add_mesh and close_glb.
+    compact=True writes quantized positions, materials and 16 bits indices.
+    """
+    folder = os.path.dirname(path)
+    if folder:
+        os.makedirs(folder, exist_ok=True)
+
+    return {
+        "path": path,
+        "bin_path": path + ".bin.tmp",
+        "bin": open(path + ".bin.tmp", "wb"),
+        "offset": 0,
+        "compact": compact,
+        "materials": {},
+        "gltf": {
+            "scene": 0,
+            "scenes": [{"nodes": []}],
+            "asset": {"version": "2.0", "generator": "map-to-3d"},
+            "accessors": [],
+            "meshes": [],
+            "nodes": [],
+            "buffers": [],
+            "bufferViews": [],
+        },
+    }
+
+
+def _append(writer, array, accessor, stride=None):
+    """
+    Append array to the binary file (4 bytes aligned), then add its buffer view and its accessor.
+    stride is the byteStride of the buffer view (vertex attributes whose elements are not 4 bytes aligned).
+    """
+    data = np.ascontiguousarray(array).tobytes()
+    writer["bin"].write(data)
+    padding = -len(data) % 4
+    writer["bin"].write(b"\0" * padding)
+
+    gltf = writer["gltf"]
+    view = {"buffer": 0, "byteOffset": writer["offset"], "byteLength": len(data)}
+    if stride is not None:
+        view["byteStride"] = stride
+    gltf["bufferViews"].append(view)
+    writer["offset"] += len(data) + padding
+
+    gltf["accessors"].append({**accessor, "bufferView": len(gltf["bufferViews"]) - 1, "count": len(array)})
+    return len(gltf["accessors"]) - 1
+
+
+def add_mesh(writer, name, vertices, faces, colors=None, feature_ids=None, extras=None):
+    """
+    Write one mesh (and its node) in the glb file.
+    colors is an (n, 4) uint8 array of vertex colors, feature_ids the _FEATURE_ID_0 of every vertex.
+    """
+    if len(faces) == 0:
+        return None
+    if writer["compact"]:
+        return _add_compact_mesh(writer, name, vertices, faces, colors, feature_ids, extras)
+
+    vertices = np.asarray(vertices, dtype=np.float32)
+    faces = np.asarray(faces, dtype=np.uint32).ravel()
+
+    primitive = {"attributes": {}, "mode": 4}
+    primitive["indices"] = _append(writer, faces, {
+        "componentType": 5125, "type": "SCALAR", "max": [int(faces.max())], "min": [int(faces.min())]})
+    primitive["attributes"]["POSITION"] = _append(writer, vertices, {
+        "componentType": 5126, "type": "VEC3",
+        "max": vertices.max(axis=0).tolist(), "min": vertices.min(axis=0).tolist()})
+
+    if colors is not None:
+        colors = np.asarray(colors, dtype=np.uint8)
+        primitive["attributes"]["COLOR_0"] = _append(writer, colors, {
+            "componentType": 5121, "normalized": True, "type": "VEC4",
+            "max": colors.max(axis=0).tolist(), "min": colors.min(axis=0).tolist()})
+
+    if feature_ids is not None:
+        feature_ids = np.asarray(feature_ids, dtype=np.float32)
+        primitive["attributes"]["_FEATURE_ID_0"] = _append(writer, feature_ids, {
+            "componentType": 5126, "type": "SCALAR",
+            "max": [float(feature_ids.max())], "min": [float(feature_ids.min())]})
+
+    gltf = writer["gltf"]
+    mesh = {"name": name, "primitives": [primitive]}
+    if extras:
+        mesh["extras"] = extras
+    gltf["meshes"].append(mesh)
+    gltf["nodes"].append({"name": name, "mesh": len(gltf["meshes"]) - 1})
+    gltf["scenes"][0]["nodes"].append(len(gltf["nodes"]) - 1)
+    return len(gltf["nodes"]) - 1
+
+
+def add_trimesh(writer, name, mesh, feature_ids=FEATURE_IDS):
+    """add_mesh for a trimesh.Trimesh of the batched builder (vertex colors, _FEATURE_ID_0, entity_type)."""
+    ids = mesh.vertex_attributes.get("_FEATURE_ID_0") if feature_ids else None
+    typ = mesh.metadata.get("entity_type")
+    return add_mesh(writer, name, mesh.vertices, mesh.faces, mesh.visual.vertex_colors, ids,
+                    {"entity_type": typ} if typ is not None else None)
+
+
+def close_glb(writer, extras=None):
+    """
+    Write the glb file : header, JSON chunk, then the binary chunk copied block by block
+    from the temporary file, which is removed. extras goes in the extras of the scene.
+    """
+    writer["bin"].close()
+    gltf = writer["gltf"]
+    if extras:
+        gltf["scenes"][0]["extras"] = extras
+    if writer["offset"]:
+        gltf["buffers"].append({"byteLength": writer["offset"]})
+    else:
+        del gltf["buffers"], gltf["bufferViews"], gltf["accessors"]
+
+    content = json.dumps(gltf, separators=(",", ":")).encode("utf-8")
+    content += b" " * (-len(content) % 4)
+
+    length = 12 + 8 + len(content) + (8 + writer["offset"] if writer["offset"] else 0)
+    with open(writer["path"], "wb") as f:
+        f.write(struct.pack("<III", GLB_MAGIC, 2, length))
+        f.write(struct.pack("<II", len(content), CHUNK_JSON))
+        f.write(content)
+        if writer["offset"]:
+            f.write(struct.pack("<II", writer["offset"], CHUNK_BIN))
+            with open(writer["bin_path"], "rb") as binary:
+                shutil.copyfileobj(binary, f, COPY_SIZE)
+
+    os.remove(writer["bin_path"])
+    return writer["path"]
+
+
+def abort_glb(writer):
+    """Close and remove the temporary binary file of a glb whose writing failed."""
+    writer["bin"].close()
+    if os.path.exists(writer["bin_path"]):
+        os.remove(writer["bin_path"])
+
+
+####### Compact meshes #######
+
+def locality_order(vertices, faces):
+    """
+    Reorder the triangles along a Morton curve of their centroids, then the vertices in their order of first use.
+    Returns the new faces, the position of every new vertex in the old vertices (unused vertices are dropped)
+    and the position of every new face in the old faces.
+    """
+    centroids = vertices[faces].mean(axis=1)
+    low, extent = centroids.min(axis=0), np.ptp(centroids, axis=0)
+    cells = (centroids - low) / np.where(extent > 0, extent, 1.0) * 1023
+    cells = cells.astype(np.uint64)
+
+    # Interleave the 10 bits of x, y and z
+    code = np.zeros(len(faces), dtype=np.uint64)
+    for bit in range(10):
+        for axis in range(3):
+            code |= ((cells[:, axis] >> np.uint64(bit)) & np.uint64(1)) << np.uint64(3 * bit + axis)
+    face_order = np.argsort(code, kind="stable")
+    faces = faces[face_order]
+
+    used, first = np.unique(faces.ravel(), return_index=True)
+    vertex_order = used[np.argsort(first)]
+    new_position = np.empty(len(vertices), dtype=np.int64)
+    new_position[vertex_order] = np.arange(len(vertex_order))
+    return new_position[faces], vertex_order, face_order
+
+
+def quantize_positions(vertices, step=QUANTIZATION_STEP):
+    """
+    Positions as uint16 integers local to the bounds of the mesh, with the translation and scale of their node.
+    None when the extent of the mesh needs a coarser step than step (m).
+    """
+    low = vertices.min(axis=0)
+    extent = vertices.max(axis=0) - low
+    if extent.max() / 65535 > step:
+        return None
+
+    scale = np.where(extent > 0, extent / 65535, 1.0)
+    quantized = np.zeros((len(vertices), 4), dtype=np.uint16)      # padded to 8 bytes per vertex
+    quantized[:, :3] = np.round((vertices - low) / scale)
+    return quantized, low, scale
+
+
+def _material(writer, color):
+    """Index of the material of a color (RGBA uint8), created the first time it is used."""
+    color = tuple(int(c) for c in color)
+    if color not in writer["materials"]:
+        material = {
+            "pbrMetallicRoughness": {
+                "baseColorFactor": [c / 255 for c in color],
+                "metallicFactor": 0.0,
+                "roughnessFactor": 1.0,
+            },
+        }
+        if color[3] < 255:
+            material["alphaMode"] = "BLEND"
+        writer["gltf"].setdefault("materials", []).append(material)
+        writer["materials"][color] = len(writer["gltf"]["materials"]) - 1
+    return writer["materials"][color]
+
+
+def _add_compact_mesh(writer, name, vertices, faces, colors, feature_ids, extras):
+    """
+    add_mesh of the compact mode. A mesh too large for QUANTIZATION_STEP is split in square chunks
+    (by the centroid of its triangles), every chunk having its own node and its own local integer positions.
+    """
+    vertices = np.asarray(vertices, dtype=np.float64)
+    faces = np.asarray(faces, dtype=np.int64)
+
+    # Half of the quantized extent : the triangles overlapping the border of a chunk still fit
+    size = 65535 * QUANTIZATION_STEP / 2
+    if np.ptp(vertices, axis=0).max() <= 2 * size:
+        chunks = [faces]
+    else:
+        centroids = vertices[faces].mean(axis=1)[:, :2]
+        cells = np.floor((centroids - centroids.min(axis=0)) / size).astype(np.int64)
+        key = cells[:, 0] * (cells[:, 1].max() + 1) + cells[:, 1]
+        order = np.argsort(key, kind="stable")
+        chunks = np.split(faces[order], np.flatnonzero(np.diff(key[order])) + 1)
+
+    node = None
+    for k, chunk in enumerate(chunks):
+        used, local = np.unique(chunk, return_inverse=True)
+        node = _add_compact_part(
+            writer, name if len(chunks) == 1 else f"{name}_{k}",
+            vertices[used], local.reshape(-1, 3),
+            np.asarray(colors)[used] if colors is not None else None,
+            np.asarray(feature_ids)[used] if feature_ids is not None else None,
+            extras)
+    return node
+
+
+def merge_vertices(faces, *columns):
+    """
+    Merge the vertices whose values are equal in every column (arrays of n rows), keeping their order of first use.
+    Returns the new faces without the degenerated triangles, and the position of every kept vertex.
+    """
+    n = len(columns[0])
+    rows = np.concatenate([np.ascontiguousarray(c).view(np.uint8).reshape(n, -1) for c in columns], axis=1)
+    rows = np.ascontiguousarray(rows).view(f"V{rows.shape[1]}").ravel()
+    _, first, inverse = np.unique(rows, return_index=True, return_inverse=True)
+
+    rank = np.empty(len(first), dtype=np.int64)
+    rank[np.argsort(first)] = np.arange(len(first))
+    faces = rank[inverse.ravel()][faces]
+    valid = (faces[:, 0] != faces[:, 1]) & (faces[:, 1] != faces[:, 2]) & (faces[:, 0] != faces[:, 2])
+    return faces[valid], np.sort(first), valid
+
+
+def _add_compact_part(writer, name, vertices, faces, colors, feature_ids, extras):
+    """
+    One node of the compact mode : quantized vertices, merged when they are equal (the file has no normals,
+    the viewers compute flat normals), and one primitive per color sharing these vertices.
+    """
+    gltf = writer["gltf"]
+    node = {"name": name}
+    attributes = {}
+
+    # The color of a face is the color of its first vertex
+    face_colors = np.asarray(colors, dtype=np.uint8)[faces[:, 0]] if colors is not None else None
+
+    quantized = quantize_positions(vertices)
+    if quantized is not None:
+        positions, translation, scale = quantized
+        node["translation"] = translation.tolist()
+        node["scale"] = scale.tolist()
+    else:
+        print(f"Mesh {name} is too large to be quantized with a step of {QUANTIZATION_STEP} m : float positions")
+        positions = vertices.astype(np.float32)
+
+    columns = [positions] if feature_ids is None else [positions, np.asarray(feature_ids, dtype=np.float32)]
+    faces, kept, valid = merge_vertices(faces, *columns)
+    positions = positions[kept]
+    feature_ids = columns[1][kept] if feature_ids is not None else None
+    face_colors = face_colors[valid] if face_colors is not None else None
+    if len(faces) == 0:
+        return None
+
+    if REORDER_MESHES:
+        faces, vertex_order, face_order = locality_order(positions[:, :3].astype(np.float64), faces)
+        positions = positions[vertex_order]
+        feature_ids = feature_ids[vertex_order] if feature_ids is not None else None
+        face_colors = face_colors[face_order] if face_colors is not None else None
+
+    if quantized is not None:
+        attributes["POSITION"] = _append(writer, positions, {
+            "componentType": 5123, "type": "VEC3",
+            "max": positions[:, :3].max(axis=0).tolist(), "min": positions[:, :3].min(axis=0).tolist()}, stride=8)
+        for key in ("extensionsUsed", "extensionsRequired"):
+            if "KHR_mesh_quantization" not in gltf.setdefault(key, []):
+                gltf[key].append("KHR_mesh_quantization")
+    else:
+        attributes["POSITION"] = _append(writer, positions, {
+            "componentType": 5126, "type": "VEC3",
+            "max": positions.max(axis=0).tolist(), "min": positions.min(axis=0).tolist()})
+
+    if feature_ids is not None:
+        attributes["_FEATURE_ID_0"] = _append(writer, feature_ids, {
+            "componentType": 5126, "type": "SCALAR",
+            "max": [float(feature_ids.max())], "min": [float(feature_ids.min())]})
+
+    # One primitive (and material) per color
+    if face_colors is not None:
+        palette, face_material = np.unique(face_colors, axis=0, return_inverse=True)
+    else:
+        palette, face_material = [None], np.zeros(len(faces), dtype=np.int64)
+
+    index_type, component = (np.uint16, 5123) if len(positions) < 65536 else (np.uint32, 5125)
+    primitives = []
+    for k, color in enumerate(palette):
+        indices = faces[face_material.ravel() == k].ravel().astype(index_type)
+        primitive = {"attributes": attributes, "mode": 4}
+        primitive["indices"] = _append(writer, indices, {
+            "componentType": component, "type": "SCALAR",
+            "max": [int(indices.max())], "min": [int(indices.min())]})
+        if color is not None:
+            primitive["material"] = _material(writer, color)
+        primitives.append(primitive)
+
+    mesh = {"name": name, "primitives": primitives}
+    if extras:
+        mesh["extras"] = extras
+    gltf["meshes"].append(mesh)
+    node["mesh"] = len(gltf["meshes"]) - 1
+    gltf["nodes"].append(node)
+    gltf["scenes"][0]["nodes"].append(len(gltf["nodes"]) - 1)
+    return len(gltf["nodes"]) - 1
+
+
+####### Whole scene #######
+
+def write_scene(scene, path, compact=COMPACT_EXPORT, feature_ids=FEATURE_IDS):
+    """Write a trimesh.Scene (node transforms applied) with the writer, the scene metadata in the scene extras."""
+    writer = open_glb(path, compact)
+    try:
+        for node in scene.graph.nodes_geometry:
+            transform, geom_name = scene.graph[node]
+            mesh = scene.geometry[geom_name]
+            if not np.allclose(transform, np.eye(4)):
+                mesh = mesh.copy()
+                mesh.apply_transform(transform)
+            add_trimesh(writer, node, mesh, feature_ids)
+        return close_glb(writer, dict(scene.metadata))
+    except BaseException:
+        abort_glb(writer)
+        raise
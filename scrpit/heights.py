@@ -0,0 +1,160 @@
+"""
+File: heights.py
+Author: TORREGROSSA Dylan
+Repository: https://github.com/P-Joss-P/map-to-3d.git
+License: GNU GENERAL PUBLIC LICENSE Version 3 (see LICENSE file)
+
+Description:
+    This file will allow users to give a height to every feature once for the whole GeoDataFrame, instead of
+    reading a single tag row by row while meshing :
+        - the tags are parsed as lengths with vectorized string functions : "12", "12.5 m", "12,5", "40 ft",
+          "12'6\"", "3;4" (list of values : the highest one)
+        - top of the feature : height_from_tag of its rule, then height, building:height, then
+          building:levels × STOREY_HEIGHT
+        - base of the feature : min_height, then building:min_level × STOREY_HEIGHT
+        - the features without a readable value get the default of their rule in mapping_entities.json
+    The result is two numeric columns (HEIGHT_COLUMN = extruded height, BASE_COLUMN = altitude of its bottom)
+    read by the batched builder (meshing.entity_arrays).
+
+Usage:
+    - resolve_heights(gdf, load_rules(config_path))       (done by build_scene, the tiles and the lods)
+
+Dependencies:
+    - Python 3.13+
+    - library used : numpy
+
+Notes:
+    - Only the rules with "height_from_tag" read the tags, the others always get their default height.
+    - Default height : "default_height" of the rule for an extrusion (5 m if missing), "default_height" or
+      "height" (0.1 m) for an extrusion_line, 0.1 m for a flat surface.
+    - A top lower than the base (or a null height) is not readable : the default height is put on the base.
+
+"""
+
+# library import
+import numpy as np
+
+# function/variable import
+from configuration import STOREY_HEIGHT
+from constant import BASE_COLUMN, HEIGHT_COLUMN
+
+
+# Lengths : number (decimal point or comma), unit, and optional inches after feet (12'6")
+LENGTH_PATTERN = (r"^(?P<value>\d+(?:[.,]\d+)?|[.,]\d+)\s*(?P<unit>m|metres?|meters?|cm|mm|km|ft|feet|foot|')?"
+                  r"\s*(?:(?P<inches>\d+(?:[.,]\d+)?)\s*(?:\"|in|inch|inches))?$")
+UNITS = {"": 1.0, "m": 1.0, "metre": 1.0, "metres": 1.0, "meter": 1.0, "meters": 1.0, "cm": 0.01, "mm": 0.001,
+         "km": 1000.0, "ft": 0.3048, "feet": 0.3048, "foot": 0.3048, "'": 0.3048}
+
+
+def parse_lengths(values):
+    """
+    Lengths in metres of a Series of tag values (NaN when the value is missing or not readable).
+    A list of values ("3;4") gives the highest one.
+    """
+    text = values.dropna().astype(str).str.strip().str.lower()
+    parts = text.str.split(";").explode().str.strip()
+
+    found = parts.str.extract(LENGTH_PATTERN)
+    number = found["value"].str.replace(",", ".").astype(float)
+    inches = found["inches"].str.replace(",", ".").astype(float).fillna(0.0).to_numpy() * 0.0254
+    factor = found["unit"].fillna("").map(UNITS).astype(float).to_numpy()
+    metres = number.to_numpy(dtype=np.float64) * factor + inches
+
+    # Highest value of every list, back to the rows of values
+    owner = np.repeat(np.arange(len(text)), text.str.count(";").to_numpy() + 1)
+    highest = np.full(len(text), np.nan)
+    valid = np.isfinite(metres)
+    np.fmax.at(highest, owner[valid], metres[valid])
+
+    lengths = np.full(len(values), np.nan)
+    lengths[values.notna().to_numpy()] = highest
+    return lengths
+
+
+def default_height(rule):
+    """Height of the features of rule without a readable tag."""
+    mesh_type = rule.get("mesh_type", "extrusion")
+    if mesh_type == "extrusion":
+        return float(rule.get("default_height", 5.0))
+    if mesh_type == "extrusion_line":
+        return float(rule.get("default_height", rule.get("height", 0.1)))
+    return 0.1
+
+
+def _first_length(group, tags, factor=1.0):
+    """First readable length of tags (in this order) for every row of group, and the tag it comes from (-1 : none)."""
+    lengths = np.full(len(group), np.nan)
+    source = np.full(len(group), -1)
+    for k, tag in enumerate(tags):
+        if tag not in group.columns:
+            continue
+        missing = np.isnan(lengths)
+        if not missing.any():
+            break
+        values = parse_lengths(group[tag]) * factor
+        fill = missing & np.isfinite(values)
+        lengths[fill] = values[fill]
+        source[fill] = k
+    return lengths, source
+
+
+def feature_heights(group, rule, storey_height=STOREY_HEIGHT):
+    """
+    (heights, bases) of the features of group (all of the entity_type of rule), and the counts of the sources
+    {"tags", "levels", "default", "unreadable"}.
+    """
+    default = default_height(rule)
+    tag = rule.get("height_from_tag", None)
+    if not tag:
+        return np.full(len(group), default), np.zeros(len(group)), {"default": len(group)}
+
+    tags = list(dict.fromkeys([tag, "height", "building:height"]))
+    top, source = _first_length(group, tags)
+    levels, _ = _first_length(group, ["building:levels"], storey_height)
+    from_levels = np.isnan(top) & np.isfinite(levels)
+    top[from_levels] = levels[from_levels]
+
+    base, _ = _first_length(group, ["min_height"])
+    min_levels, _ = _first_length(group, ["building:min_level"], storey_height)
+    base = np.where(np.isnan(base), min_levels, base)
+    base = np.nan_to_num(base, nan=0.0)
+
+    # Tag given but not readable (or top under the base) : default height on the base
+    tagged = np.zeros(len(group), dtype=bool)
+    for name in [*tags, "building:levels"]:
+        if name in group.columns:
+            tagged |= group[name].notna().to_numpy()
+    heights = top - base
+    readable = np.isfinite(heights) & (heights > 0)
+    heights[~readable] = default
+
+    counts = {
+        "tags": int((readable & (source >= 0)).sum()),
+        "levels": int((readable & from_levels).sum()),
+        "default": int((~readable).sum()),
+        "unreadable": int((~readable & tagged).sum()),
+    }
+    return heights, base, counts
+
+
+def resolve_heights(gdf, rules, storey_height=STOREY_HEIGHT):
+    """
+    Copy of gdf with the HEIGHT_COLUMN and BASE_COLUMN of every feature, resolved once per entity_type.
+    The features of an entity_type without rule get a null height.
+    """
+    heights = np.zeros(len(gdf))
+    bases = np.zeros(len(gdf))
+    total = {"tags": 0, "levels": 0, "default": 0, "unreadable": 0}
+
+    for typ, positions in gdf.groupby("entity_type", sort=False).indices.items():
+        if typ not in rules:
+            continue
+        heights[positions], bases[positions], counts = feature_heights(gdf.iloc[positions], rules[typ], storey_height)
+        if rules[typ].get("height_from_tag"):
+            for key, count in counts.items():
+                total[key] += count
+
+    if total["tags"] or total["levels"] or total["unreadable"]:
+        print(f"Heights : {total['tags']} from tags, {total['levels']} from levels, {total['default']} default "
+              f"({total['unreadable']} unreadable values)")
+    return gdf.assign(**{HEIGHT_COLUMN: heights, BASE_COLUMN: bases})
@@ -0,0 +1,133 @@
+"""
+File: lod.py
+Author: TORREGROSSA Dylan
+Repository: https://github.com/P-Joss-P/map-to-3d.git
+License: GNU GENERAL PUBLIC LICENSE Version 3 (see LICENSE file)
+
+Description:
+    This file will allow users to export the scene at several levels of detail (LOD) for the simulation viewer :
+    full geometry close up and coarse geometry far away.
+    For every level of LOD_LEVELS (configuration.py), the footprints are simplified with a topology-preserving
+    simplification of the given tolerance, and the polygons smaller than box_area are replaced by their
+    oriented bounding box. Coarse levels can also use mitre joins for the lines and drop the walls and bottom
+    of the flat features. The farthest levels can drop whole entity_types (thin lines like barriers), the
+    polygons and lines smaller than a threshold, and turn every polygon of some entity_types (buildings) in
+    its oriented bounding box. Each level is exported in its own glb file, listed in a manifest.json file
+    with its number of triangles and the ratio to the first level.
+
+Usage:
+    - python main.py (with EXPORT_LOD = True in configuration.py)
+
+Dependencies:
+    - Python 3.13+
+    - library used : json, numpy, os, shapely
+
+"""
+
+# library import
+import json
+import os
+import numpy as np
+import shapely
+
+# function/variable import
+from configuration import COMPACT_EXPORT, DEFAULT_CONFIG, LOD_LEVELS, MESH_CACHE_DIR, USE_MESH_CACHE, FEATURE_IDS
+from heights import resolve_heights
+from meshing import LINE_TYPES, POLYGON_TYPES, build_scene_batched, load_rules
+from scene_export import export_scene
+
+
+def select_features(gdf, drop_types=(), min_area=0.0, min_length=0.0):
+    """
+    Features of gdf kept by a far level of detail :
+        - the entity_types of drop_types are removed
+        - the polygons with an area smaller than min_area (m²) are removed
+        - the lines shorter than min_length (m) are removed
+    """
+    geoms = np.asarray(gdf.geometry.values, dtype=object)
+    type_id = shapely.get_type_id(geoms)
+
+    keep = ~gdf["entity_type"].isin(list(drop_types)).to_numpy()
+    if min_area > 0:
+        keep &= ~(np.isin(type_id, POLYGON_TYPES) & (shapely.area(geoms) < min_area))
+    if min_length > 0:
+        keep &= ~(np.isin(type_id, LINE_TYPES) & (shapely.length(geoms) < min_length))
+    return gdf[keep]
+
+
+def simplify_frame(gdf, tolerance=0.0, box_area=0.0, box_types=()):
+    """
+    Copy of gdf with simplified geometries :
+        - every geometry is simplified with tolerance (m), keeping its topology
+        - the polygons with an area smaller than box_area (m²), and all the polygons of the entity_types of
+          box_types, are replaced by their oriented bounding box
+    """
+    geoms = np.asarray(gdf.geometry.values, dtype=object)
+
+    if tolerance > 0:
+        geoms = shapely.simplify(geoms, tolerance, preserve_topology=True)
+
+    if box_area > 0 or len(box_types):
+        small = shapely.area(geoms) < box_area
+        small |= gdf["entity_type"].isin(list(box_types)).to_numpy()
+        small &= np.isin(shapely.get_type_id(geoms), POLYGON_TYPES)
+        geoms[small] = shapely.oriented_envelope(geoms[small])
+
+    simplified = gdf.copy()
+    simplified[gdf.geometry.name] = geoms
+    return simplified
+
+
+def level_rules(rules, level):
+    """
+    Rules of mapping_entities.json with the meshing options of a level :
+        - join_style : join of the buffered lines ("mitre" gives far less triangles than "round")
+        - min_wall_height : features lower than this height (m) only keep their top face
+    """
+    options = {key: level[key] for key in ("join_style", "min_wall_height") if key in level}
+    return {typ: {**rule, **options} for typ, rule in rules.items()}
+
+
+def triangle_count(scene):
+    return int(sum(len(mesh.faces) for mesh in scene.geometry.values()))
+
+
+def export_lods(gdf, folder, levels=LOD_LEVELS, config_path=DEFAULT_CONFIG, mesh_cache=USE_MESH_CACHE,
+                compact=COMPACT_EXPORT, terrain=None):
+    """
+    Build and export one glb file per level of detail in folder, then write folder/manifest.json with
+    the parameters, the file, the number of triangles of every level and its ratio to the first level.
+    compact and terrain are the ones of the full detail scene (quantized glb, DEM of terrain.py), the
+    "terrain_step" of a level gives the step of its ground mesh (step of terrain by default).
+    """
+    os.makedirs(folder, exist_ok=True)
+    rules = load_rules(config_path)
+    gdf = resolve_heights(gdf, rules)       # once for every level
+
+    manifest = {"origin": gdf.attrs.get("origin"), "levels": []}
+    for level in levels:
+        name = level["name"]
+        kept = select_features(gdf, level.get("drop_types", ()), level.get("min_area", 0.0),
+                               level.get("min_length", 0.0))
+        simplified = simplify_frame(kept, level.get("tolerance", 0.0), level.get("box_area", 0.0),
+                                    level.get("box_types", ()))
+
+        cache_dir = os.path.join(MESH_CACHE_DIR, f"lod_{name}") if mesh_cache else None
+        level_terrain = {**terrain, "step": level.get("terrain_step", terrain["step"])} if terrain is not None else None
+        scene = build_scene_batched(simplified, level_rules(rules, level), cache_dir, FEATURE_IDS, level_terrain)
+        scene.metadata["origin"] = gdf.attrs.get("origin")
+
+        file = f"{name}.glb"
+        export_scene(scene, os.path.join(folder, file), compact=compact)
+
+        triangles = triangle_count(scene)
+        full = manifest["levels"][0]["triangles"] if manifest["levels"] else triangles
+        ratio = round(full / max(triangles, 1), 1)
+        manifest["levels"].append({**level, "file": file, "features": len(kept), "triangles": triangles,
+                                   "ratio": ratio})
+        print(f"LOD {name} : {len(kept)} features, {triangles} triangles (ratio {ratio} to the first level)")
+
+    with open(os.path.join(folder, "manifest.json"), "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=4)
+
+    return manifest
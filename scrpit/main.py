@@ -1,45 +1,257 @@
 """
 File: main.py
-Author: TORREGROSSA Dylan 
+Author: TORREGROSSA Dylan
 Repository: https://github.com/P-Joss-P/map-to-3d.git
 License: GNU GENERAL PUBLIC LICENSE Version 3 (see LICENSE file)
 
 Description:
-    Main python file that will contain all the executable functions to run the entire project 
+    Main python file that will contain all the executable functions to run the entire project
+    It is a command line tool with one subcommand per task :
+        - build : OSM → GLB conversion, headless (batch mode, never imports pyglet or matplotlib.pyplot)
+        - preview : build the scene and open it in the trimesh viewer (pyglet)
+        - plot : figures of the interest_types (matplotlib)
+        - raster : quick png preview of the filtered data, rasterized with numpy (raster_preview.py, no matplotlib)
+        - index : tiled GeoParquet index of the osm file, read by the other commands with --index (spatial_index.py)
+        - update : apply an osm change file (.osc) to an index and to its glb tiles (osm_changes.py)
+        - catalog : csv catalog of every tag of the osm file, or of every osm file of a folder
+    pyglet (scene.show) and matplotlib (osm2plot) are imported only when their subcommand runs,
+    so a pure conversion starts quickly on a server without display.
 
 Usage:
-    None
+    - python main.py                    (same as python main.py build)
+    - python main.py build file.osm -o map3d.glb
+    - python main.py build file.osm --bbox 5.70 45.17 5.74 45.20        (area of interest in lon/lat, aoi.py)
+    - python main.py build file.osm --dem dem.tif                       (scene draped on a DEM, terrain.py)
+    - python main.py preview
+    - python main.py plot --show
+    - python main.py raster file.osm -o preview.png --size 4096
+    - python main.py index file.osm --folder index_folder
+    - python main.py build --index index_folder --bbox 5.70 45.17 5.74 45.20     (no parsing of the osm file)
+    - python main.py update changes.osc --index index_folder --glb-tiles tiles_folder
+    - python main.py catalog
+    - python main.py catalog folder_of_osm_files --workers 8
 
 Dependencies:
     - Python 3.13+
-    - libraries used : os, osmnx
+    - libraries used : argparse, os
 
 
 """
 
 # library import
+import argparse
 import os
-import osmnx as ox
 
 # function/variable import
-from configuration import full_path, interest_types, save_folder_path, FILTERED_DIR
-from functions import osm2plot
-from functions import build_scene, load_and_filter_osm
+from aoi import extract_area, read_area
+from configuration import full_path, interest_types, save_folder_path, CATALOG_WORKERS, DEFAULT_CONFIG, FILTERED_DIR
+from configuration import AREA_BUFFER, AREA_CLIP, AREA_CRS, AREA_OF_INTEREST
+from configuration import INDEX_DIR, INDEX_TILE_SIZE, INDEX_TILES_DIR
+from configuration import DEM_PATH, TERRAIN_STEP
+from configuration import COMPACT_EXPORT, EXPORT_LOD, LOD_DIR, SPLIT_TILES, STREAMING_EXPORT, TILED_SCENE, TILES_DIR
+from functions import load_and_filter_osm, load_osm, osm2plot
+from Ident_tag import catalog_folder, export_folder_catalog, export_tag_catalog, tag_catalog
+from lod import export_lods
+from osm_changes import apply_changes, read_osm_state, save_state
+from osm_stream import read_osm_filtered
+from raster_preview import export_preview
+from scene_builder import build_scene
+from scene_export import export_scene
+from spatial_index import build_index_store, export_index_tiles, query_index
+from terrain import open_dem
+from tiling import build_scene_tiled, export_tiles, stream_scene
 
-# General settings and load data
-os.makedirs(FILTERED_DIR, exist_ok=True) # creation of filter_directory
 
-gdf = ox.features_from_xml(full_path)
+def load(osm_path, args=None):
+    """
+    Filtered, centred and classified osm file, read from the cache when the file didn't change (cache.py),
+    else streamed (interest_types elements only, STREAMING_LOAD).
+    The area of interest of args (--bbox / --area), or AREA_OF_INTEREST, is then extracted (aoi.py).
+    With --index, the features are read from the tiles of the index instead of the osm file.
+    """
+    area = getattr(args, "bbox", None) or getattr(args, "area", None) or AREA_OF_INTEREST
+    area_crs = getattr(args, "area_crs", AREA_CRS)
+    if isinstance(area, str):       # vector file : its own crs
+        area, area_crs = read_area(area)
+    buffer, clip = getattr(args, "buffer", AREA_BUFFER), getattr(args, "clip", AREA_CLIP)
 
-# Plot interest_types
-#osm2plot(gdf, interest_types, True, save_folder_path, show_setting=False)
+    if getattr(args, "index", None):
+        return query_index(args.index, area, area_crs, buffer, clip)
 
-# Scene creation and operation
-gdf = load_and_filter_osm(full_path, save_filtered=True)
-scene = build_scene(gdf)  # utilise mapping_entities.json par défaut
+    os.makedirs(FILTERED_DIR, exist_ok=True) # creation of filter_directory
+    gdf = load_and_filter_osm(osm_path, save_filtered=True)     # cache checked before any parsing (cache.py)
 
-scene.export("map3d.glb")
-scene.show()
+    if area is None:
+        return gdf
+    return extract_area(gdf, area, area_crs, buffer, clip)
 
 
+def load_terrain(args):
+    """Header of the DEM of --dem (or DEM_PATH), None for a flat scene."""
+    return open_dem(args.dem, step=args.terrain_step) if args.dem else None
 
+
+def build_command(args):
+    """OSM → GLB conversion, without any window."""
+    gdf = load(args.osm, args)
+    terrain = load_terrain(args)
+
+    if args.tiled and args.split_tiles:
+        export_tiles(gdf, TILES_DIR, args.config, compact=args.compact, terrain=terrain)     # one glb per tile
+    elif args.streaming:
+        stream_scene(gdf, args.output, args.config, compact=args.compact, terrain=terrain)     # tiles written one by one
+    elif args.tiled:
+        scene = build_scene_tiled(gdf, args.config, terrain=terrain)
+        export_scene(scene, args.output, compact=args.compact)
+    else:
+        scene = build_scene(gdf, args.config, terrain=terrain)
+        export_scene(scene, args.output, compact=args.compact)
+
+    if args.lod:
+        export_lods(gdf, LOD_DIR, config_path=args.config, compact=args.compact, terrain=terrain)     # + manifest.json
+
+
+def preview_command(args):
+    """Build the scene and show it in the trimesh viewer (pyglet is imported by scene.show)."""
+    scene = build_scene(load(args.osm, args), args.config, terrain=load_terrain(args))
+    scene.show()
+
+
+def plot_command(args):
+    """Figures of the interest_types (matplotlib is imported by osm2plot)."""
+    gdf_osm = read_osm_filtered(args.osm, interest_types)
+    osm2plot(gdf_osm, interest_types, True, args.folder, show_setting=args.show)
+
+
+def raster_command(args):
+    """Top-down png preview of the filtered data, without matplotlib."""
+    export_preview(load(args.osm, args), args.output, args.config, args.size, args.resolution)
+
+
+def index_command(args):
+    """
+    Tiled index of the whole osm file (no area of interest : every query is done on the index),
+    with the osm topology used by the update command, and the glb of every tile with --glb-tiles.
+    """
+    os.makedirs(FILTERED_DIR, exist_ok=True)
+    gdf = load_and_filter_osm(args.osm, save_filtered=False)
+    build_index_store(gdf, args.folder, args.tile_size, source=os.path.abspath(args.osm))
+    save_state(args.folder, read_osm_state(args.osm))
+    if args.glb_tiles:
+        export_index_tiles(args.folder, args.glb_tiles, config_path=args.config, compact=args.compact)
+
+
+def update_command(args):
+    """Apply the osm change files to the index, in the given order, then export the patched glb tiles again."""
+    patched = set()
+    for osc in args.osc:
+        patched.update(apply_changes(osc, args.index))
+    if args.glb_tiles and patched:
+        export_index_tiles(args.index, args.glb_tiles, sorted(patched), args.config, compact=args.compact)
+
+
+def catalog_command(args):
+    """
+    Catalog of the tags (needs every tag of the file : whole parsing with load_osm).
+    For a folder, the tags of every osm file are counted in streaming, without geometries.
+    """
+    if os.path.isdir(args.osm):
+        export_folder_catalog(*catalog_folder(args.osm, args.workers))
+        return
+    export_tag_catalog(tag_catalog(load_osm(args.osm)), os.path.basename(args.osm))
+
+
+COMMANDS = {
+    "build": build_command,
+    "preview": preview_command,
+    "plot": plot_command,
+    "raster": raster_command,
+    "index": index_command,
+    "update": update_command,
+    "catalog": catalog_command,
+}
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="map-to-3d : 3D map from an OpenStreetMap osm file")
+    subparsers = parser.add_subparsers(dest="command")
+
+    def add_command(name, help):
+        subparser = subparsers.add_parser(name, help=help)
+        subparser.add_argument("osm", nargs="?", default=full_path, help="osm file (configuration.py by default)")
+        return subparser
+
+    def add_area_arguments(subparser):
+        subparser.add_argument("--bbox", nargs=4, type=float, metavar=("MINX", "MINY", "MAXX", "MAXY"),
+                               help="area of interest (crs of --area-crs)")
+        subparser.add_argument("--area", help="area of interest : vector file (GeoJSON, shapefile...)")
+        subparser.add_argument("--area-crs", default=AREA_CRS, help="crs of --bbox : lonlat, projected, scene or EPSG:...")
+        subparser.add_argument("--buffer", type=float, default=AREA_BUFFER, help="buffer around the area (m)")
+        subparser.add_argument("--clip", action=argparse.BooleanOptionalAction, default=AREA_CLIP,
+                               help="clip the features to the area")
+        subparser.add_argument("--index", help="folder of an index (index command) read instead of the osm file")
+
+    def add_terrain_arguments(subparser):
+        subparser.add_argument("--dem", default=DEM_PATH, help="DEM file (GeoTIFF or ESRI ASCII grid) to drape the scene on")
+        subparser.add_argument("--terrain-step", type=float, default=TERRAIN_STEP, help="step of the ground mesh (m)")
+
+    build = add_command("build", "OSM → GLB conversion (headless)")
+    build.add_argument("-o", "--output", default="map3d.glb", help="glb file")
+    build.add_argument("--config", default=DEFAULT_CONFIG, help="mapping_entities.json file")
+    build.add_argument("--tiled", action=argparse.BooleanOptionalAction, default=TILED_SCENE,
+                       help="build the scene tile by tile in a process pool")
+    build.add_argument("--split-tiles", action=argparse.BooleanOptionalAction, default=SPLIT_TILES,
+                       help="one glb per tile + manifest.json (with --tiled)")
+    build.add_argument("--streaming", action=argparse.BooleanOptionalAction, default=STREAMING_EXPORT,
+                       help="write the tiles one by one in the glb file (bounded memory)")
+    build.add_argument("--compact", action=argparse.BooleanOptionalAction, default=COMPACT_EXPORT,
+                       help="quantized glb with one material per color")
+    build.add_argument("--lod", action=argparse.BooleanOptionalAction, default=EXPORT_LOD,
+                       help="also export the levels of detail")
+    add_area_arguments(build)
+    add_terrain_arguments(build)
+
+    preview = add_command("preview", "build the scene and open the 3D viewer")
+    preview.add_argument("--config", default=DEFAULT_CONFIG, help="mapping_entities.json file")
+    add_area_arguments(preview)
+    add_terrain_arguments(preview)
+
+    plot = add_command("plot", "figures of the interest_types")
+    plot.add_argument("--folder", default=save_folder_path, help="folder of the png files")
+    plot.add_argument("--show", action="store_true", help="open the figures")
+
+    raster = add_command("raster", "png preview of the filtered data (numpy rasterizer)")
+    raster.add_argument("-o", "--output", default="preview.png", help="png file")
+    raster.add_argument("--config", default=DEFAULT_CONFIG, help="mapping_entities.json file")
+    raster.add_argument("--size", type=int, default=2048, help="pixels of the longest side")
+    raster.add_argument("--resolution", type=float, default=None, help="metres per pixel (instead of --size)")
+    add_area_arguments(raster)
+
+    index = add_command("index", "tiled GeoParquet index of the osm file")
+    index.add_argument("--folder", default=INDEX_DIR, help="folder of the index")
+    index.add_argument("--tile-size", type=float, default=INDEX_TILE_SIZE, help="size of a tile (m)")
+    index.add_argument("--glb-tiles", nargs="?", const=INDEX_TILES_DIR, help="also export one glb per tile in this folder")
+    index.add_argument("--config", default=DEFAULT_CONFIG, help="mapping_entities.json file")
+    index.add_argument("--compact", action=argparse.BooleanOptionalAction, default=COMPACT_EXPORT,
+                       help="quantized glb with one material per color")
+
+    update = subparsers.add_parser("update", help="apply osm change files (.osc) to an index")
+    update.add_argument("osc", nargs="+", help="osmChange files, in the order of the diffs")
+    update.add_argument("--index", default=INDEX_DIR, help="folder of the index")
+    update.add_argument("--glb-tiles", nargs="?", const=INDEX_TILES_DIR, help="folder of the glb tiles to patch")
+    update.add_argument("--config", default=DEFAULT_CONFIG, help="mapping_entities.json file")
+    update.add_argument("--compact", action=argparse.BooleanOptionalAction, default=COMPACT_EXPORT,
+                        help="quantized glb with one material per color")
+
+    catalog = add_command("catalog", "csv catalog of the tags (osm file or folder of osm files)")
+    catalog.add_argument("--workers", type=int, default=CATALOG_WORKERS, help="processes for a folder (default : every core)")
+
+    args = parser.parse_args(argv)
+    if args.command is None:        # python main.py : headless build with the configuration.py settings
+        args = parser.parse_args(["build"])
+    return args
+
+
+if __name__ == "__main__":     # needed by the process pool of the tiled scene
+    args = parse_args()
+    COMMANDS[args.command](args)
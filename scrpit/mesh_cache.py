@@ -0,0 +1,173 @@
+"""
+File: mesh_cache.py
+Author: TORREGROSSA Dylan
+Repository: https://github.com/P-Joss-P/map-to-3d.git
+License: GNU GENERAL PUBLIC LICENSE Version 3 (see LICENSE file)
+
+Description:
+    This file will allow users to keep on disk the triangulated mesh of every feature, so that a rebuild
+    after a change of mapping_entities.json only re-triangulates the features whose inputs changed.
+    The key of a feature is a hash of its geometry and of the parameters of its rule which change the shape
+    of the mesh (mesh_type, height, width). The color is not part of the key : a color-only change
+    re-colors the cached meshes without any triangulation.
+
+Usage:
+    - python main.py (with USE_MESH_CACHE = True in configuration.py)
+
+Dependencies:
+    - Python 3.13+
+    - library used : hashlib, numpy, os, shapely
+
+Notes:
+    - One .npz file per entity_type, which contains the keys, the vertex and face counts of every feature and
+      the concatenated vertices (float32) and faces (int32, local to the feature).
+    - A file is rewritten with the features of the current build only, so it never grows with old entries.
+
+"""
+
+# library import
+import hashlib
+import os
+import numpy as np
+import shapely
+
+# function/variable import
+from constant import MESHING_VERSION
+
+
+def feature_keys(geoms, heights, params):
+    """Key (16 bytes) of every feature : hash of its geometry (WKB), of its height and of the rule parameters."""
+    wkbs = shapely.to_wkb(np.asarray(geoms, dtype=object))
+    common = f"{MESHING_VERSION}|{params}".encode("utf-8")
+    heights = np.asarray(heights, dtype=np.float64)
+
+    keys = np.empty(len(wkbs), dtype="S16")
+    for i, wkb in enumerate(wkbs):
+        h = hashlib.blake2b(common, digest_size=16)
+        h.update(heights[i].tobytes())
+        h.update(wkb if wkb is not None else b"")
+        keys[i] = h.digest()
+    return keys
+
+
+def split_by_feature(vertices, faces, face_index, n_features):
+    """
+    Reorder the arrays of extrude_polygons so that the vertices and faces of every feature are contiguous.
+    Returns the vertices, the faces (local to each feature) and the vertex and face counts of every feature.
+    """
+    order = np.argsort(face_index, kind="stable")
+    faces, face_index = faces[order], face_index[order]
+
+    # Vertices are never shared between features : their owner is the owner of their faces
+    vertex_owner = np.zeros(len(vertices), dtype=np.int64)
+    vertex_owner[faces.ravel()] = np.repeat(face_index, 3)
+    vertex_order = np.argsort(vertex_owner, kind="stable")
+    new_position = np.empty_like(vertex_order)
+    new_position[vertex_order] = np.arange(len(vertex_order))
+
+    vertex_counts = np.bincount(vertex_owner, minlength=n_features)
+    face_counts = np.bincount(face_index, minlength=n_features)
+    vertex_start = np.concatenate([[0], np.cumsum(vertex_counts)[:-1]])
+    local_faces = new_position[faces] - vertex_start[face_index][:, None]
+
+    return vertices[vertex_order], local_faces, vertex_counts, face_counts
+
+
+def _gather(data, counts, index):
+    """Concatenate the chunks index of data, chunk i having counts[i] rows."""
+    starts = np.concatenate([[0], np.cumsum(counts)[:-1]])
+    lengths = counts[index]
+    total = int(lengths.sum())
+    shift = np.repeat(starts[index] - np.concatenate([[0], np.cumsum(lengths)[:-1]]), lengths)
+    return data[np.arange(total) + shift]
+
+
+def load_store(cache_file):
+    """Read a cache file, None if it does not exist or can't be read."""
+    if cache_file is None or not os.path.exists(cache_file):
+        return None
+    try:
+        with np.load(cache_file) as data:
+            return {name: data[name] for name in data.files}
+    except Exception as e:
+        print(f"Mesh cache {cache_file} could not be read : {e}")
+        return None
+
+
+def save_store(cache_file, store):
+    """Write a cache file (atomic replacement)."""
+    os.makedirs(os.path.dirname(cache_file), exist_ok=True)
+    tmp = cache_file + ".tmp.npz"
+    np.savez(tmp, **store)
+    os.replace(tmp, cache_file)
+
+
+def cached_arrays(geoms, heights, params, build, cache_file):
+    """
+    Same result as build(geoms, heights) -> (vertices, faces, face_index), but the features already
+    present in cache_file are not built again. cache_file is then rewritten with the features of this call.
+    """
+    n = len(geoms)
+    keys = feature_keys(geoms, heights, params)
+
+    store = load_store(cache_file)
+    if store is None:
+        store = {
+            "keys": np.empty(0, dtype="S16"),
+            "vertex_counts": np.empty(0, dtype=np.int32),
+            "face_counts": np.empty(0, dtype=np.int32),
+            "vertices": np.empty((0, 3), dtype=np.float32),
+            "faces": np.empty((0, 3), dtype=np.int32),
+        }
+
+    # Position of every feature in the cache (-1 : not cached)
+    position = np.full(n, -1, dtype=np.int64)
+    if len(store["keys"]):
+        sorter = np.argsort(store["keys"])
+        found = np.searchsorted(store["keys"], keys, sorter=sorter)
+        found = sorter[np.minimum(found, len(sorter) - 1)]
+        hit = store["keys"][found] == keys
+        position[hit] = found[hit]
+
+    missing = np.flatnonzero(position < 0)
+    print(f"Mesh cache {os.path.basename(cache_file)} : {n - len(missing)} / {n} features reused")
+
+    # Build the missing features only
+    if len(missing):
+        vertices, faces, face_index = build(np.asarray(geoms, dtype=object)[missing], np.asarray(heights)[missing])
+        new_vertices, new_faces, new_vertex_counts, new_face_counts = split_by_feature(
+            vertices, faces, face_index, len(missing))
+    else:
+        new_vertices, new_faces = np.empty((0, 3)), np.empty((0, 3), dtype=np.int64)
+        new_vertex_counts = new_face_counts = np.empty(0, dtype=np.int64)
+
+    # Cached and new chunks in a single list of chunks : the new ones are after the cached ones
+    n_cached = len(store["keys"])
+    vertex_counts = np.concatenate([store["vertex_counts"], new_vertex_counts]).astype(np.int64)
+    face_counts = np.concatenate([store["face_counts"], new_face_counts]).astype(np.int64)
+    all_vertices = np.concatenate([store["vertices"], new_vertices.astype(np.float32)])
+    all_faces = np.concatenate([store["faces"], new_faces.astype(np.int32)])
+
+    chunk = position.copy()
+    chunk[missing] = n_cached + np.arange(len(missing))
+
+    # Assembly of the features in their order
+    f_vertices = _gather(all_vertices, vertex_counts, chunk).astype(np.float64)
+    f_faces = _gather(all_faces, face_counts, chunk).astype(np.int64)
+    vertex_start = np.concatenate([[0], np.cumsum(vertex_counts[chunk])[:-1]])
+    face_index = np.repeat(np.arange(n), face_counts[chunk])
+    f_faces += vertex_start[face_index][:, None]
+
+    # Rewrite the cache with the features of this build only
+    if cache_file is not None:
+        _, first = np.unique(keys, return_index=True)
+        kept = chunk[first]
+        save_store(cache_file, {
+            "keys": keys[first],
+            "vertex_counts": vertex_counts[kept].astype(np.int32),
+            "face_counts": face_counts[kept].astype(np.int32),
+            "vertices": _gather(all_vertices, vertex_counts, kept),
+            "faces": _gather(all_faces, face_counts, kept),
+        })
+
+    return f_vertices, f_faces, face_index
@@ -0,0 +1,480 @@
+"""
+File: meshing.py
+Author: TORREGROSSA Dylan
+Repository: https://github.com/P-Joss-P/map-to-3d.git
+License: GNU GENERAL PUBLIC LICENSE Version 3 (see LICENSE file)
+
+Description:
+    This file will contain the batched version of the 3D scene creation.
+    Instead of extruding every feature one by one, all the features of a same entity_type
+    are triangulated together thank's to shapely vectorized functions and the vertex, face
+    and color arrays are assembled with numpy. The result is one mesh per entity_type.
+
+Usage:
+    - python main.py
+
+Dependencies:
+    - Python 3.13+
+    - library used : json, numpy, os, shapely, trimesh
+
+Notes:
+    - Every function working on arrays returns (vertices, faces, face_index) where face_index
+      gives, for each face, the position of the source feature in the input array.
+    - "line_mesher": "ribbon" in a rule of mapping_entities.json extrudes its lines directly (ribbon_prisms),
+      always with mitre joins, instead of buffering and triangulating them ("buffer", default).
+    - "network": true in a rule dissolves its lines before a single buffer (clean junctions, less triangles, but a
+      slower meshing). It is off by default : every face is then given to the nearest line for the picking.
+
+"""
+
+# library import
+import json
+import os
+import numpy as np
+import shapely
+import trimesh
+
+# function/variable import
+from constant import BASE_COLUMN, HEIGHT_COLUMN, NETWORK_CELL_SIZE, Z_LAYERS
+from heights import feature_heights, resolve_heights
+from mesh_cache import cached_arrays
+from terrain import drape, frame_sampler, ground_mesh
+
+
+# shapely geometry type ids
+POLYGON_TYPES = (3, 6)      # Polygon, MultiPolygon
+LINE_TYPES = (1, 5)         # LineString, MultiLineString
+
+
+##################################
+####### Array construction #######
+##################################
+
+def _polygon_parts(geoms):
+    """
+    Explode an array of (Multi)Polygons into single oriented polygons
+    (exterior counter-clockwise, holes clockwise).
+    Returns the parts and the index of the source geometry of each part.
+    """
+    geoms = np.asarray(geoms, dtype=object)
+
+    # Repair invalid geometries only, valid ones are kept untouched
+    invalid = ~shapely.is_valid(geoms)
+    if invalid.any():
+        geoms = geoms.copy()
+        geoms[invalid] = shapely.make_valid(geoms[invalid])
+
+    parts, owner = shapely.get_parts(geoms, return_index=True)
+    keep = (shapely.get_type_id(parts) == 3) & ~shapely.is_empty(parts)
+    parts, owner = parts[keep], owner[keep]
+
+    # make_valid could give back GeometryCollections containing MultiPolygons
+    if len(parts) and (shapely.get_type_id(parts) == 6).any():
+        parts, sub = shapely.get_parts(parts, return_index=True)
+        owner = owner[sub]
+
+    return shapely.orient_polygons(parts), owner
+
+
+def extrude_polygons(geoms, heights, min_wall_height=0.0):
+    """
+    Extrude an array of polygons in one batch.
+    Every polygon gets a bottom cap at z = 0, a top cap at z = height and a wall quad for each ring edge.
+    The polygons lower than min_wall_height only get their top cap (coarse levels of detail).
+    """
+    heights = np.asarray(heights, dtype=np.float64)
+    parts, owner = _polygon_parts(geoms)
+
+    if len(parts) == 0:
+        return np.empty((0, 3)), np.empty((0, 3), dtype=np.int64), np.empty(0, dtype=np.int64)
+
+    part_height = heights[owner]
+    part_solid = part_height >= min_wall_height
+
+    # Caps : constrained Delaunay triangulation of all the polygons at once
+    triangles, tri_part = shapely.get_parts(shapely.constrained_delaunay_triangles(parts), return_index=True)
+    tri = shapely.get_coordinates(triangles).reshape(-1, 4, 2)[:, :3]
+
+    # Orientation of the triangles : counter-clockwise seen from above
+    u, v = tri[:, 1] - tri[:, 0], tri[:, 2] - tri[:, 0]
+    area = u[:, 0] * v[:, 1] - u[:, 1] * v[:, 0]
+    tri[area < 0] = tri[area < 0][:, ::-1]
+    tri = tri[area != 0]
+    tri_part = tri_part[area != 0]
+
+    tri_height = part_height[tri_part]
+    tri_solid = part_solid[tri_part]
+
+    top = np.concatenate([tri, np.repeat(tri_height, 3).reshape(-1, 3, 1)], axis=2)
+    bottom = np.concatenate([tri[tri_solid][:, ::-1], np.zeros((tri_solid.sum(), 3, 1))], axis=2)
+    cap_vertices = np.concatenate([top, bottom]).reshape(-1, 3)
+    cap_faces = np.arange(len(cap_vertices)).reshape(-1, 3)
+    cap_owner = np.concatenate([owner[tri_part], owner[tri_part][tri_solid]])
+
+    # Walls : one quad per edge of every ring (exterior and holes)
+    rings, ring_part = shapely.get_rings(parts[part_solid], return_index=True)
+    ring_part = np.flatnonzero(part_solid)[ring_part]
+    coords, ring_id = shapely.get_coordinates(rings, return_index=True)
+    same_ring = ring_id[:-1] == ring_id[1:]
+    a = coords[:-1][same_ring]
+    b = coords[1:][same_ring]
+    edge_part = ring_part[ring_id[:-1][same_ring]]
+    edge_height = part_height[edge_part]
+
+    n_edges = len(a)
+    zeros = np.zeros(n_edges)
+    wall_vertices = np.stack([
+        np.column_stack([a, zeros]),
+        np.column_stack([b, zeros]),
+        np.column_stack([b, edge_height]),
+        np.column_stack([a, edge_height]),
+    ], axis=1).reshape(-1, 3)
+    quad = np.arange(n_edges)[:, None] * 4 + cap_vertices.shape[0]
+    wall_faces = np.concatenate([quad + [0, 1, 2], quad + [0, 2, 3]])
+    wall_owner = np.tile(owner[edge_part], 2)
+
+    vertices = np.concatenate([cap_vertices, wall_vertices])
+    faces = np.concatenate([cap_faces, wall_faces])
+    face_index = np.concatenate([cap_owner, wall_owner])
+
+    return vertices, faces, face_index
+
+
+def buffer_lines(geoms, widths, join_style="round"):
+    """Buffer an array of (Multi)LineStrings with flat caps, as mesh_from_line does one by one."""
+    return shapely.buffer(np.asarray(geoms, dtype=object), np.asarray(widths, dtype=np.float64) / 2,
+                          cap_style="flat", join_style=join_style)
+
+
+def ribbon_prisms(geoms, widths, heights, min_wall_height=0.0, mitre_limit=4.0):
+    """
+    Extrude an array of (Multi)LineStrings in thin prisms without any buffer : the left and right vertices of
+    every point are offset from the line along the mitred normal of its segments.
+    Every line gives a strip with a known layout : top and bottom faces, two side walls and two end caps.
+    The lines lower than min_wall_height only get their top strip.
+    """
+    geoms = np.asarray(geoms, dtype=object)
+    widths = np.broadcast_to(np.asarray(widths, dtype=np.float64), len(geoms))
+    heights = np.broadcast_to(np.asarray(heights, dtype=np.float64), len(geoms))
+
+    parts, owner = shapely.get_parts(geoms, return_index=True)
+    coords, line = shapely.get_coordinates(parts, return_index=True)
+
+    # Remove repeated points, then the lines with less than 2 points
+    repeated = np.r_[False, (line[1:] == line[:-1]) & np.all(coords[1:] == coords[:-1], axis=1)]
+    coords, line = coords[~repeated], line[~repeated]
+    valid = np.bincount(line, minlength=len(parts))[line] >= 2
+    coords, line = coords[valid], line[valid]
+
+    if len(coords) == 0:
+        return np.empty((0, 3)), np.empty((0, 3), dtype=np.int64), np.empty(0, dtype=np.int64)
+
+    n_points = len(coords)
+    point_owner = owner[line]
+    half_width = widths[point_owner][:, None] / 2
+    height = heights[point_owner]
+    solid = height >= min_wall_height
+
+    # Unit normal (on the left) of every segment
+    segment = line[:-1] == line[1:]
+    direction = coords[1:] - coords[:-1]
+    direction /= np.maximum(np.linalg.norm(direction, axis=1), 1e-12)[:, None]
+    normal = np.column_stack([-direction[:, 1], direction[:, 0]])
+
+    # Normals before and after every point (the first and last points only have one segment)
+    n_in = np.zeros((n_points, 2))
+    n_out = np.zeros((n_points, 2))
+    n_out[:-1][segment] = normal[segment]
+    n_in[1:][segment] = normal[segment]
+    first = np.r_[True, ~segment]
+    last = np.r_[~segment, True]
+    n_in[first] = n_out[first]
+    n_out[last] = n_in[last]
+
+    # Mitre join, limited for the sharp turns
+    mitre = n_in + n_out
+    length = np.linalg.norm(mitre, axis=1)
+    mitre = np.where(length[:, None] > 1e-9, mitre / np.maximum(length, 1e-12)[:, None], n_out)
+    scale = np.minimum(1 / np.maximum(np.sum(mitre * n_out, axis=1), 1e-9), mitre_limit)
+    offset = mitre * scale[:, None] * half_width
+
+    left, right = coords + offset, coords - offset
+    zeros = np.zeros(n_points)
+
+    # Top and bottom strips : the vertices of a point are shared by its two segments
+    strips = np.concatenate([
+        np.column_stack([left, height]),       # 0 * n_points : left top
+        np.column_stack([right, height]),      # 1 * n_points : right top
+        np.column_stack([left, zeros]),        # 2 * n_points : left bottom
+        np.column_stack([right, zeros]),       # 3 * n_points : right bottom
+    ])
+    i = np.flatnonzero(segment)
+    lt, rt, lb, rb = i, i + n_points, i + 2 * n_points, i + 3 * n_points
+    top = np.concatenate([np.column_stack([rt, rt + 1, lt + 1]), np.column_stack([rt, lt + 1, lt])])
+    bottom = np.concatenate([np.column_stack([rb, lb + 1, rb + 1]), np.column_stack([rb, lb, lb + 1])])
+    top_owner = np.tile(point_owner[i], 2)
+    bottom_solid = np.tile(solid[i], 2)
+    bottom, bottom_owner = bottom[bottom_solid], top_owner[bottom_solid]
+
+    # Walls and end caps : one quad (a -> b, outward normal on the right) with its own 4 vertices
+    s = i[solid[i]]
+    start = np.flatnonzero(first & solid)
+    end = np.flatnonzero(last & solid)
+    a = np.concatenate([left[s + 1], right[s], left[start], right[end]])
+    b = np.concatenate([left[s], right[s + 1], right[start], left[end]])
+    quad_height = np.concatenate([height[s], height[s], height[start], height[end]])
+    quad_owner = np.concatenate([point_owner[s], point_owner[s], point_owner[start], point_owner[end]])
+
+    n_quads = len(a)
+    quad_zeros = np.zeros(n_quads)
+    quad_vertices = np.stack([
+        np.column_stack([a, quad_zeros]),
+        np.column_stack([b, quad_zeros]),
+        np.column_stack([b, quad_height]),
+        np.column_stack([a, quad_height]),
+    ], axis=1).reshape(-1, 3)
+    quad = np.arange(n_quads)[:, None] * 4 + len(strips)
+    quad_faces = np.concatenate([quad + [0, 1, 2], quad + [0, 2, 3]])
+
+    vertices = np.concatenate([strips, quad_vertices])
+    faces = np.concatenate([top, bottom, quad_faces])
+    face_index = np.concatenate([top_owner, bottom_owner, np.tile(quad_owner, 2)])
+
+    # Only keep the vertices used by a face (bottom and walls of the low lines are not)
+    used = np.zeros(len(vertices), dtype=bool)
+    used[faces.ravel()] = True
+    new_position = np.cumsum(used) - 1
+    return vertices[used], new_position[faces], face_index
+
+
+def network_polygons(geoms, width, join_style="round"):
+    """
+    Dissolve every line of a network (same entity_type and width) before a single buffer, so that
+    the junctions are not made of overlapping and duplicated geometries.
+    """
+    geoms = np.asarray(geoms, dtype=object)
+    if len(geoms) == 0:
+        return np.empty(0, dtype=object)
+
+    merged = shapely.line_merge(shapely.union_all(geoms))
+    network = shapely.buffer(merged, width / 2, cap_style="flat", join_style=join_style)
+
+    # The dissolved network has a hole for every block : cut it in cells, much faster to triangulate
+    minx, miny, maxx, maxy = shapely.bounds(network)
+    x, y = np.meshgrid(np.arange(minx, maxx, NETWORK_CELL_SIZE), np.arange(miny, maxy, NETWORK_CELL_SIZE))
+    cells = shapely.box(x.ravel(), y.ravel(), x.ravel() + NETWORK_CELL_SIZE, y.ravel() + NETWORK_CELL_SIZE)
+
+    shapely.prepare(network)
+    cells = cells[shapely.intersects(network, cells)]
+    return shapely.intersection(network, cells)
+
+
+def nearest_lines(points, lines):
+    """
+    Position in lines of the line nearest to every point. The tree is built on the segments of the lines :
+    the bounding boxes of whole roads overlap too much for a fast nearest query.
+    """
+    parts, part_line = shapely.get_parts(lines, return_index=True)
+    coords, part = shapely.get_coordinates(parts, return_index=True)
+    same_part = part[:-1] == part[1:]
+    segments = shapely.linestrings(np.stack([coords[:-1][same_part], coords[1:][same_part]], axis=1))
+    segment_line = part_line[part[:-1][same_part]]
+    return segment_line[shapely.STRtree(segments).query_nearest(points, all_matches=False)[1]]
+
+
+def largest_polygons(geoms):
+    """Vectorized version of force_polygon : keep the biggest polygon of every MultiPolygon."""
+    geoms = np.asarray(geoms, dtype=object)
+    parts, owner = shapely.get_parts(geoms, return_index=True)
+    keep = shapely.get_type_id(parts) == 3
+    parts, owner = parts[keep], owner[keep]
+
+    result = np.full(len(geoms), None, dtype=object)
+    if len(parts):
+        order = np.lexsort((-shapely.area(parts), owner))
+        first = np.r_[True, owner[order][1:] != owner[order][:-1]]
+        result[owner[order][first]] = parts[order][first]
+    return result
+
+
+###########################
+####### Batched scene #####
+###########################
+
+def _prepare_polygons(geoms, rule):
+    """Polygons to extrude for the kept geometries of an entity_type, following its mesh_type."""
+    mesh_type = rule.get("mesh_type", "extrusion")
+
+    if mesh_type == "extrusion_line":
+        return buffer_lines(geoms, float(rule.get("width", 3.0)), rule.get("join_style", "round"))
+    if mesh_type == "flat":
+        return largest_polygons(geoms)
+    return geoms
+
+
+def entity_arrays(group, rule, cache_file=None):
+    """
+    Build the vertex/face arrays of every feature of one entity_type, following the
+    mesh_type of its rule in mapping_entities.json.
+    With a cache_file (mesh_cache.py), only the features which are not already cached are triangulated.
+    Lines whose rule has "network": true are dissolved in a single mesh, every face is given back to the
+    nearest line of the group so that the picking still works.
+    Lines whose rule has "line_mesher": "ribbon" are extruded directly from their points (ribbon_prisms).
+    The heights are the HEIGHT_COLUMN / BASE_COLUMN of resolve_heights (heights.py), resolved here when
+    group doesn't have them.
+    """
+    mesh_type = rule.get("mesh_type", "extrusion")
+    geoms = np.asarray(group.geometry.values, dtype=object)
+    type_id = shapely.get_type_id(geoms)
+
+    if HEIGHT_COLUMN in group.columns:
+        all_heights = group[HEIGHT_COLUMN].to_numpy(dtype=np.float64)
+        bases = group[BASE_COLUMN].to_numpy(dtype=np.float64)
+    else:
+        all_heights, bases, _ = feature_heights(group, rule)
+
+    if mesh_type == "extrusion":
+        keep = np.isin(type_id, POLYGON_TYPES)
+        heights = all_heights[keep]
+
+    elif mesh_type == "extrusion_line":
+        keep = np.isin(type_id, LINE_TYPES)
+        heights = all_heights[keep]
+
+    elif mesh_type == "flat":
+        keep = np.isin(type_id, POLYGON_TYPES)
+        heights = np.full(keep.sum(), 0.1)      # default heignt for flat surface
+
+    else:
+        raise ValueError(f"Unknown mesh_type '{mesh_type}'")
+
+    geoms = geoms[keep]
+
+    min_wall_height = float(rule.get("min_wall_height", 0.0))
+    ribbon = mesh_type == "extrusion_line" and rule.get("line_mesher", "buffer") == "ribbon"
+    network = mesh_type == "extrusion_line" and rule.get("network", False) and not ribbon
+
+    lines = geoms
+    if network:
+        # The whole network is dissolved before the cache lookup : the cached "features" are its cells
+        geoms = network_polygons(geoms, float(rule.get("width", 3.0)), rule.get("join_style", "mitre"))
+        heights = np.full(len(geoms), float(rule.get("height", 0.1)))
+
+    def build(geoms, heights):
+        if ribbon:
+            return ribbon_prisms(geoms, float(rule.get("width", 3.0)), heights, min_wall_height)
+        polygons = geoms if network else _prepare_polygons(geoms, rule)
+        return extrude_polygons(polygons, heights, min_wall_height)
+
+    if cache_file is None:
+        vertices, faces, face_index = build(geoms, heights)
+    else:
+        params = f"{mesh_type}|{rule.get('width', 3.0)}|{rule.get('join_style')}|{min_wall_height}|{network}|{ribbon}"
+        vertices, faces, face_index = cached_arrays(geoms, heights, params, build, cache_file)
+
+    # Dissolved network : face_index refers to the cells, every face goes to the line nearest to its centre
+    if network and len(faces):
+        face_index = nearest_lines(shapely.points(vertices[faces][:, :, :2].mean(axis=1)), lines)
+
+    # face_index refers to the kept features, go back to the position in the group
+    face_index = np.flatnonzero(keep)[face_index]
+
+    # Features which don't start on the ground (min_height) : vertices are never shared between features
+    if bases.any():
+        vertex_base = np.zeros(len(vertices))
+        vertex_base[faces.ravel()] = np.repeat(bases[face_index], 3)
+        vertices[:, 2] += vertex_base
+    return vertices, faces, face_index
+
+
+def load_rules(config_path):
+    """Load and read the json file of the rules of every entity_type (mapping_entities.json)."""
+    with open(config_path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def feature_names(index):
+    """Name of every feature ("way/123") of a GeoDataFrame index, for the picking of the exported scene."""
+    if index.nlevels == 2:
+        return [f"{element}/{osm_id}" for element, osm_id in index]
+    return [str(i) for i in index]
+
+
+def build_scene_batched(gdf, rules, cache_dir=None, feature_ids=False, terrain=None, ground_bounds=None):
+    """
+    Build a 3D scene with one mesh per entity_type from a GeoDataFrame already filtered and
+    which contain 'entity_type' columns.
+    With a cache_dir, the meshes of every feature are kept in cache_dir/<entity_type>.npz (mesh_cache.py).
+    With feature_ids=True, every vertex gets the _FEATURE_ID_0 attribute : the position of its feature in gdf
+    (or the value of its 'feature_id' column if gdf has one), scene.metadata["features"] gives their names.
+    With a terrain (terrain.open_dem), the meshes are draped on the DEM and a "terrain" ground mesh covers
+    ground_bounds (the extent of gdf by default).
+    """
+    scene = trimesh.Scene()
+    sampler = frame_sampler(terrain, gdf, ground_bounds) if terrain is not None else None
+    if HEIGHT_COLUMN not in gdf.columns:
+        gdf = resolve_heights(gdf, rules)
+
+    if "feature_id" in gdf.columns:
+        ids = gdf["feature_id"].to_numpy()
+    else:
+        ids = np.arange(len(gdf))
+        if feature_ids:
+            scene.metadata["features"] = feature_names(gdf.index)
+
+    for typ, positions in gdf.groupby("entity_type", sort=False).indices.items():
+
+        # Select only types which are in json file
+        if typ not in rules:
+            continue
+
+        rule = rules[typ]
+        group = gdf.iloc[positions]
+
+        try:
+            color = np.array(rule["color"], dtype=np.uint8)
+            cache_file = os.path.join(cache_dir, f"{typ}.npz") if cache_dir is not None else None
+            vertices, faces, face_index = entity_arrays(group, rule, cache_file)
+        except Exception as e:
+            print(f"Error creating mesh for {typ} ({len(group)} features) : {e}")
+            print("rule =", rule)
+            continue
+
+        if len(faces) == 0:
+            continue
+
+        vertices[:, 2] += Z_LAYERS.get(typ, 0.0)     # values taken in constant.py file
+
+        if sampler is not None:
+            # Extrusions are moved as a whole (flat roofs), the other meshes follow the ground at every vertex
+            vertex_owner = None
+            if rule.get("mesh_type", "extrusion") == "extrusion":
+                vertex_owner = np.zeros(len(vertices), dtype=np.int64)
+                vertex_owner[faces.ravel()] = np.repeat(face_index, 3)
+            vertices = drape(vertices, sampler, vertex_owner)
+
+        mesh = trimesh.Trimesh(
+            vertices=vertices,
+            faces=faces,
+            vertex_colors=np.tile(color, (len(vertices), 1)),
+            process=False,
+        )
+        mesh.metadata["entity_type"] = typ
+
+        if feature_ids:
+            # Vertices are never shared between features
+            vertex_feature = np.zeros(len(vertices), dtype=np.float32)
+            face_feature = np.where(face_index >= 0, ids[positions][np.maximum(face_index, 0)], -1)
+            vertex_feature[faces.ravel()] = np.repeat(face_feature, 3)
+            mesh.vertex_attributes["_FEATURE_ID_0"] = vertex_feature
+
+        scene.add_geometry(mesh, node_name=typ, geom_name=typ)
+
+    if sampler is not None:
+        bounds = ground_bounds if ground_bounds is not None else gdf.attrs.get("aoi", gdf.total_bounds)
+        mesh = ground_mesh(sampler, bounds, terrain["step"])
+        if feature_ids:
+            mesh.vertex_attributes["_FEATURE_ID_0"] = np.full(len(mesh.vertices), -1, dtype=np.float32)
+        scene.add_geometry(mesh, node_name="terrain", geom_name="terrain")
+
+    return scene
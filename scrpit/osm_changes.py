@@ -0,0 +1,356 @@
+"""
+File: osm_changes.py
+Author: TORREGROSSA Dylan
+Repository: https://github.com/P-Joss-P/map-to-3d.git
+License: GNU GENERAL PUBLIC LICENSE Version 3 (see LICENSE file)
+
+Description:
+    This file will allow users to refresh an index (spatial_index.py) with the OSM change files (osmChange .osc)
+    instead of downloading and processing the whole extract again :
+        - the index command also keeps the osm topology in the index folder (osm_state) : coordinates of every
+          node, nodes of every way (with its polygon rule) and members of every multipolygon relation, in numpy
+          files read memory-mapped
+        - an .osc file is read in streaming (create / modify / delete of nodes, ways and relations)
+        - the affected features are found : changed elements, ways whose nodes moved, relations whose member
+          ways changed. Only these features are built again (same geometry rules as osm_stream.py), projected
+          with the crs and origin of the index and classified
+        - only the tiles of the index which contain an affected feature are rewritten, and only their GLB files
+          are built again (export_index_tiles)
+
+Usage:
+    - python main.py index file.osm --folder index_folder --glb-tiles tiles_folder
+    - python main.py update changes.osc --index index_folder --glb-tiles tiles_folder
+
+Dependencies:
+    - Python 3.13+
+    - library used : array, geopandas, json, numpy, os, pandas, shapely, xml
+
+Notes:
+    - The change files must follow the extract of the index (replication diffs applied in order).
+    - The origin and the crs of the index never change, so the patched tiles stay aligned with the others.
+
+"""
+
+# library import
+from array import array
+import json
+import os
+import xml.etree.ElementTree as ET
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+from shapely.geometry import Point
+
+# function/variable import
+from configuration import COMPACT_EXPORT, DEFAULT_CONFIG, INDEX_DIR, TILE_WORKERS, interest_types
+from functions import detect_entity_types
+from osm_stream import _RELATION_TYPES, _build_relation_geometry, _build_way_geometry, _has_interest_tag
+from osm_stream import _polygon_tags, element_record, iter_osm_elements
+from spatial_index import export_index_tiles, read_feature_tiles, read_manifest, read_tiles, tile_entry, tile_name
+from spatial_index import write_feature_tiles, write_manifest, write_tile
+
+
+STATE_DIR = "osm_state"
+STATE_ARRAYS = ("node_id", "node_coord", "way_id", "way_offset", "way_ref", "way_polygon")
+
+
+##########################
+####### OSM state ########
+##########################
+
+def _ragged_take(offsets, values, rows):
+    """Offsets and values of the rows of a ragged array (values[offsets[i]:offsets[i + 1]] is the row i)."""
+    lengths = offsets[rows + 1] - offsets[rows]
+    new_offsets = np.r_[0, np.cumsum(lengths)]
+    gather = np.repeat(offsets[rows] - new_offsets[:-1], lengths) + np.arange(new_offsets[-1])
+    return new_offsets, values[gather]
+
+
+def read_osm_state(osm_path):
+    """Topology of the whole osm file : node coordinates, way nodes and polygon rule, multipolygon members."""
+    node_id, node_lon, node_lat = array("q"), array("d"), array("d")
+    way_id, way_length, way_ref, way_polygon = array("q"), array("q"), array("q"), array("b")
+    relations = {}
+
+    for element, attrib, tags, children in iter_osm_elements(osm_path, {"node", "way", "relation"}):
+        if element == "node":
+            node_id.append(int(attrib["id"]))
+            node_lon.append(float(attrib["lon"]))
+            node_lat.append(float(attrib["lat"]))
+        elif element == "way":
+            way_id.append(int(attrib["id"]))
+            way_length.append(len(children))
+            way_ref.extend(children)
+            way_polygon.append(_polygon_tags(tags))
+        elif tags.get("type") in _RELATION_TYPES:
+            relations[int(attrib["id"])] = children
+
+    nodes = np.frombuffer(node_id, dtype=np.int64)
+    order = np.argsort(nodes, kind="stable")
+    ways = np.frombuffer(way_id, dtype=np.int64)
+    way_order = np.argsort(ways, kind="stable")
+    offsets, refs = _ragged_take(np.r_[0, np.cumsum(np.frombuffer(way_length, dtype=np.int64))],
+                                 np.frombuffer(way_ref, dtype=np.int64), way_order)
+    return {
+        "node_id": nodes[order],
+        "node_coord": np.stack([np.frombuffer(node_lon), np.frombuffer(node_lat)], axis=1)[order],
+        "way_id": ways[way_order],
+        "way_offset": offsets,
+        "way_ref": refs,
+        "way_polygon": np.frombuffer(way_polygon, dtype=np.int8).astype(bool)[way_order],
+        "relations": relations,
+    }
+
+
+def save_state(folder, state):
+    """Write the state in folder/osm_state (one .npy file per array, relations.json)."""
+    state_dir = os.path.join(folder, STATE_DIR)
+    os.makedirs(state_dir, exist_ok=True)
+    for name in STATE_ARRAYS:
+        path = os.path.join(state_dir, f"{name}.npy")
+        np.save(path + ".tmp.npy", np.asarray(state[name]))
+        os.replace(path + ".tmp.npy", path)     # never leave a half written state
+    with open(os.path.join(state_dir, "relations.json"), "w", encoding="utf-8") as f:
+        json.dump({str(k): v for k, v in state["relations"].items()}, f)
+
+
+def load_state(folder):
+    """State of folder/osm_state, the arrays are memory-mapped."""
+    state_dir = os.path.join(folder, STATE_DIR)
+    state = {name: np.load(os.path.join(state_dir, f"{name}.npy"), mmap_mode="r") for name in STATE_ARRAYS}
+    with open(os.path.join(state_dir, "relations.json"), encoding="utf-8") as f:
+        state["relations"] = {int(k): v for k, v in json.load(f).items()}
+    return state
+
+
+####################################
+####### OSM change files ###########
+####################################
+
+def read_osc(path):
+    """
+    Changes of an osmChange file : {"node": {id: change}, "way": {...}, "relation": {...}} where a change is
+    None for a deletion, or the (attributes, tags, children) of the new version of the element.
+    """
+    changes = {"node": {}, "way": {}, "relation": {}}
+    action = None
+    context = ET.iterparse(path, events=("start", "end"))
+    _, root = next(context)
+
+    for event, elem in context:
+        if event == "start":
+            if elem.tag in ("create", "modify", "delete"):
+                action = elem.tag
+            continue
+        if elem.tag not in changes:
+            continue
+
+        element_id = int(elem.get("id"))
+        changes[elem.tag][element_id] = None if action == "delete" else (dict(elem.attrib), *element_record(elem))
+        elem.clear()
+    root.clear()
+    return changes
+
+
+def _update_state(state, changes):
+    """New state with the changes applied, the ids of the changed nodes and the ids of the affected ways."""
+    # Nodes
+    changed_nodes = np.fromiter(changes["node"].keys(), dtype=np.int64, count=len(changes["node"]))
+    alive = {i: c for i, c in changes["node"].items() if c is not None}
+    keep = ~np.isin(state["node_id"], changed_nodes)
+    node_id = np.r_[state["node_id"][keep], np.fromiter(alive.keys(), dtype=np.int64, count=len(alive))]
+    node_coord = np.concatenate([
+        state["node_coord"][keep],
+        np.array([(float(a["lon"]), float(a["lat"])) for a, _, _ in alive.values()], dtype=float).reshape(-1, 2),
+    ])
+    order = np.argsort(node_id, kind="stable")
+
+    # Ways : changed ways, and ways using a changed node
+    changed_ways = np.fromiter(changes["way"].keys(), dtype=np.int64, count=len(changes["way"]))
+    moved = np.flatnonzero(np.isin(state["way_ref"], changed_nodes))
+    moved_ways = state["way_id"][np.searchsorted(state["way_offset"], moved, side="right") - 1]
+    affected_ways = np.union1d(changed_ways, moved_ways)
+
+    rows = np.flatnonzero(~np.isin(state["way_id"], changed_ways))
+    offsets, refs = _ragged_take(np.asarray(state["way_offset"]), state["way_ref"], rows)
+    new_ways = {i: c for i, c in changes["way"].items() if c is not None}
+    new_refs = [np.asarray(children, dtype=np.int64) for _, _, children in new_ways.values()]
+    way_id = np.r_[state["way_id"][rows], np.fromiter(new_ways.keys(), dtype=np.int64, count=len(new_ways))]
+    way_polygon = np.r_[state["way_polygon"][rows], [_polygon_tags(tags) for _, tags, _ in new_ways.values()]]
+    lengths = np.r_[np.diff(offsets), [len(r) for r in new_refs]].astype(np.int64)
+    refs = np.concatenate([refs, *new_refs]) if new_refs else refs
+    way_order = np.argsort(way_id, kind="stable")
+    way_offset, way_ref = _ragged_take(np.r_[0, np.cumsum(lengths)], refs, way_order)
+
+    # Multipolygon relations
+    relations = dict(state["relations"])
+    for relation_id, change in changes["relation"].items():
+        relations.pop(relation_id, None)
+        if change is not None and change[1].get("type") in _RELATION_TYPES:
+            relations[relation_id] = change[2]
+
+    new_state = {
+        "node_id": node_id[order],
+        "node_coord": node_coord[order],
+        "way_id": way_id[way_order],
+        "way_offset": way_offset,
+        "way_ref": way_ref,
+        "way_polygon": way_polygon.astype(bool)[way_order],
+        "relations": relations,
+    }
+    return new_state, changed_nodes, affected_ways
+
+
+def _way_geometries(state, way_ids, tags):
+    """Geometries (lon/lat) of the ways of way_ids present in the state, tags gives the tags of the features."""
+    positions = np.searchsorted(state["way_id"], way_ids)
+    found = (positions < len(state["way_id"])) & (state["way_id"][np.minimum(positions, len(state["way_id"]) - 1)] == way_ids)
+    way_ids, positions = way_ids[found], positions[found]
+    offsets, refs = _ragged_take(state["way_offset"], state["way_ref"], positions)
+
+    # Coordinates of the needed nodes only
+    needed = np.unique(refs)
+    node_pos = np.minimum(np.searchsorted(state["node_id"], needed), len(state["node_id"]) - 1)
+    known = state["node_id"][node_pos] == needed
+    node_coords = dict(zip(needed[known].tolist(), map(tuple, state["node_coord"][node_pos[known]].tolist())))
+
+    return {
+        int(way_id): _build_way_geometry(int(way_id), refs[offsets[k]:offsets[k + 1]].tolist(),
+                                         tags.get(int(way_id), {}), node_coords, bool(state["way_polygon"][positions[k]]))
+        for k, way_id in enumerate(way_ids)
+    }
+
+
+def _old_tags(frames, element, element_id):
+    """Tags of a feature of the index (None if it is not in the read tiles)."""
+    for frame in frames.values():
+        if (element, element_id) in frame.index:
+            row = frame.loc[(element, element_id)]
+            return {k: v for k, v in row.items() if k not in ("geometry", "entity_type") and pd.notna(v)}
+    return None
+
+
+def _classify(records, manifest):
+    """GeoDataFrame of the rebuilt features, projected, centred and classified as load_and_filter_osm does."""
+    if not records:
+        return None
+    gdf = gpd.GeoDataFrame(records, geometry="geometry", crs="EPSG:4326").set_index(["element", "id"])
+    gdf = gdf[~(gdf.geometry.isna() | gdf.geometry.is_empty)]
+    gdf.loc[:, "geometry"] = gdf.geometry.make_valid()
+    gdf = gdf.to_crs(manifest["crs"])
+    gdf["geometry"] = gdf.translate(xoff=-manifest["origin"]["x"], yoff=-manifest["origin"]["y"])
+
+    available_tags = [col for col in interest_types if col in gdf.columns]
+    if not available_tags or not len(gdf):
+        return None
+    gdf["entity_type"] = detect_entity_types(gdf, available_tags)
+    return gdf[gdf["entity_type"].notnull()]
+
+
+def apply_changes(osc_path, folder=INDEX_DIR, glb_folder=None, config_path=DEFAULT_CONFIG, workers=TILE_WORKERS,
+                  compact=COMPACT_EXPORT):
+    """
+    Apply an osmChange file to the index of folder : only the affected features are built again and only
+    their tiles are rewritten (and exported again in glb_folder when it is given). Returns the patched tiles.
+    """
+    manifest = read_manifest(folder)
+    changes = read_osc(osc_path)
+    keys = set(interest_types)
+    state, changed_nodes, affected_ways = _update_state(load_state(folder), changes)
+
+    affected_relations = set(changes["relation"])
+    affected_set = set(affected_ways.tolist())
+    for relation_id, members in state["relations"].items():
+        if any(m["type"] == "way" and m["ref"] in affected_set for m in members):
+            affected_relations.add(relation_id)
+
+    # Features of the index to remove, and their tiles
+    feature_tiles = read_feature_tiles(folder)
+    removed = (
+        ((feature_tiles["element"] == "node") & feature_tiles["id"].isin(changed_nodes))
+        | ((feature_tiles["element"] == "way") & feature_tiles["id"].isin(affected_ways))
+        | ((feature_tiles["element"] == "relation") & feature_tiles["id"].isin(list(affected_relations)))
+    ).to_numpy()
+    tiles = {tile["name"]: tile for tile in manifest["tiles"]}
+    frames = {name: read_tiles(folder, manifest, [tiles[name]]) for name in feature_tiles["tile"][removed].unique()}
+
+    # Tags of the affected features : the change file, else the index
+    def tags_of(element, element_id):
+        if element_id in changes[element]:
+            change = changes[element][element_id]
+            return change[1] if change is not None else None
+        return _old_tags(frames, element, element_id)
+
+    records = []
+    for node_id, change in changes["node"].items():
+        if change is not None and _has_interest_tag(change[1], keys):
+            records.append({"element": "node", "id": node_id, "geometry": Point(float(change[0]["lon"]),
+                            float(change[0]["lat"])), **change[1]})
+
+    way_tags = {int(i): tags_of("way", int(i)) for i in affected_ways}
+    relation_tags = {i: tags_of("relation", i) for i in affected_relations if i in state["relations"]}
+    relation_tags = {i: t for i, t in relation_tags.items() if t and _has_interest_tag(t, keys)}
+    feature_ways = np.array([i for i, t in way_tags.items() if t and _has_interest_tag(t, keys)], dtype=np.int64)
+    member_ways = np.array(sorted({m["ref"] for i in relation_tags for m in state["relations"][i] if m["type"] == "way"}),
+                           dtype=np.int64)
+
+    way_geoms = _way_geometries(state, np.union1d(feature_ways, member_ways), way_tags)
+    for way_id in feature_ways.tolist():
+        if way_id in way_geoms:
+            records.append({"element": "way", "id": way_id, "geometry": way_geoms[way_id], **way_tags[way_id]})
+    for relation_id, tags in relation_tags.items():
+        geom = _build_relation_geometry(state["relations"][relation_id], way_geoms)
+        records.append({"element": "relation", "id": relation_id, "geometry": geom, **tags})
+    added = _classify(records, manifest)
+
+    # Tiles of the new features (centroid rule, grid of the index)
+    tile_size, (x0, y0) = manifest["tile_size"], manifest["grid_origin"]
+    new_tiles = np.array([], dtype=object)
+    if added is not None and len(added):
+        centroids = added.geometry.centroid
+        ix = np.floor((centroids.x.to_numpy() - x0) / tile_size).astype(np.int64)
+        iy = np.floor((centroids.y.to_numpy() - y0) / tile_size).astype(np.int64)
+        new_tiles = np.array([tile_name(i, j) for i, j in zip(ix, iy)], dtype=object)
+    for name in set(new_tiles) - set(frames):
+        frames[name] = read_tiles(folder, manifest, [tiles[name]]) if name in tiles else None
+
+    # Patch the touched tiles
+    removed_keys = pd.MultiIndex.from_arrays([feature_tiles["element"][removed], feature_tiles["id"][removed]])
+    for name, frame in frames.items():
+        parts = [] if frame is None else [frame[~frame.index.isin(removed_keys)]]
+        if added is not None:
+            parts.append(added[new_tiles == name])
+        parts = [part for part in parts if len(part)]
+        if not parts:
+            tiles.pop(name, None)
+            if os.path.exists(os.path.join(folder, f"{name}.parquet")):
+                os.remove(os.path.join(folder, f"{name}.parquet"))
+            continue
+
+        tile = gpd.GeoDataFrame(pd.concat(parts), geometry="geometry", crs=manifest["crs"])
+        write_tile(folder, name, tile)
+        ix, iy = (int(v) for v in name.split("_")[1:])
+        tiles[name] = tile_entry(name, ix, iy, tile, (x0, y0), tile_size)
+
+    # Manifest, tile of every feature and state
+    if added is not None:
+        manifest["columns"] += [str(col) for col in added.columns if str(col) not in manifest["columns"]]
+        added_index = added.index
+    else:
+        added_index = pd.MultiIndex.from_arrays([[], []])
+    manifest["tiles"] = sorted(tiles.values(), key=lambda tile: tile["name"])
+    write_manifest(folder, manifest)
+
+    kept = feature_tiles[~removed]
+    index = pd.MultiIndex.from_arrays([np.r_[kept["element"].to_numpy(dtype=object), added_index.get_level_values(0)],
+                                       np.r_[kept["id"].to_numpy(), added_index.get_level_values(1)]])
+    write_feature_tiles(folder, index, np.r_[kept["tile"].to_numpy(dtype=object), new_tiles])
+    save_state(folder, state)
+
+    patched = sorted(frames)
+    n_added = 0 if added is None else len(added)
+    print(f"Changes : {int(removed.sum())} features removed, {n_added} built, {len(patched)} tiles patched")
+
+    if glb_folder is not None:
+        export_index_tiles(folder, glb_folder, patched, config_path, workers, compact)
+    return patched
@@ -0,0 +1,279 @@
+"""
+File: osm_stream.py
+Author: TORREGROSSA Dylan
+Repository: https://github.com/P-Joss-P/map-to-3d.git
+License: GNU GENERAL PUBLIC LICENSE Version 3 (see LICENSE file)
+
+Description:
+    This file will allow users to read an OSM/XML file in streaming (xml iterparse) and to keep
+    in memory only the elements which carry one of the tags of the interest_types list.
+    The result is the same GeoDataFrame as ox.features_from_xml followed by the interest_types filter,
+    so it could be given directly to load_and_filter_osm(gdf=...).
+
+Usage:
+    - python main.py
+
+Dependencies:
+    - Python 3.13+
+    - library used : geopandas, numpy, shapely, xml
+
+Notes:
+    - The file is read in three streaming passes because of the osm order (nodes, ways, relations) :
+        1. relations : keep the multipolygon/boundary relations with an interest tag, note their member ways
+        2. ways : keep the ways with an interest tag or used by a kept relation, note their nodes
+                  (tagged nodes with an interest tag are kept during this pass too)
+        3. nodes : keep only the coordinates of the noted nodes
+      Peak memory therefore depends on the number of kept features, not on the file size.
+    - Way and relation geometries are built with the same rules as osmnx : the functions of the
+      "OSM geometries" section are adapted from osmnx 2.1 features.py (MIT license, Geoff Boeing).
+      osmnx itself is not imported, because it imports matplotlib.pyplot and networkx, which a headless
+      conversion does not need.
+
+"""
+
+# library import
+import xml.etree.ElementTree as ET
+import geopandas as gpd
+import numpy as np
+from shapely import prepare
+from shapely.errors import GEOSException
+from shapely.geometry import LineString, MultiLineString, MultiPolygon, Point, Polygon
+from shapely.ops import linemerge, polygonize, unary_union
+
+# function/variable import
+from configuration import interest_types
+
+
+##############################
+####### OSM geometries #######
+##############################
+
+# OSM relations handled (multipolygons, with or without holes)
+_RELATION_TYPES = {"boundary", "multipolygon"}
+
+# Tags which make a closed way a polygon (https://wiki.openstreetmap.org/wiki/Overpass_turbo/Polygon_Features)
+_POLYGON_FEATURES = {
+    "aeroway": {"polygon": "blocklist", "values": {"taxiway"}},
+    "amenity": {"polygon": "all"},
+    "area": {"polygon": "all"},
+    "area:highway": {"polygon": "all"},
+    "barrier": {"polygon": "passlist", "values": {"city_wall", "ditch", "hedge", "retaining_wall", "spikes"}},
+    "boundary": {"polygon": "all"},
+    "building": {"polygon": "all"},
+    "building:part": {"polygon": "all"},
+    "craft": {"polygon": "all"},
+    "golf": {"polygon": "all"},
+    "highway": {"polygon": "passlist", "values": {"elevator", "escape", "rest_area", "services"}},
+    "historic": {"polygon": "all"},
+    "indoor": {"polygon": "all"},
+    "landuse": {"polygon": "all"},
+    "leisure": {"polygon": "all"},
+    "man_made": {"polygon": "blocklist", "values": {"cutline", "embankment", "pipeline"}},
+    "military": {"polygon": "all"},
+    "natural": {"polygon": "blocklist", "values": {"arete", "cliff", "coastline", "ridge", "tree_row"}},
+    "office": {"polygon": "all"},
+    "place": {"polygon": "all"},
+    "power": {"polygon": "passlist", "values": {"generator", "plant", "substation", "transformer"}},
+    "public_transport": {"polygon": "all"},
+    "railway": {"polygon": "passlist", "values": {"platform", "roundhouse", "station", "turntable"}},
+    "ruins": {"polygon": "all"},
+    "shop": {"polygon": "all"},
+    "tourism": {"polygon": "all"},
+    "waterway": {"polygon": "passlist", "values": {"boatyard", "dam", "dock", "riverbank"}},
+}
+
+
+def _polygon_tags(way_tags):
+    """True if the tags of a closed way make it a polygon (not area=no, a tag of _POLYGON_FEATURES)."""
+    if way_tags.get("area") == "no":
+        return False
+    for tag in way_tags.keys() & _POLYGON_FEATURES.keys():
+        rule = _POLYGON_FEATURES[tag]["polygon"]
+        values = _POLYGON_FEATURES[tag].get("values", set())
+        if (
+            rule == "all"
+            or (rule == "passlist" and way_tags[tag] in values)
+            or (rule == "blocklist" and way_tags[tag] not in values)
+        ):
+            return True
+    return False
+
+
+def _build_way_geometry(way_id, way_nodes, way_tags, node_coords, polygon_tags=None):
+    """
+    Geometry of a way from the coordinates of its nodes : a LineString, or a Polygon when the way is closed,
+    not tagged area=no and carries a tag of _POLYGON_FEATURES.
+    polygon_tags gives the result of _polygon_tags when the tags of the way are not kept (osm_changes.py).
+    """
+    if polygon_tags is None:
+        polygon_tags = _polygon_tags(way_tags)
+    geom_type = Polygon if way_nodes[0] == way_nodes[-1] and polygon_tags else LineString
+
+    try:
+        return geom_type(node_coords[node] for node in way_nodes)
+    except (GEOSException, KeyError, ValueError) as e:
+        print(f"Could not build geometry of way {way_id}: {e!r}")
+        return geom_type()
+
+
+def _build_relation_geometry(members, way_geoms):
+    """
+    (Multi)Polygon of a multipolygon relation from the geometries of its member ways :
+    the outer and inner fragments are merged and polygonized, then the inner polygons are holes.
+    An empty Polygon is returned when a member way is missing.
+    """
+    inner_linestrings, outer_linestrings = [], []
+    inner_polygons, outer_polygons = [], []
+
+    for member in members:
+        if member["type"] == "way":
+            geom = way_geoms.get(member["ref"])
+            if geom is None:
+                print(f"Cannot build relation geometry, missing member way {member['ref']}")
+                return Polygon()
+            role = member["role"]
+            if role == "outer" and geom.geom_type == "LineString":
+                outer_linestrings.append(geom)
+            elif role == "outer" and geom.geom_type == "Polygon":
+                outer_polygons.append(geom)
+            elif role == "inner" and geom.geom_type == "LineString":
+                inner_linestrings.append(geom)
+            elif role == "inner" and geom.geom_type == "Polygon":
+                inner_polygons.append(geom)
+
+    # merge/polygonize the linestring fragments
+    for linestrings, polygons in ((outer_linestrings, outer_polygons), (inner_linestrings, inner_polygons)):
+        merged = linemerge(linestrings)
+        if merged.geom_type == "LineString":
+            merged = MultiLineString([merged])
+        for linestring in merged.geoms:
+            polygons += polygonize(linestring)
+
+    return _remove_polygon_holes(outer_polygons, inner_polygons)
+
+
+def _remove_polygon_holes(outer_polygons, inner_polygons):
+    """Subtract from every outer polygon the inner polygons it contains (islands in holes are kept)."""
+    if len(inner_polygons) == 0:
+        geometry = unary_union(outer_polygons)
+    else:
+        polygons_with_holes = []
+        for outer in outer_polygons:
+            prepare(outer)
+            holes = [inner for inner in inner_polygons if outer.contains(inner)]
+            polygons_with_holes.append(outer.difference(unary_union(holes)))
+        geometry = unary_union(polygons_with_holes)
+
+    if isinstance(geometry, (Polygon, MultiPolygon)):
+        return geometry
+    return Polygon()
+
+
+###########################
+####### OSM reading #######
+###########################
+
+def element_record(elem):
+    """(tags, children) of an osm xml element : children are the node refs of a way or the members of a relation."""
+    tags = {t.get("k"): t.get("v") for t in elem.iter("tag")}
+    if elem.tag == "way":
+        children = [int(nd.get("ref")) for nd in elem.iter("nd")]
+    elif elem.tag == "relation":
+        children = [
+            {"type": m.get("type"), "ref": int(m.get("ref")), "role": m.get("role")}
+            for m in elem.iter("member")
+        ]
+    else:
+        children = None
+    return tags, children
+
+
+def iter_osm_elements(path, element_types):
+    """
+    Yield one by one the (type, attributes, tags, children) of the osm elements whose type is in element_types.
+    children are the node refs of a way or the members of a relation.
+    Every element is cleared once read so the xml tree never grows.
+    """
+    context = ET.iterparse(path, events=("start", "end"))
+    _, root = next(context)
+
+    for event, elem in context:
+        if event != "end" or elem.tag not in ("node", "way", "relation"):
+            continue
+
+        if elem.tag in element_types:
+            yield (elem.tag, elem.attrib, *element_record(elem))
+
+        elem.clear()
+        root.clear()
+
+
+def _has_interest_tag(tags, keys):
+    """True if the element carries at least one of the interest tags with a value."""
+    return any(tags.get(key) for key in keys)
+
+
+def read_osm_filtered(path, interest_types=interest_types):
+    """
+    Stream an OSM/XML file and build the GeoDataFrame of the elements carrying one of the interest_types tags.
+    The frame is indexed by (element, id) and in EPSG:4326, as the one of ox.features_from_xml.
+    """
+    keys = set(interest_types)
+
+    # 1st pass : relations
+    relations = {}
+    member_ways = set()
+    for _, attrib, tags, members in iter_osm_elements(path, {"relation"}):
+        if tags.get("type") in _RELATION_TYPES and _has_interest_tag(tags, keys):
+            relations[int(attrib["id"])] = (tags, members)
+            member_ways.update(m["ref"] for m in members if m["type"] == "way")
+
+    # 2nd pass : ways (and tagged nodes, which don't need other elements)
+    features = []
+    ways = {}
+    needed_nodes = set()
+    for element, attrib, tags, refs in iter_osm_elements(path, {"node", "way"}):
+        tags.pop("geometry", None)
+        if element == "node":
+            if _has_interest_tag(tags, keys):
+                point = Point(float(attrib["lon"]), float(attrib["lat"]))
+                features.append({"element": "node", "id": int(attrib["id"]), "geometry": point, **tags})
+            continue
+
+        way_id = int(attrib["id"])
+        is_feature = _has_interest_tag(tags, keys)
+        if is_feature or way_id in member_ways:
+            ways[way_id] = (tags, np.array(refs, dtype=np.int64), is_feature)
+            needed_nodes.update(refs)
+
+    # 3rd pass : coordinates of the needed nodes only
+    node_coords = {}
+    for _, attrib, _, _ in iter_osm_elements(path, {"node"}):
+        node_id = int(attrib["id"])
+        if node_id in needed_nodes:
+            node_coords[node_id] = (float(attrib["lon"]), float(attrib["lat"]))
+    needed_nodes.clear()
+
+    # Geometries of ways and relations
+    way_geoms = {}
+    for way_id, (tags, refs, is_feature) in ways.items():
+        geom = _build_way_geometry(way_id, refs.tolist(), tags, node_coords)
+        way_geoms[way_id] = geom
+        if is_feature:
+            features.append({"element": "way", "id": way_id, "geometry": geom, **tags})
+    del ways, node_coords
+
+    for relation_id, (tags, members) in relations.items():
+        geom = _build_relation_geometry(members, way_geoms)
+        features.append({"element": "relation", "id": relation_id, "geometry": geom, **tags})
+    del way_geoms
+
+    if not features:
+        raise ValueError("None of the interest_types are present in this OSM file!")
+
+    gdf = gpd.GeoDataFrame(features, geometry="geometry", crs="EPSG:4326").set_index(["element", "id"]).sort_index()
+
+    # Same cleaning as osmnx : no empty geometries, valid geometries, no empty columns
+    gdf = gdf[~(gdf["geometry"].isna() | gdf["geometry"].is_empty)]
+    gdf.loc[:, "geometry"] = gdf["geometry"].make_valid()
+    return gdf.dropna(axis="columns", how="all")
@@ -0,0 +1,179 @@
+"""
+File: plotting.py
+Author: TORREGROSSA Dylan
+Repository: https://github.com/P-Joss-P/map-to-3d.git
+License: GNU GENERAL PUBLIC LICENSE Version 3 (see LICENSE file)
+
+Description:
+    This file will contain the rendering of the osm2plot figures (functions.py), made for the QA runs
+    which render many areas :
+        - the masks of every interest type are computed in one pass over the GeoDataFrame
+        - the geometries are drawn with one matplotlib collection per geometry kind (polygons, lines, points)
+          instead of one GeoDataFrame.plot call per layer
+        - the per-type png files are rendered in a process pool, every worker reusing a single figure
+        - the figures are matplotlib.figure.Figure objects : no pyplot state, they are freed as soon as saved
+
+Usage:
+    - python main.py plot
+
+Dependencies:
+    - Python 3.13+
+    - library used : concurrent.futures, matplotlib, numpy, os, shapely
+
+Notes:
+    - This module is imported by osm2plot only, so the 3D scene creation never loads matplotlib.
+
+"""
+
+# library import
+from concurrent.futures import ProcessPoolExecutor
+import os
+import matplotlib
+from matplotlib.collections import LineCollection, PathCollection
+import matplotlib.colors as mcolors
+from matplotlib.figure import Figure
+import matplotlib.patches as mpatches
+from matplotlib.path import Path
+import numpy as np
+import shapely
+
+# function/variable import
+from configuration import PLOT_WORKERS
+
+
+FIGSIZE = (10, 10)
+
+
+def type_masks(gdf, interest_types):
+    """Boolean matrix (features x interest_types) of the features carrying every type, in one pass."""
+    return gdf.reindex(columns=list(interest_types)).notna().to_numpy(dtype=bool)
+
+
+def type_colors(n_types):
+    """n_types colors taken regularly in the jet colormap."""
+    colormap = matplotlib.colormaps["jet"].resampled(n_types)
+    return [mcolors.to_hex(colormap(i)) for i in range(n_types)]
+
+
+def _split(coords, owner):
+    """Split coords in one array per consecutive value of owner."""
+    return np.split(coords, np.flatnonzero(np.diff(owner)) + 1)
+
+
+def geometry_paths(geoms):
+    """
+    Drawing data of an array of shapely geometries : one compound Path per polygon (holes included),
+    the coordinates of every line and the coordinates of the points.
+    """
+    parts = shapely.get_parts(np.asarray(geoms, dtype=object))
+    type_id = shapely.get_type_id(parts)
+
+    # Polygons : exterior counter-clockwise and holes clockwise, so the holes are not filled
+    paths = []
+    polygons = shapely.orient_polygons(parts[type_id == 3])
+    if len(polygons):
+        rings, ring_polygon = shapely.get_rings(polygons, return_index=True)
+        coords, coord_ring = shapely.get_coordinates(rings, return_index=True)
+        codes = np.full(len(coords), Path.LINETO, dtype=Path.code_type)
+        starts = np.r_[0, np.flatnonzero(np.diff(coord_ring)) + 1]
+        codes[starts] = Path.MOVETO
+        codes[np.r_[starts[1:] - 1, len(coords) - 1]] = Path.CLOSEPOLY
+
+        owner = ring_polygon[coord_ring]
+        paths = [Path(c, k) for c, k in zip(_split(coords, owner), _split(codes, owner))]
+
+    # Lines and rings
+    lines = []
+    line_parts = parts[(type_id == 1) | (type_id == 2)]
+    if len(line_parts):
+        coords, owner = shapely.get_coordinates(line_parts, return_index=True)
+        lines = _split(coords, owner)
+
+    points = shapely.get_coordinates(parts[type_id == 0])
+    return paths, lines, points
+
+
+def draw(ax, geoms, color, aspect, label=None):
+    """Draw geoms on ax with one collection per geometry kind, then fit the view."""
+    paths, lines, points = geometry_paths(geoms)
+    if paths:
+        ax.add_collection(PathCollection(paths, facecolor=color, edgecolor=color, label=label), autolim=True)
+    if lines:
+        ax.add_collection(LineCollection(lines, colors=color, label=label), autolim=True)
+    if len(points):
+        ax.scatter(points[:, 0], points[:, 1], color=color, label=label)
+    ax.autoscale_view()
+    ax.set_aspect(aspect)
+
+
+def plot_aspect(gdf):
+    """Aspect of the axes : corrected by the latitude for a geographic crs, as GeoDataFrame.plot does."""
+    if gdf.crs is not None and gdf.crs.is_geographic and len(gdf):
+        miny, maxy = gdf.total_bounds[[1, 3]]
+        return 1 / np.cos(np.radians((miny + maxy) / 2))
+    return "equal"
+
+
+def render_types(job):
+    """
+    Worker : render the png file of every (type_name, color, wkbs) of the job with a single figure,
+    cleared between two types. Returns the written files.
+    """
+    layers, folder, aspect = job
+    fig = Figure(figsize=FIGSIZE)
+    written = []
+    for type_name, color, wkbs in layers:
+        fig.clear()
+        ax = fig.add_subplot()
+        draw(ax, shapely.from_wkb(wkbs), color, aspect)
+        ax.set_title(type_name)
+
+        path = os.path.join(folder, f"{type_name}.png")
+        fig.savefig(path)
+        written.append(path)
+    fig.clear()
+    return written
+
+
+def render_layers(gdf, interest_types, folder, workers=PLOT_WORKERS):
+    """
+    One png file per interest type present in gdf, rendered in a process pool (workers=1 : in this process).
+    The types are dealt between the workers, every worker renders its types with a reused figure.
+    """
+    os.makedirs(folder, exist_ok=True)
+    masks = type_masks(gdf, interest_types)
+    colors = type_colors(len(interest_types))
+    geoms = np.asarray(gdf.geometry.values, dtype=object)
+    aspect = plot_aspect(gdf)
+
+    layers = [(type_name, colors[i], shapely.to_wkb(geoms[masks[:, i]]))
+              for i, type_name in enumerate(interest_types) if masks[:, i].any()]
+    if not layers:
+        return []
+
+    workers = min(workers or os.cpu_count() or 1, len(layers))
+    if workers == 1:
+        return render_types((layers, folder, aspect))
+
+    jobs = [(layers[k::workers], folder, aspect) for k in range(workers)]
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        return [path for written in executor.map(render_types, jobs) for path in written]
+
+
+def combined_figure(gdf, interest_types, fig=None):
+    """Figure with every interest type in its color and the legend of the categories."""
+    masks = type_masks(gdf, interest_types)
+    colors = type_colors(len(interest_types))
+    geoms = np.asarray(gdf.geometry.values, dtype=object)
+
+    fig = fig if fig is not None else Figure(figsize=FIGSIZE)
+    ax = fig.add_subplot()
+    legend_patches = []
+    for i, type_name in enumerate(interest_types):
+        if masks[:, i].any():
+            draw(ax, geoms[masks[:, i]], colors[i], plot_aspect(gdf), label=type_name)
+        legend_patches.append(mpatches.Patch(color=colors[i], label=type_name))
+
+    ax.legend(handles=legend_patches, title="Categories", loc="upper left", bbox_to_anchor=(1, 1))
+    ax.set_title("Final plot type colored")
+    return fig
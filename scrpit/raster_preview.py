@@ -0,0 +1,216 @@
+"""
+File: raster_preview.py
+Author: TORREGROSSA Dylan
+Repository: https://github.com/P-Joss-P/map-to-3d.git
+License: GNU GENERAL PUBLIC LICENSE Version 3 (see LICENSE file)
+
+Description:
+    This file will allow users to make a quick top-down png preview of the filtered data, without matplotlib.
+    The projected geometries are rasterized by entity_type straight into a numpy RGB image, with the colors of
+    mapping_entities.json :
+        - polygons : scanline filling (even-odd rule, holes included) of every entity_type at once, the spans
+          are accumulated in a difference image and summed along the rows
+        - lines : points sampled every half pixel along the segments, thickened to the width of their rule
+        - points : a 3 x 3 pixels square
+    The layers are drawn from the flat surfaces to the lines and then the buildings.
+
+Usage:
+    - python main.py raster file.osm -o preview.png --size 4096
+
+Dependencies:
+    - Python 3.13+
+    - library used : numpy, shapely, struct, zlib
+
+Notes:
+    - The png file is written here (zlib), no image library is needed.
+
+"""
+
+# library import
+import struct
+import zlib
+import numpy as np
+import shapely
+
+# function/variable import
+from configuration import DEFAULT_CONFIG
+from constant import Z_LAYERS
+from meshing import load_rules
+
+
+BACKGROUND = (255, 255, 255)
+DRAW_ORDER = {"flat": 0, "extrusion_line": 1, "extrusion": 2}     # flat surfaces first, buildings on top
+
+
+####### Rasterization #######
+
+def polygon_mask(polygons, to_pixels, shape):
+    """Pixels (H x W boolean) whose centre is inside one of the polygons (even-odd rule per polygon)."""
+    height, width = shape
+    rings, ring_owner = shapely.get_rings(polygons, return_index=True)
+    coords, coord_ring = shapely.get_coordinates(rings, return_index=True)
+    if len(coords) < 2:
+        return np.zeros(shape, dtype=bool)
+    px, py = to_pixels(coords)
+
+    # Edges of the rings, with the polygon which owns them
+    same = coord_ring[1:] == coord_ring[:-1]
+    x0, y0, x1, y1 = px[:-1][same], py[:-1][same], px[1:][same], py[1:][same]
+    owner = ring_owner[coord_ring[:-1][same]]
+
+    # Rows whose centre (row + 0.5) is crossed by every edge (half open, so a vertex is counted once)
+    first = np.clip(np.ceil(np.minimum(y0, y1) - 0.5), 0, height).astype(np.int64)
+    last = np.clip(np.ceil(np.maximum(y0, y1) - 0.5), 0, height).astype(np.int64)
+    counts = last - first
+
+    edge = np.repeat(np.arange(len(x0)), counts)
+    row = first[edge] + np.arange(len(edge)) - np.repeat(np.cumsum(counts) - counts, counts)
+    y = row + 0.5
+    x = x0[edge] + (y - y0[edge]) * (x1 - x0)[edge] / (y1 - y0)[edge]
+
+    # Crossings sorted by polygon, row and x : they come by pairs (start and end of a span)
+    order = np.lexsort((x, row, owner[edge]))
+    x, row = x[order], row[order]
+    start = np.clip(np.ceil(x[0::2] - 0.5), 0, width).astype(np.int64)
+    end = np.clip(np.ceil(x[1::2] - 0.5), 0, width).astype(np.int64)
+    row = row[0::2]
+
+    # Difference image of the spans, summed along the rows
+    size = height * (width + 1)
+    diff = np.bincount(row * (width + 1) + start, minlength=size) - np.bincount(row * (width + 1) + end, minlength=size)
+    return np.cumsum(diff.reshape(height, width + 1)[:, :width], axis=1) > 0
+
+
+def line_mask(lines, to_pixels, shape, radius=0):
+    """Pixels (H x W boolean) under the lines, thickened by radius pixels."""
+    height, width = shape
+    coords, owner = shapely.get_coordinates(lines, return_index=True)
+    mask = np.zeros(shape, dtype=bool)
+    if len(coords) < 2:
+        return mask
+    px, py = to_pixels(coords)
+
+    same = owner[1:] == owner[:-1]
+    x0, y0 = px[:-1][same], py[:-1][same]
+    dx, dy = (px[1:] - px[:-1])[same], (py[1:] - py[:-1])[same]
+
+    # One sample every half pixel along every segment
+    counts = (np.ceil(2 * np.maximum(np.abs(dx), np.abs(dy))) + 1).astype(np.int64)
+    segment = np.repeat(np.arange(len(x0)), counts)
+    t = (np.arange(len(segment)) - np.repeat(np.cumsum(counts) - counts, counts)) / np.maximum(counts - 1, 1)[segment]
+    cols = np.floor(x0[segment] + t * dx[segment]).astype(np.int64)
+    rows = np.floor(y0[segment] + t * dy[segment]).astype(np.int64)
+    return _stamp(mask, rows, cols, radius)
+
+
+def point_mask(points, to_pixels, shape, radius=1):
+    """Pixels (H x W boolean) of a (2 radius + 1) square around every point."""
+    coords = shapely.get_coordinates(points)
+    mask = np.zeros(shape, dtype=bool)
+    if len(coords) == 0:
+        return mask
+    px, py = to_pixels(coords)
+    return _stamp(mask, np.floor(py).astype(np.int64), np.floor(px).astype(np.int64), radius)
+
+
+def _stamp(mask, rows, cols, radius):
+    """Set the pixels (rows, cols) of mask, and their neighbours up to radius, the outside ones are ignored."""
+    height, width = mask.shape
+    for dr in range(-radius, radius + 1):
+        for dc in range(-radius, radius + 1):
+            r, c = rows + dr, cols + dc
+            inside = (r >= 0) & (r < height) & (c >= 0) & (c < width)
+            mask[r[inside], c[inside]] = True
+    return mask
+
+
+####### Preview #######
+
+def layer_order(entity_types, rules):
+    """Entity types sorted in drawing order (mesh_type of their rule, then Z_LAYERS)."""
+    return sorted(entity_types, key=lambda typ: (DRAW_ORDER.get(rules[typ].get("mesh_type", "extrusion"), 2),
+                                                 Z_LAYERS.get(typ, 0.0)))
+
+
+def render_preview(gdf, config_path=DEFAULT_CONFIG, size=2048, resolution=None, bounds=None):
+    """
+    RGB image (H x W x 3 uint8) of the filtered and projected gdf, one color per entity_type (mapping_entities.json).
+    The resolution (m per pixel) is chosen so that the longest side of bounds has size pixels, unless it is given.
+    bounds are by default the area of interest of gdf (aoi.py) or its total bounds.
+    Returns the image and the (minx, miny, maxx, maxy, resolution) of its pixels.
+    """
+    rules = load_rules(config_path)
+    if bounds is None:
+        bounds = gdf.attrs.get("aoi", gdf.total_bounds)
+    minx, miny, maxx, maxy = bounds
+    if not np.all(np.isfinite(bounds)):
+        raise ValueError("Nothing to draw : the GeoDataFrame is empty")
+    if resolution is None:
+        resolution = max(maxx - minx, maxy - miny, 1e-9) / size
+    shape = (max(int(np.ceil((maxy - miny) / resolution)), 1), max(int(np.ceil((maxx - minx) / resolution)), 1))
+
+    def to_pixels(coords):
+        return (coords[:, 0] - minx) / resolution, (maxy - coords[:, 1]) / resolution     # north up
+
+    # Opaque layers only write their palette index (1 byte per pixel), the colors are applied once at the end.
+    # Label 0 keeps the pixel of image, which receives the translucent layers.
+    image = np.empty((*shape, 3), dtype=np.uint8)
+    image[:] = BACKGROUND
+    label = np.zeros(shape, dtype=np.uint8)
+    palette = [np.asarray(BACKGROUND, dtype=np.uint8)]
+
+    def flush():
+        painted = label > 0
+        image[painted] = np.asarray(palette)[label[painted]]
+        label[:] = 0
+        del palette[1:]
+
+    geoms = np.asarray(gdf.geometry.values, dtype=object)
+    entity = gdf["entity_type"].to_numpy()
+    for typ in layer_order([t for t in gdf["entity_type"].dropna().unique() if t in rules], rules):
+        rule = rules[typ]
+        parts = shapely.get_parts(geoms[entity == typ])
+        type_id = shapely.get_type_id(parts)
+        radius = int(float(rule.get("width", 0.0)) / 2 / resolution) if rule.get("mesh_type") == "extrusion_line" else 0
+
+        mask = polygon_mask(parts[type_id == 3], to_pixels, shape)
+        mask |= line_mask(parts[(type_id == 1) | (type_id == 2)], to_pixels, shape, radius)
+        mask |= point_mask(parts[type_id == 0], to_pixels, shape)
+
+        color = np.clip(np.asarray(rule.get("color", [128, 128, 128, 255]), dtype=np.int64), 0, 255)
+        alpha = color[3] if len(color) > 3 else 255
+        if alpha == 255 and len(palette) < 256:
+            palette.append(color[:3].astype(np.uint8))
+            label[mask] = len(palette) - 1
+        else:
+            flush()
+            blended = (image[mask].astype(np.int64) * (255 - alpha) + color[:3] * alpha) // 255
+            image[mask] = blended.astype(np.uint8)
+    flush()
+
+    return image, (minx, miny, maxx, maxy, resolution)
+
+
+def write_png(path, image):
+    """Write an RGB (H x W x 3 uint8) image in a png file."""
+    height, width, _ = image.shape
+    raw = np.zeros((height, width * 3 + 1), dtype=np.uint8)     # filter byte 0 at the start of every row
+    raw[:, 1:] = image.reshape(height, width * 3)
+
+    def chunk(kind, data):
+        return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data) & 0xFFFFFFFF)
+
+    with open(path, "wb") as f:
+        f.write(b"\x89PNG\r\n\x1a\n")
+        f.write(chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0)))
+        f.write(chunk(b"IDAT", zlib.compress(raw.tobytes(), 6)))
+        f.write(chunk(b"IEND", b""))
+    return path
+
+
+def export_preview(gdf, path, config_path=DEFAULT_CONFIG, size=2048, resolution=None):
+    """Render the preview of gdf and write it in a png file."""
+    image, (_, _, _, _, resolution) = render_preview(gdf, config_path, size, resolution)
+    write_png(path, image)
+    print(f"Preview {image.shape[1]} x {image.shape[0]} px ({resolution:.2f} m/px) → {path}")
+    return path
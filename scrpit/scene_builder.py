@@ -0,0 +1,180 @@
+"""
+File: scene_builder.py
+Author: TORREGROSSA Dylan
+Repository: https://github.com/P-Joss-P/map-to-3d.git
+License: GNU GENERAL PUBLIC LICENSE Version 3 (see LICENSE file)
+
+Description:
+    This file will contain the creation of the 3D scene from the filtered GeoDataFrame (build_scene),
+    batched (meshing.py) or feature by feature with the mesh_from_* functions.
+    It never imports geopandas, osmnx or matplotlib (its project modules heights, meshing and terrain don't
+    either), so a script which only builds scenes doesn't pay their import (see the "imports" benchmark
+    of benchmark.py).
+
+Usage:
+    - python main.py
+
+Dependencies:
+    - Python 3.13+
+    - library used : numpy, shapely, trimesh (and pyproj, imported by terrain.py only with a DEM in another crs)
+
+"""
+
+# library import
+import numpy as np
+from shapely.geometry import LineString, MultiLineString, MultiPolygon, Polygon
+import trimesh
+from trimesh.creation import extrude_polygon
+
+# function/variable import
+from configuration import BATCHED_SCENE, DEFAULT_CONFIG, FEATURE_IDS, MESH_CACHE_DIR, USE_MESH_CACHE
+from constant import BASE_COLUMN, HEIGHT_COLUMN, Z_LAYERS
+from heights import resolve_heights
+from meshing import build_scene_batched, feature_names, load_rules
+from terrain import drape, frame_sampler, ground_mesh
+
+
+########################
+####### 3D scene #######
+########################
+
+def build_scene(gdf, config_path=DEFAULT_CONFIG, batched=BATCHED_SCENE, mesh_cache=USE_MESH_CACHE, terrain=None):
+    """
+    Build a 3D scene from a GeoDataFrame already filtered and which contain 
+    'entity_type' columns.
+    With batched=True, all the features of an entity_type are meshed together (see meshing.py)
+    and the scene contains one node per entity_type. With batched=False, every feature
+    keeps its own node.
+    With mesh_cache=True (batched only), the meshes of unchanged features are read from MESH_CACHE_DIR.
+    With a terrain (terrain.open_dem), the scene is draped on the DEM with a ground mesh (terrain.py).
+    """
+
+    # Load and read json file
+    rules = load_rules(config_path)
+    gdf = resolve_heights(gdf, rules)       # once for the whole frame (heights.py)
+
+    if batched:
+        scene = build_scene_batched(gdf, rules, MESH_CACHE_DIR if mesh_cache else None, FEATURE_IDS, terrain)
+        scene.metadata["origin"] = gdf.attrs.get("origin")
+        return scene
+
+    # Variable and scene initialization 
+    scene = trimesh.Scene()
+    scene.metadata["origin"] = gdf.attrs.get("origin")
+    if FEATURE_IDS:     # names of the feature_id of the meshes, as in build_scene_batched
+        scene.metadata["features"] = feature_names(gdf.index)
+    sampler = frame_sampler(terrain, gdf) if terrain is not None else None
+    counter = 0
+
+    for position, (idx, row) in enumerate(gdf.iterrows()):
+        typ = row["entity_type"]
+        geom = row.geometry
+
+        # Select only types which are in json file
+        if typ not in rules:
+            continue
+
+        rule = rules[typ]
+        color_3Dobject = rule["color"]
+
+        mesh_type = rule.get("mesh_type", "extrusion")
+
+        z_offset = 0 # default value
+        z_offset = Z_LAYERS.get(typ, 0.0) # values taken in constant.py file
+
+
+        try:
+            if mesh_type == "extrusion":
+                if not isinstance(geom, (Polygon, MultiPolygon)):
+                    continue
+                # height and base resolved from the tags (heights.py)
+                mesh = mesh_from_polygon(geom, height=row[HEIGHT_COLUMN], color=tuple(rule.get("color")))
+                mesh.apply_translation([0, 0, row[BASE_COLUMN]])
+
+            elif mesh_type == "extrusion_line":
+                if not isinstance(geom, (LineString, MultiLineString)):
+                    continue
+                w = float(rule.get("width", 3.0))
+                mesh = mesh_from_line(geom, width=w, height=row[HEIGHT_COLUMN], color=tuple(rule.get("color")))
+                mesh.apply_translation([0, 0, row[BASE_COLUMN]])
+
+            elif mesh_type == "flat":
+                if not isinstance(geom, (Polygon, MultiPolygon)):
+                    continue
+                mesh = mesh_from_flat_surface(geom, color=tuple(rule.get("color")))
+
+            else:
+                print(f"Unknown mesh_type '{mesh_type}' for type '{typ}' — skipping")
+                continue
+            
+            # Secure the export 
+            mesh.apply_translation([0, 0, z_offset])
+            if sampler is not None:     # a building is moved as a whole, the other meshes follow the ground
+                owner = np.zeros(len(mesh.vertices), dtype=np.int64) if mesh_type == "extrusion" else None
+                mesh.vertices = drape(mesh.vertices, sampler, owner)
+            mesh.apply_transform(trimesh.transformations.identity_matrix())
+            mesh.metadata.update(entity_type=typ, feature_id=position)     # used by scene_export.flatten_scene
+
+            scene.add_geometry(mesh, node_name=f"{typ}_{counter}")
+            counter += 1
+
+        except Exception as e:
+            print(f"Error creating mesh for {typ} (index OSM {idx} (index {counter})) : {e}")
+            print("mesh_type =", mesh_type)
+            print("geom type =", geom.geom_type)
+            print("rule =", rule)
+            continue
+
+    if sampler is not None:
+        scene.add_geometry(ground_mesh(sampler, gdf.attrs.get("aoi", gdf.total_bounds), terrain["step"]),
+                           node_name="terrain", geom_name="terrain")
+    return scene
+
+
+def mesh_from_polygon(poly, height, color):
+    """This function will create a new mesh for a polygon type osm object."""
+    meshes = []
+
+    if isinstance(poly, MultiPolygon):
+        for p in poly.geoms:
+            meshes.append(mesh_from_polygon(p, height, color))
+        return trimesh.util.concatenate(meshes)
+
+    mesh = extrude_polygon(poly, height=height)     # Extrude the geometry of a given height
+
+    # Color the vertex of the mesh
+    n_vertices = mesh.vertices.shape[0]
+    mesh.visual.vertex_colors = np.tile(np.array(color, dtype=np.uint8), (n_vertices, 1))
+    return mesh
+
+def mesh_from_line(line:LineString, width:float, height:float, color=[255, 255, 0, 255]):
+    """Extrude line to small prism"""
+    if line.is_empty:
+        raise ValueError("Empty LineString")
+
+    poly = line.buffer(width / 2, cap_style=2)
+
+    if poly.is_empty:
+        raise ValueError("Buffer resulted in empty geometry")
+
+    if not isinstance(poly, (Polygon, MultiPolygon)):
+        raise TypeError(f"Buffered line produced {poly.geom_type}")
+
+    return mesh_from_polygon(poly, height, color=color)
+
+def mesh_from_flat_surface(poly:Polygon, color=[100, 100, 255, 150]):
+    """Extrude Flat mesh from z = 0"""
+    height = 0.1 # default heignt for flat surface
+    poly = force_polygon(poly)
+    if poly is None:
+        raise ValueError("Geometry is not a polygon")
+
+    return mesh_from_polygon(poly, height, color=color)
+
+def force_polygon(geom):
+    if isinstance(geom, Polygon):
+        return geom
+    elif isinstance(geom, MultiPolygon):
+        return max(geom.geoms, key=lambda g: g.area)
+    else:
+        return None
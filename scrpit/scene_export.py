@@ -0,0 +1,104 @@
+"""
+File: scene_export.py
+Author: TORREGROSSA Dylan
+Repository: https://github.com/P-Joss-P/map-to-3d.git
+License: GNU GENERAL PUBLIC LICENSE Version 3 (see LICENSE file)
+
+Description:
+    This file will allow users to reduce the number of nodes and meshes of a scene before its glb export.
+    The geometries are merged by entity_type and color (material) in a few large meshes, which makes the
+    export faster and the file lighter to load in Blender or in the simulation viewer.
+    The feature of every vertex could be kept in the _FEATURE_ID_0 attribute (FEATURE_IDS), so picking still
+    works. It is a float per vertex (4 bytes : the vertex attributes of a glb are 4 bytes aligned), so it is
+    opt-in, the flattened file is then lighter than the export of the per-feature scene.
+    With COMPACT_EXPORT, the glb is written quantized by glb_writer.py instead of trimesh.
+
+Usage:
+    - python main.py
+
+Dependencies:
+    - Python 3.13+
+    - library used : numpy, os, time, trimesh
+
+"""
+
+# library import
+import os
+import time
+import numpy as np
+import trimesh
+
+# function/variable import
+from configuration import COMPACT_EXPORT, FEATURE_IDS, FLATTEN_EXPORT
+from glb_writer import write_scene
+
+
+def _vertex_feature_ids(mesh):
+    """_FEATURE_ID_0 of every vertex of a mesh (-1 when unknown)."""
+    if "_FEATURE_ID_0" in mesh.vertex_attributes:
+        return np.asarray(mesh.vertex_attributes["_FEATURE_ID_0"], dtype=np.float32)
+    return np.full(len(mesh.vertices), mesh.metadata.get("feature_id", -1), dtype=np.float32)
+
+
+def flatten_scene(scene, feature_ids=FEATURE_IDS):
+    """
+    Merge every geometry of the scene (with its node transform) in one mesh per (entity_type, color).
+    The entity_type is read in the metadata of the meshes, the name of the node is used otherwise.
+    """
+    groups = {}
+    for node in scene.graph.nodes_geometry:
+        transform, geom_name = scene.graph[node]
+        mesh = scene.geometry[geom_name]
+        if len(mesh.faces) == 0:
+            continue
+
+        typ = mesh.metadata.get("entity_type", node)
+        color = tuple(int(c) for c in mesh.visual.vertex_colors[0])
+        groups.setdefault((typ, color), []).append((transform, mesh))
+
+    flat = trimesh.Scene()
+    flat.metadata.update(scene.metadata)
+
+    for (typ, color), items in groups.items():
+        offsets = np.cumsum([0] + [len(mesh.vertices) for _, mesh in items])
+
+        mesh = trimesh.Trimesh(
+            vertices=np.concatenate([trimesh.transform_points(m.vertices, t) for t, m in items]),
+            faces=np.concatenate([m.faces + offset for (_, m), offset in zip(items, offsets)]),
+            vertex_colors=np.concatenate([m.visual.vertex_colors for _, m in items]),
+            process=False,
+        )
+        mesh.metadata["entity_type"] = typ
+        if feature_ids:
+            mesh.vertex_attributes["_FEATURE_ID_0"] = np.concatenate([_vertex_feature_ids(m) for _, m in items])
+
+        # Several colors for one entity_type : one mesh per color
+        name = typ if typ not in flat.geometry else f"{typ}_{len(flat.geometry)}"
+        flat.add_geometry(mesh, node_name=name, geom_name=name)
+
+    return flat
+
+
+def export_scene(scene, path, flatten=FLATTEN_EXPORT, feature_ids=FEATURE_IDS, compact=COMPACT_EXPORT):
+    """
+    Export the scene in a glb file, after its flattening if flatten=True.
+    compact=True writes a quantized glb with one material per color (glb_writer.py).
+    Print the number of nodes before/after the flattening, the export time and the size of the file.
+    """
+    nodes_before = len(scene.graph.nodes_geometry)
+
+    start = time.perf_counter()
+    if flatten:
+        scene = flatten_scene(scene, feature_ids)
+    flatten_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    if compact:
+        write_scene(scene, path, compact=True, feature_ids=feature_ids)
+    else:
+        scene.export(path)
+    export_time = time.perf_counter() - start
+
+    print(f"Export : {nodes_before} → {len(scene.graph.nodes_geometry)} nodes "
+          f"(flatten {flatten_time:.2f} s, export {export_time:.2f} s) → {path} ({os.path.getsize(path) / 1e6:.2f} MB)")
+    return scene
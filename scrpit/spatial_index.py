@@ -0,0 +1,240 @@
+"""
+File: spatial_index.py
+Author: TORREGROSSA Dylan
+Repository: https://github.com/P-Joss-P/map-to-3d.git
+License: GNU GENERAL PUBLIC LICENSE Version 3 (see LICENSE file)
+
+Description:
+    This file will allow users to convert a big osm extract once into a tiled index on disk, so that the
+    next scene builds on the same extract never parse it again :
+        - the features are loaded by load_and_filter_osm (projected, centred, entity_type given)
+        - they are split in square tiles of INDEX_TILE_SIZE metres (tile of their centroid, see tiling.py)
+        - every tile is written in its own GeoParquet file, with the bbox of every feature (covering column)
+        - manifest.json keeps the origin, the crs and the extent of the features of every tile
+    The tiles can also be meshed in one GLB per tile (export_index_tiles), which osm_changes.py patches.
+    A query (query_index) reads the manifest, opens only the tiles whose extent meets the area (memory-mapped
+    parquet files, rows filtered on the bbox column) and gives the result to aoi.extract_area.
+
+Usage:
+    - python main.py index file.osm --folder index_folder
+    - python main.py build --index index_folder --bbox 5.70 45.17 5.74 45.20
+    - python main.py index file.osm --folder index_folder --glb-tiles tiles_folder
+    - query_index(index_folder, (5.70, 45.17, 5.74, 45.20))
+
+Dependencies:
+    - Python 3.13+
+    - library used : geopandas, json, numpy, os, pandas, pyarrow, shapely
+
+Notes:
+    - A feature is stored in a single tile, but the extent of a tile is the one of its features (not of the
+      grid cell), so a query also opens the tiles of the large features which cross it.
+    - The index is patched by the osm change files (osm_changes.py, update command), not by a new osm file :
+      run the index command again for a new extract.
+    - The tiles are read with pyarrow and converted to a GeoDataFrame once per query : geopandas.read_parquet
+      would parse the crs of every file again (tens of ms per tile).
+
+"""
+
+# library import
+import json
+import os
+import geopandas as gpd
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+import shapely
+
+# function/variable import
+from aoi import area_geometry, extract_area
+from configuration import AREA_BUFFER, AREA_CLIP, AREA_CRS, INDEX_DIR, INDEX_TILE_SIZE, INDEX_TILES_DIR
+from configuration import COMPACT_EXPORT, DEFAULT_CONFIG, TILE_WORKERS
+from tiling import assign_tiles, export_tile_frames, tile_bounds
+
+
+MANIFEST = "manifest.json"
+FEATURES = "features.parquet"
+
+
+def tile_name(ix, iy):
+    return f"tile_{ix}_{iy}"
+
+
+def write_tile(folder, name, gdf):
+    """Write the GeoParquet file of a tile (only the tags used in it, bbox covering column)."""
+    gdf.dropna(axis="columns", how="all").to_parquet(os.path.join(folder, f"{name}.parquet"), write_covering_bbox=True)
+
+
+def tile_entry(name, ix, iy, gdf, grid_origin, tile_size):
+    """Manifest entry of a tile : grid cell, extent of its features and number of features."""
+    return {
+        "name": name,
+        "file": f"{name}.parquet",
+        "ix": int(ix),
+        "iy": int(iy),
+        "bounds": tile_bounds(ix, iy, grid_origin, tile_size),
+        "extent": [float(v) for v in gdf.total_bounds],
+        "features": int(len(gdf)),
+    }
+
+
+def build_index_store(gdf, folder=INDEX_DIR, tile_size=INDEX_TILE_SIZE, source=None):
+    """
+    Write the filtered GeoDataFrame of load_and_filter_osm in one GeoParquet file per tile of folder,
+    the tile of every feature (features.parquet) and the manifest.json of the tiles. Returns the path of the manifest.
+    """
+    os.makedirs(folder, exist_ok=True)
+    for name in os.listdir(folder):      # tiles of a previous index
+        if name.startswith("tile_") and name.endswith(".parquet"):
+            os.remove(os.path.join(folder, name))
+
+    ix, iy, grid_origin = assign_tiles(gdf, tile_size)
+    keys = np.stack([ix, iy], axis=1)
+    unique, tile_of = np.unique(keys, axis=0, return_inverse=True)
+    tile_of = tile_of.ravel()
+
+    tiles = []
+    for k, key in enumerate(unique):
+        name = tile_name(*key)
+        tile = gdf.iloc[np.flatnonzero(tile_of == k)]
+        write_tile(folder, name, tile)
+        tiles.append(tile_entry(name, *key, tile, grid_origin, tile_size))
+
+    names = np.array([tile["name"] for tile in tiles], dtype=object)
+    write_feature_tiles(folder, gdf.index, names[tile_of])
+
+    manifest = {
+        "source": source,
+        "crs": gdf.crs.to_string(),
+        "origin": gdf.attrs.get("origin"),
+        "tile_size": tile_size,
+        "grid_origin": [float(v) for v in grid_origin],
+        "columns": [str(col) for col in gdf.columns],
+        "tiles": tiles,
+    }
+    manifest_path = write_manifest(folder, manifest)
+    print(f"Index : {len(gdf)} features in {len(tiles)} tiles → {folder}")
+    return manifest_path
+
+
+def read_manifest(folder=INDEX_DIR):
+    """manifest.json of the index of folder."""
+    with open(os.path.join(folder, MANIFEST), encoding="utf-8") as f:
+        return json.load(f)
+
+
+def write_manifest(folder, manifest):
+    path = os.path.join(folder, MANIFEST)
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2)
+    return path
+
+
+def write_feature_tiles(folder, index, tiles):
+    """features.parquet : tile of every (element, id) feature of the index."""
+    pd.DataFrame({
+        "element": index.get_level_values(0).astype(str),
+        "id": index.get_level_values(1).astype(np.int64),
+        "tile": np.asarray(tiles, dtype=object).astype(str),
+    }).to_parquet(os.path.join(folder, FEATURES), index=False)
+
+
+def read_feature_tiles(folder=INDEX_DIR):
+    return pd.read_parquet(os.path.join(folder, FEATURES), memory_map=True)
+
+
+def read_tiles(folder, manifest, tiles, columns=None, row_filter=None):
+    """
+    GeoDataFrame of the rows of the given tiles (manifest entries) of the index, read with memory-mapped files.
+    The tiles are converted to a GeoDataFrame once : geopandas.read_parquet would parse the crs of every file.
+    """
+    if columns is not None:
+        columns = list(dict.fromkeys([*columns, "geometry"]))
+    tables = [pq.read_table(os.path.join(folder, tile["file"]), columns=columns, filters=row_filter,
+                            memory_map=True, use_pandas_metadata=True)
+              for tile in tiles]
+
+    if tables:
+        df = pa.concat_tables(tables, promote_options="permissive").to_pandas()
+        df = df.reindex(columns=[col for col in manifest["columns"] if col in df.columns])     # order of the osm file
+        gdf = gpd.GeoDataFrame(df, geometry=shapely.from_wkb(df["geometry"].to_numpy()), crs=manifest["crs"])
+    else:
+        gdf = gpd.GeoDataFrame(geometry=[], crs=manifest["crs"])
+    gdf.attrs = {"origin": manifest["origin"]}
+    return gdf
+
+
+def query_index(folder=INDEX_DIR, area=None, area_crs=AREA_CRS, buffer=AREA_BUFFER, clip=AREA_CLIP, columns=None):
+    """
+    Features of the index of folder in the area (see aoi.area_geometry), the whole index when area is None.
+    Only the tiles whose extent meets the area are read, with memory-mapped files and a filter on the bbox
+    of the rows. columns restricts the read columns (the geometry is always read).
+    """
+    manifest = read_manifest(folder)
+
+    # Area in the scene coordinates, with an empty frame carrying the crs and origin of the index
+    empty = gpd.GeoDataFrame(geometry=[], crs=manifest["crs"])
+    empty.attrs["origin"] = manifest["origin"]
+    geometry = area_geometry(area, empty, area_crs, buffer) if area is not None else None
+
+    extents = np.array([tile["extent"] for tile in manifest["tiles"]], dtype=float).reshape(-1, 4)
+    if geometry is not None:
+        minx, miny, maxx, maxy = geometry.bounds
+        hit = (extents[:, 0] <= maxx) & (extents[:, 2] >= minx) & (extents[:, 1] <= maxy) & (extents[:, 3] >= miny)
+    else:
+        hit = np.ones(len(extents), dtype=bool)
+
+    # Rows whose bbox (covering column) meets the area, from the memory-mapped tiles
+    row_filter = None
+    if geometry is not None:
+        row_filter = ((pc.field("bbox", "xmin") <= maxx) & (pc.field("bbox", "xmax") >= minx)
+                      & (pc.field("bbox", "ymin") <= maxy) & (pc.field("bbox", "ymax") >= miny))
+    gdf = read_tiles(folder, manifest, [tile for tile, keep in zip(manifest["tiles"], hit) if keep], columns, row_filter)
+    print(f"Index : {int(hit.sum())} / {len(hit)} tiles read, {len(gdf)} features")
+
+    if geometry is None:
+        return gdf
+    return extract_area(gdf, geometry, "scene", 0.0, clip)
+
+
+def export_index_tiles(folder=INDEX_DIR, glb_folder=INDEX_TILES_DIR, names=None, config_path=DEFAULT_CONFIG,
+                       workers=TILE_WORKERS, compact=COMPACT_EXPORT):
+    """
+    One GLB per tile of the index (tiling.export_tile_frames), with the manifest.json of the GLB tiles.
+    With names, only these tiles are built again and the existing manifest is updated (osm_changes.py).
+    """
+    manifest = read_manifest(folder)
+    tiles = {tile["name"]: tile for tile in manifest["tiles"]}
+    names = list(tiles) if names is None else list(names)
+
+    frames = ((name, read_tiles(folder, manifest, [tiles[name]])) for name in names if name in tiles)
+    written = export_tile_frames(frames, glb_folder, config_path, workers, compact)
+
+    glb_manifest_path = os.path.join(glb_folder, MANIFEST)
+    glb_tiles = {}
+    if os.path.exists(glb_manifest_path) and len(names) < len(tiles):
+        with open(glb_manifest_path, encoding="utf-8") as f:
+            glb_tiles = {tile["name"]: tile for tile in json.load(f)["tiles"]}
+    for name in names:
+        glb_tiles.pop(name, None)
+        glb_path = os.path.join(glb_folder, f"{name}.glb")
+        if name not in tiles and os.path.exists(glb_path):       # tile removed from the index
+            os.remove(glb_path)
+        if written.get(name):
+            glb_tiles[name] = {**{k: tiles[name][k] for k in ("name", "ix", "iy", "bounds", "extent", "features")},
+                               "file": f"{name}.glb"}
+
+    glb_manifest = {
+        "crs": manifest["crs"],
+        "origin": manifest["origin"],
+        "tile_size": manifest["tile_size"],
+        "border_rule": "centroid",
+        "tiles": sorted(glb_tiles.values(), key=lambda tile: tile["name"]),
+    }
+    os.makedirs(glb_folder, exist_ok=True)
+    with open(glb_manifest_path, "w", encoding="utf-8") as f:
+        json.dump(glb_manifest, f, indent=4)
+
+    print(f"{sum(bool(w) for w in written.values())} tiles exported → {glb_folder}")
+    return glb_manifest
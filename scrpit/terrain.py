@@ -0,0 +1,375 @@
+"""
+File: terrain.py
+Author: TORREGROSSA Dylan
+Repository: https://github.com/P-Joss-P/map-to-3d.git
+License: GNU GENERAL PUBLIC LICENSE Version 3 (see LICENSE file)
+
+Description:
+    This file will allow users to put the scene on the relief of a local DEM raster (digital elevation model)
+    instead of the flat Z_LAYERS offsets :
+        - the DEM is a GeoTIFF (uncompressed or deflate, strips or tiles) or an ESRI ASCII grid (.asc). The ASCII
+          grid is converted once, row by row, in a .npy file of DEM_CACHE_DIR. Both are read memory-mapped and only
+          the window under the scene is read (only the strips/tiles of the GeoTIFF which meet it)
+        - the elevation is sampled at the vertices with a vectorized bilinear interpolation, the scene coordinates
+          being converted to the crs of the DEM with pyproj
+        - the features are draped : every vertex of the flat surfaces and lines follows the ground, the
+          extrusions (buildings) are moved as a whole to the lowest ground under them, so their roofs stay flat
+        - a decimated ground mesh (one vertex every TERRAIN_STEP metres) covers the scene or every tile
+    Z_LAYERS stays the offset above the ground.
+
+Usage:
+    - python main.py build file.osm --dem dem.tif
+    - python main.py build file.osm --dem dem.asc --terrain-step 20
+
+Dependencies:
+    - Python 3.13+
+    - library used : functools, hashlib, json, numpy, os, pyproj, struct, trimesh, zlib
+
+Notes:
+    - No raster library is needed : the TIFF structure is read here. LZW compressed or floating point predictor
+      GeoTIFF files are refused, convert them with gdal_translate -co COMPRESS=DEFLATE (or NONE).
+    - The crs of the DEM comes from the GeoTIFF keys or from the .prj file of the ASCII grid, DEM_CRS (configuration.py)
+      overrides it. Without crs, the DEM is taken in the crs of the scene.
+    - open_dem returns a small dict (no open file), so it can be sent to the process pool of the tiles.
+
+"""
+
+# library import
+from functools import lru_cache
+import hashlib
+import json
+import os
+import struct
+import zlib
+import numpy as np
+import trimesh
+
+# function/variable import
+from configuration import DEM_CACHE_DIR, DEM_CRS, TERRAIN_COLOR, TERRAIN_STEP
+from constant import Z_LAYERS
+
+
+#######################
+####### GeoTIFF #######
+#######################
+
+# TIFF field types : (struct format, size)
+_TIFF_TYPES = {1: ("B", 1), 2: ("s", 1), 3: ("H", 2), 4: ("I", 4), 5: ("II", 8), 6: ("b", 1), 7: ("B", 1),
+               8: ("h", 2), 9: ("i", 4), 11: ("f", 4), 12: ("d", 8), 16: ("Q", 8)}
+_SAMPLE_KINDS = {1: "u", 2: "i", 3: "f"}
+
+
+def _read_ifd(f, order, offset):
+    """Tags {tag: tuple of values (or str)} of the first image file directory of a TIFF file."""
+    f.seek(offset)
+    (count,) = struct.unpack(order + "H", f.read(2))
+    tags = {}
+    for _ in range(count):
+        tag, typ, n, value = struct.unpack(order + "HHI4s", f.read(12))
+        fmt, size = _TIFF_TYPES.get(typ, ("B", 1))
+        if typ == 2:
+            fmt = f"{n}s"
+        elif typ == 5:
+            fmt = "I" * 2 * n
+        else:
+            fmt = fmt * n
+        data = value
+        if struct.calcsize(order + fmt) > 4:
+            position = f.tell()
+            f.seek(struct.unpack(order + "I", value)[0])
+            data = f.read(struct.calcsize(order + fmt))
+            f.seek(position)
+        values = struct.unpack(order + fmt, data[:struct.calcsize(order + fmt)])
+        tags[tag] = values[0].decode("latin-1").strip("\x00 ") if typ == 2 else values
+    return tags
+
+
+def _geokey_crs(geokeys):
+    """crs ("EPSG:xxxx") of the GeoKeyDirectory of a GeoTIFF, None if it is user defined."""
+    if not geokeys:
+        return None, False
+    keys = {geokeys[i]: (geokeys[i + 1], geokeys[i + 3]) for i in range(4, 4 + 4 * geokeys[3], 4)}
+    pixel_is_point = keys.get(1025, (0, 1))[1] == 2
+    for key in (3072, 2048):        # ProjectedCSTypeGeoKey, GeographicTypeGeoKey
+        location, value = keys.get(key, (None, None))
+        if location == 0 and value not in (None, 0, 32767):
+            return f"EPSG:{value}", pixel_is_point
+    return None, pixel_is_point
+
+
+def _open_tiff(path):
+    with open(path, "rb") as f:
+        header = f.read(8)
+        order = {b"II": "<", b"MM": ">"}.get(header[:2])
+        if order is None or struct.unpack(order + "H", header[2:4])[0] != 42:
+            raise ValueError(f"{path} is not a TIFF file (BigTIFF is not supported)")
+        tags = _read_ifd(f, order, struct.unpack(order + "I", header[4:8])[0])
+
+    compression = tags.get(259, (1,))[0]
+    predictor = tags.get(317, (1,))[0]
+    if compression not in (1, 8, 32946) or predictor not in (1, 2) or tags.get(277, (1,))[0] != 1:
+        raise ValueError(f"{path} : only single band, uncompressed or deflate GeoTIFF files are read "
+                         "(gdal_translate -co COMPRESS=DEFLATE)")
+
+    width, height = tags[256][0], tags[257][0]
+    if 322 in tags:     # tiled
+        block = (tags[323][0], tags[322][0])
+        offsets, counts = tags[324], tags[325]
+    else:
+        block = (tags.get(278, (height,))[0], width)
+        offsets, counts = tags[273], tags[279]
+    dtype = np.dtype(f"{order}{_SAMPLE_KINDS[tags.get(339, (1,))[0]]}{tags[258][0] // 8}")
+
+    scale, tiepoint = tags.get(33550), tags.get(33922)
+    if scale is None or tiepoint is None:
+        raise ValueError(f"{path} has no georeferencing (ModelPixelScale / ModelTiepoint tags)")
+    crs, pixel_is_point = _geokey_crs(tags.get(34735))
+    x0 = tiepoint[3] - tiepoint[0] * scale[0] - (scale[0] / 2 if pixel_is_point else 0.0)
+    y0 = tiepoint[4] + tiepoint[1] * scale[1] + (scale[1] / 2 if pixel_is_point else 0.0)
+    nodata = tags.get(42113)
+
+    return {
+        "kind": "tiff",
+        "path": path,
+        "shape": (height, width),
+        "transform": (x0, y0, scale[0], -scale[1]),      # top left corner, cell size (dy < 0 : north up)
+        "crs": crs,
+        "nodata": float(nodata) if nodata not in (None, "") else None,
+        "dtype": dtype.str,
+        "block": block,
+        "offsets": list(offsets),
+        "counts": list(counts),
+        "compression": compression,
+        "predictor": predictor,
+    }
+
+
+def _read_tiff_window(dem, rows, cols):
+    """Window (rows, cols slices) of a GeoTIFF : only the strips/tiles which meet it are read."""
+    height, width = dem["shape"]
+    bh, bw = dem["block"]
+    across = -(-width // bw)
+    dtype = np.dtype(dem["dtype"])
+    data = np.memmap(dem["path"], dtype=np.uint8, mode="r")
+    window = np.empty((rows.stop - rows.start, cols.stop - cols.start), dtype=dtype)
+
+    for br in range(rows.start // bh, -(-rows.stop // bh)):
+        for bc in range(cols.start // bw, -(-cols.stop // bw)):
+            k = br * across + bc
+            raw = data[dem["offsets"][k]:dem["offsets"][k] + dem["counts"][k]]
+            if dem["compression"] != 1:
+                raw = zlib.decompress(raw.tobytes())
+            n_rows = min(bh, height - br * bh) if bw == width else bh      # the last strip could be shorter
+            block = np.frombuffer(raw, dtype=dtype, count=n_rows * bw).reshape(n_rows, bw)
+            if dem["predictor"] == 2:
+                block = np.cumsum(block, axis=1, dtype=dtype)
+
+            r0, c0 = br * bh, bc * bw
+            r = slice(max(rows.start, r0), min(rows.stop, r0 + n_rows))
+            c = slice(max(cols.start, c0), min(cols.stop, c0 + bw))
+            window[r.start - rows.start:r.stop - rows.start, c.start - cols.start:c.stop - cols.start] = \
+                block[r.start - r0:r.stop - r0, c.start - c0:c.stop - c0]
+    return window
+
+
+##########################
+####### ASCII grid #######
+##########################
+
+def _open_ascii(path, cache_dir=DEM_CACHE_DIR):
+    """
+    Header of an ESRI ASCII grid, its values being converted once (row by row) in a .npy file of cache_dir.
+    The .npy file is named by a hash of the path, size and date of the grid, so it is made again when the grid changes.
+    """
+    stat = os.stat(path)
+    key = f"{os.path.abspath(path)}\0{stat.st_size}\0{stat.st_mtime_ns}"
+    key = hashlib.sha256(key.encode("utf-8")).hexdigest()[:24]
+    npy_path = os.path.join(cache_dir, f"{key}.npy")
+    json_path = os.path.join(cache_dir, f"{key}.json")
+
+    if not (os.path.exists(npy_path) and os.path.exists(json_path)):
+        os.makedirs(cache_dir, exist_ok=True)
+        with open(path, encoding="ascii") as f:
+            header = {}
+            while len(header) < 6:
+                position = f.tell()
+                line = f.readline()
+                name, *value = line.split()
+                if not name[0].isalpha():       # NODATA_value is optional
+                    f.seek(position)
+                    break
+                header[name.lower()] = float(value[0])
+
+            height, width = int(header["nrows"]), int(header["ncols"])
+            values = np.lib.format.open_memmap(npy_path + ".tmp.npy", mode="w+", dtype=np.float32,
+                                               shape=(height * width,))
+            filled = 0
+            for line in f:
+                row = np.array(line.split(), dtype=np.float32)
+                values[filled:filled + len(row)] = row
+                filled += len(row)
+            values.flush()
+            del values
+        os.replace(npy_path + ".tmp.npy", npy_path)
+
+        cell = header["cellsize"]
+        x0 = header["xllcorner"] if "xllcorner" in header else header["xllcenter"] - cell / 2
+        y0 = (header["yllcorner"] if "yllcorner" in header else header["yllcenter"] - cell / 2) + height * cell
+        prj = os.path.splitext(path)[0] + ".prj"
+        crs = None
+        if os.path.exists(prj):
+            from pyproj import CRS
+            with open(prj, encoding="utf-8") as f:
+                crs = CRS.from_wkt(f.read()).to_string()
+        with open(json_path, "w", encoding="utf-8") as f:
+            json.dump({"shape": [height, width], "transform": [x0, y0, cell, -cell], "crs": crs,
+                       "nodata": header.get("nodata_value")}, f)
+
+    with open(json_path, encoding="utf-8") as f:
+        header = json.load(f)
+    return {"kind": "npy", "path": npy_path, "shape": tuple(header["shape"]), "transform": tuple(header["transform"]),
+            "crs": header["crs"], "nodata": header["nodata"]}
+
+
+###################
+####### DEM #######
+###################
+
+def open_dem(path, crs=DEM_CRS, step=TERRAIN_STEP, cache_dir=DEM_CACHE_DIR):
+    """
+    Header of a DEM (GeoTIFF or ASCII grid) : shape, transform (x0, y0, dx, dy), crs, nodata, and the step (m)
+    of the ground meshes built on it. An ASCII grid is converted in cache_dir.
+    """
+    if os.path.splitext(path)[1].lower() in (".asc", ".txt"):
+        dem = _open_ascii(path, cache_dir)
+    else:
+        dem = _open_tiff(path)
+    if crs is not None:
+        dem["crs"] = crs
+    dem["step"] = step
+    return dem
+
+
+def read_window(dem, rows, cols):
+    """Elevations (float32, NaN where there is no data) of the rows and cols slices of the DEM."""
+    if dem["kind"] == "npy":
+        grid = np.load(dem["path"], mmap_mode="r").reshape(dem["shape"])
+        window = np.array(grid[rows, cols], dtype=np.float32)
+    else:
+        window = _read_tiff_window(dem, rows, cols).astype(np.float32)
+    if dem["nodata"] is not None:
+        window[window == np.float32(dem["nodata"])] = np.nan
+    return window
+
+
+@lru_cache(maxsize=8)
+def _transformer(scene_crs, dem_crs):
+    from pyproj import Transformer
+    return Transformer.from_crs(scene_crs, dem_crs, always_xy=True)
+
+
+def _to_dem(sampler, x, y):
+    """Scene coordinates (centred, crs of the scene) → coordinates of the DEM."""
+    x = np.asarray(x, dtype=float) + sampler["origin"]["x"]
+    y = np.asarray(y, dtype=float) + sampler["origin"]["y"]
+    if sampler["dem_crs"] is None or sampler["scene_crs"] is None or sampler["dem_crs"] == sampler["scene_crs"]:
+        return x, y
+    return _transformer(sampler["scene_crs"], sampler["dem_crs"]).transform(x, y)
+
+
+def terrain_sampler(dem, bounds, scene_crs=None, origin=None, margin=2):
+    """
+    Elevation window of the DEM under bounds (minx, miny, maxx, maxy in the scene coordinates), ready for elevation.
+    origin is the scene origin in scene_crs (gdf.attrs["origin"] of load_and_filter_osm).
+    """
+    sampler = {"dem_crs": dem["crs"], "scene_crs": scene_crs, "origin": origin or {"x": 0.0, "y": 0.0}}
+
+    # Bounds in the crs of the DEM (edges densified, the crs could be rotated)
+    minx, miny, maxx, maxy = bounds
+    t = np.linspace(0.0, 1.0, 17)
+    edge_x = np.r_[minx + t * (maxx - minx), np.full(17, maxx), maxx - t * (maxx - minx), np.full(17, minx)]
+    edge_y = np.r_[np.full(17, miny), miny + t * (maxy - miny), np.full(17, maxy), maxy - t * (maxy - miny)]
+    dem_x, dem_y = _to_dem(sampler, edge_x, edge_y)
+
+    x0, y0, dx, dy = dem["transform"]
+    height, width = dem["shape"]
+    col0 = int(np.clip(np.floor((np.min(dem_x) - x0) / dx) - margin, 0, width))
+    col1 = int(np.clip(np.ceil((np.max(dem_x) - x0) / dx) + margin, 0, width))
+    row0 = int(np.clip(np.floor((np.max(dem_y) - y0) / dy) - margin, 0, height))
+    row1 = int(np.clip(np.ceil((np.min(dem_y) - y0) / dy) + margin, 0, height))
+    if col1 <= col0 or row1 <= row0:
+        raise ValueError("The DEM doesn't cover the scene (check its crs, or DEM_CRS in configuration.py)")
+
+    grid = read_window(dem, slice(row0, row1), slice(col0, col1))
+    fill = np.nanmin(grid) if np.isfinite(grid).any() else 0.0
+    sampler["grid"] = np.where(np.isfinite(grid), grid, fill)      # holes of the DEM : lowest ground of the window
+    sampler["transform"] = (x0 + col0 * dx, y0 + row0 * dy, dx, dy)
+    return sampler
+
+
+def frame_sampler(dem, gdf, bounds=None):
+    """terrain_sampler under the features of gdf (and bounds), with the crs and origin of gdf."""
+    extent = np.asarray(gdf.total_bounds, dtype=float)
+    if bounds is not None:
+        extent = np.r_[np.fmin(extent[:2], bounds[:2]), np.fmax(extent[2:], bounds[2:])]
+    crs = gdf.crs.to_string() if gdf.crs is not None else None
+    return terrain_sampler(dem, extent, crs, gdf.attrs.get("origin"))
+
+
+def elevation(sampler, x, y):
+    """Bilinear interpolation of the ground elevation at the scene coordinates (x, y), vectorized."""
+    dem_x, dem_y = _to_dem(sampler, x, y)
+    x0, y0, dx, dy = sampler["transform"]
+    grid = sampler["grid"]
+
+    # Position between the centres of the cells, clamped to the window
+    u = np.clip((np.asarray(dem_x) - x0) / dx - 0.5, 0.0, grid.shape[1] - 1.0)
+    v = np.clip((np.asarray(dem_y) - y0) / dy - 0.5, 0.0, grid.shape[0] - 1.0)
+    c0 = np.minimum(u.astype(np.int64), grid.shape[1] - 2) if grid.shape[1] > 1 else np.zeros(u.shape, np.int64)
+    r0 = np.minimum(v.astype(np.int64), grid.shape[0] - 2) if grid.shape[0] > 1 else np.zeros(v.shape, np.int64)
+    c1, r1 = np.minimum(c0 + 1, grid.shape[1] - 1), np.minimum(r0 + 1, grid.shape[0] - 1)
+    fu, fv = u - c0, v - r0
+
+    top = grid[r0, c0] * (1 - fu) + grid[r0, c1] * fu
+    bottom = grid[r1, c0] * (1 - fu) + grid[r1, c1] * fu
+    return top * (1 - fv) + bottom * fv
+
+
+def drape(vertices, sampler, vertex_feature=None):
+    """
+    Vertices moved on the ground. With vertex_feature (feature of every vertex), every feature is moved as a
+    whole to the lowest ground under its vertices (flat roofs stay flat), else every vertex follows the ground.
+    """
+    ground = elevation(sampler, vertices[:, 0], vertices[:, 1])
+    if vertex_feature is not None:
+        _, owner = np.unique(vertex_feature, return_inverse=True)
+        lowest = np.full(owner.max() + 1 if len(owner) else 0, np.inf)
+        np.minimum.at(lowest, owner, ground)
+        ground = lowest[owner]
+
+    draped = vertices.copy()
+    draped[:, 2] += ground
+    return draped
+
+
+def ground_mesh(sampler, bounds, step=TERRAIN_STEP, color=TERRAIN_COLOR):
+    """
+    Ground mesh of bounds (scene coordinates) with one vertex every step metres. The grid is aligned on the
+    multiples of step, so the ground meshes of two adjacent tiles share their border vertices.
+    """
+    minx, miny, maxx, maxy = bounds
+    xs = np.unique(np.r_[minx, np.arange(np.ceil(minx / step), np.floor(maxx / step) + 1) * step, maxx])
+    ys = np.unique(np.r_[miny, np.arange(np.ceil(miny / step), np.floor(maxy / step) + 1) * step, maxy])
+    gx, gy = np.meshgrid(xs, ys)
+    vertices = np.column_stack([gx.ravel(), gy.ravel(), np.zeros(gx.size)])
+    vertices[:, 2] = elevation(sampler, vertices[:, 0], vertices[:, 1]) + Z_LAYERS.get("ground", 0.0)
+
+    # Two triangles per cell (counter-clockwise seen from above)
+    nx = len(xs)
+    i = (np.arange(len(ys) - 1)[:, None] * nx + np.arange(nx - 1)[None, :]).ravel()
+    faces = np.concatenate([np.column_stack([i, i + 1, i + nx + 1]), np.column_stack([i, i + nx + 1, i + nx])])
+
+    mesh = trimesh.Trimesh(vertices=vertices, faces=faces, vertex_colors=np.tile(np.asarray(color, dtype=np.uint8),
+                           (len(vertices), 1)), process=False)
+    mesh.metadata["entity_type"] = "terrain"
+    return mesh
@@ -0,0 +1,268 @@
+"""
+File: tiling.py
+Author: TORREGROSSA Dylan
+Repository: https://github.com/P-Joss-P/map-to-3d.git
+License: GNU GENERAL PUBLIC LICENSE Version 3 (see LICENSE file)
+
+Description:
+    This file will allow users to build the 3D scene tile by tile on every core of the computer.
+    The projected extent of the filtered GeoDataFrame is split in a grid of square tiles of TILE_SIZE metres
+    and the meshes of each tile are built in a process pool (meshing.build_scene_batched).
+    The tiles are then either merged in a single GLB, or written in one GLB per tile with a manifest.json
+    file which contains the bounds of every tile, or streamed one by one in a single GLB (glb_writer.py)
+    so that the whole scene is never in memory.
+    export_tile_frames exports tiles made elsewhere (tiles of the index, spatial_index.py).
+    With a terrain (terrain.py), every tile reads its own window of the DEM and gets the ground of its cell.
+
+Usage:
+    - python main.py (with TILED_SCENE = True or STREAMING_EXPORT = True in configuration.py)
+
+Dependencies:
+    - Python 3.13+
+    - library used : collections, concurrent.futures, json, numpy, os, shapely, trimesh
+
+Notes:
+    - Border rule : a feature belongs to the tile which contains its centroid. Features are never clipped
+      or duplicated, so a building crossing a border is kept whole in a single tile.
+    - The scripts using this file must protect their code with if __name__ == "__main__" (process pool).
+
+"""
+
+# library import
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+import json
+import os
+import numpy as np
+import shapely
+import trimesh
+
+# function/variable import
+from configuration import COMPACT_EXPORT, DEFAULT_CONFIG, FEATURE_IDS, MESH_CACHE_DIR, TILE_SIZE, TILE_WORKERS
+from configuration import USE_MESH_CACHE
+from constant import BASE_COLUMN, HEIGHT_COLUMN
+from glb_writer import abort_glb, add_trimesh, close_glb, open_glb, write_scene
+from heights import resolve_heights
+from meshing import build_scene_batched, feature_names, load_rules
+
+
+def assign_tiles(gdf, tile_size=TILE_SIZE):
+    """
+    Give the (ix, iy) tile of every feature, thank's to its centroid.
+    Returns the two arrays of indexes and the origin (minx, miny) of the grid.
+    """
+    minx, miny, _, _ = gdf.total_bounds
+    centroids = shapely.centroid(np.asarray(gdf.geometry.values, dtype=object))
+
+    ix = np.floor((shapely.get_x(centroids) - minx) / tile_size)
+    iy = np.floor((shapely.get_y(centroids) - miny) / tile_size)
+
+    # Empty geometries have no centroid : they go to the first tile
+    ix = np.nan_to_num(ix).astype(np.int64)
+    iy = np.nan_to_num(iy).astype(np.int64)
+    return ix, iy, (minx, miny)
+
+
+def tile_bounds(ix, iy, origin, tile_size=TILE_SIZE):
+    """Bounds (minx, miny, maxx, maxy) of the tile (ix, iy) in the scene coordinates."""
+    x0 = origin[0] + ix * tile_size
+    y0 = origin[1] + iy * tile_size
+    return [float(x0), float(y0), float(x0 + tile_size), float(y0 + tile_size)]
+
+
+def _meshing_frame(gdf, rules):
+    """Only the columns used by the meshing are sent to the workers : the heights are resolved before (heights.py)."""
+    gdf = resolve_heights(gdf, rules)
+    return gdf[["entity_type", gdf.geometry.name, HEIGHT_COLUMN, BASE_COLUMN]]
+
+
+def _build_tile(job):
+    """Worker : build the scene of a single tile, export it if a file path is given."""
+    name, gdf, rules, glb_path, cache_dir, compact, terrain, ground_bounds = job
+    scene = build_scene_batched(gdf, rules, cache_dir, FEATURE_IDS, terrain, ground_bounds)
+
+    if glb_path is None:
+        return name, scene.geometry
+
+    # Nothing to export (no meshable feature in this tile)
+    if len(scene.geometry) == 0:
+        return name, False
+    write_scene(scene, glb_path, compact)
+    return name, True
+
+
+def _tile_grid(gdf, tile_size, terrain=None):
+    """
+    Tile (ix, iy) of every feature, origin of the grid, extent of gdf and keys of the tiles to build.
+    With a terrain, the cells without any feature are also built, to get their ground.
+    """
+    ix, iy, origin = assign_tiles(gdf, tile_size)
+    extent = gdf.attrs.get("aoi", gdf.total_bounds)
+
+    keys = np.unique(np.stack([ix, iy], axis=1), axis=0)
+    if terrain is not None:
+        cols = np.arange(np.floor((extent[0] - origin[0]) / tile_size), np.ceil((extent[2] - origin[0]) / tile_size))
+        rows = np.arange(np.floor((extent[1] - origin[1]) / tile_size), np.ceil((extent[3] - origin[1]) / tile_size))
+        grid = np.stack(np.meshgrid(cols, rows), axis=-1).reshape(-1, 2).astype(np.int64)
+        keys = np.unique(np.concatenate([keys, grid]), axis=0)
+    return ix, iy, origin, extent, keys
+
+
+def _tile_entries(gdf, tile_size, folder=None, terrain=None):
+    """Manifest entry of every tile, in the order of the jobs of _tile_jobs."""
+    ix, iy, origin, _, keys = _tile_grid(gdf, tile_size, terrain)
+    tiles = []
+    for key in keys:
+        name = f"tile_{key[0]}_{key[1]}"
+        tiles.append({
+            "name": name,
+            "ix": int(key[0]),
+            "iy": int(key[1]),
+            "bounds": tile_bounds(key[0], key[1], origin, tile_size),
+            "features": int(((ix == key[0]) & (iy == key[1])).sum()),
+            "file": f"{name}.glb" if folder is not None else None,
+        })
+    return tiles
+
+
+def _tile_jobs(gdf, rules, tile_size, folder=None, mesh_cache=USE_MESH_CACHE, compact=COMPACT_EXPORT, terrain=None):
+    """
+    Split gdf in tiles and yield the job of every tile for the process pool. It is a generator : the features
+    of a tile are copied only when iter_tiles submits its job, so only a few tiles are in memory.
+    Every tile has its own folder in the mesh cache, so the workers never write the same file.
+    The ground of a tile (terrain) is its cell cut to the extent of gdf, so the grounds of the tiles meet.
+    """
+    ix, iy, origin, extent, keys = _tile_grid(gdf, tile_size, terrain)
+    gdf = _meshing_frame(gdf, rules).assign(feature_id=np.arange(len(gdf)))    # same feature ids in every tile
+
+    for key in keys:
+        mask = (ix == key[0]) & (iy == key[1])
+        name = f"tile_{key[0]}_{key[1]}"
+        glb_path = os.path.join(folder, f"{name}.glb") if folder is not None else None
+        cache_dir = os.path.join(MESH_CACHE_DIR, name) if mesh_cache else None
+
+        bounds = tile_bounds(key[0], key[1], origin, tile_size)
+        ground = [max(bounds[0], extent[0]), max(bounds[1], extent[1]),
+                  min(bounds[2], extent[2]), min(bounds[3], extent[3])]
+
+        yield name, gdf[mask], rules, glb_path, cache_dir, compact, terrain, ground
+
+
+def iter_tiles(jobs, workers=TILE_WORKERS):
+    """
+    Yield the (name, geometries) of every tile in the order of jobs, built in a process pool.
+    Only a few tiles per worker are submitted in advance, so the built tiles never pile up in memory.
+    """
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        window = 2 * (workers or os.cpu_count() or 1)
+        pending = deque()
+        for job in jobs:
+            pending.append(executor.submit(_build_tile, job))
+            if len(pending) >= window:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+def build_scene_tiled(gdf, config_path=DEFAULT_CONFIG, tile_size=TILE_SIZE, workers=TILE_WORKERS, terrain=None):
+    """
+    Build the tiles in a process pool and merge them in a single scene.
+    Every tile keeps its own node per entity_type, named "<tile>_<entity_type>".
+    """
+    rules = load_rules(config_path)
+    jobs = _tile_jobs(gdf, rules, tile_size, terrain=terrain)
+
+    scene = trimesh.Scene()
+    scene.metadata["origin"] = gdf.attrs.get("origin")
+    if FEATURE_IDS:
+        scene.metadata["features"] = feature_names(gdf.index)
+    for name, geometries in iter_tiles(jobs, workers):
+        for typ, mesh in geometries.items():
+            scene.add_geometry(mesh, node_name=f"{name}_{typ}", geom_name=f"{name}_{typ}")
+    return scene
+
+
+def export_tiles(gdf, folder, config_path=DEFAULT_CONFIG, tile_size=TILE_SIZE, workers=TILE_WORKERS,
+                 compact=COMPACT_EXPORT, terrain=None):
+    """
+    Build and export one GLB per tile in a process pool, then write folder/manifest.json
+    with the origin of the scene and the bounds, the number of features and the file of every tile.
+    """
+    os.makedirs(folder, exist_ok=True)
+    rules = load_rules(config_path)
+    tiles = _tile_entries(gdf, tile_size, folder, terrain)
+    jobs = _tile_jobs(gdf, rules, tile_size, folder, compact=compact, terrain=terrain)
+    written = dict(iter_tiles(jobs, workers))
+
+    for tile in tiles:
+        if not written[tile["name"]]:
+            tile["file"] = None
+
+    manifest = {
+        "crs": gdf.crs.to_string() if gdf.crs is not None else None,
+        "origin": gdf.attrs.get("origin"),
+        "tile_size": tile_size,
+        "border_rule": "centroid",
+        "tiles": tiles,
+    }
+    if FEATURE_IDS:
+        manifest["features"] = feature_names(gdf.index)
+    with open(os.path.join(folder, "manifest.json"), "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=4)
+
+    print(f"{len(tiles)} tiles exported → {folder}")
+    return manifest
+
+
+def export_tile_frames(frames, folder, config_path=DEFAULT_CONFIG, workers=TILE_WORKERS, compact=COMPACT_EXPORT,
+                       mesh_cache=USE_MESH_CACHE):
+    """
+    Build and export folder/<name>.glb for every (name, gdf) of frames in a process pool. frames could be a
+    generator : only a few tiles are in memory. Every GLB carries the names of its own features, and the GLB
+    of a tile left without any mesh is removed. Returns {name: written}.
+    """
+    os.makedirs(folder, exist_ok=True)
+    rules = load_rules(config_path)
+    jobs = (
+        (name, _meshing_frame(gdf, rules), rules, os.path.join(folder, f"{name}.glb"),
+         os.path.join(MESH_CACHE_DIR, name) if mesh_cache else None, compact, None, None)
+        for name, gdf in frames
+    )
+
+    written = {}
+    for name, done in iter_tiles(jobs, workers):
+        written[name] = done
+        glb_path = os.path.join(folder, f"{name}.glb")
+        if not done and os.path.exists(glb_path):
+            os.remove(glb_path)
+    return written
+
+
+def stream_scene(gdf, path, config_path=DEFAULT_CONFIG, tile_size=TILE_SIZE, workers=TILE_WORKERS,
+                 compact=COMPACT_EXPORT, terrain=None):
+    """
+    Build the scene tile by tile in a process pool and write every tile in the glb file as soon as
+    it is ready. Every tile keeps its own node per entity_type, named "<tile>_<entity_type>".
+    """
+    rules = load_rules(config_path)
+    jobs = _tile_jobs(gdf, rules, tile_size, terrain=terrain)
+
+    extras = {"origin": gdf.attrs.get("origin")}
+    if FEATURE_IDS:
+        extras["features"] = feature_names(gdf.index)
+
+    writer = open_glb(path, compact)
+    try:
+        n_tiles, n_nodes = 0, 0
+        for name, geometries in iter_tiles(jobs, workers):
+            n_tiles += 1
+            for typ, mesh in geometries.items():
+                if add_trimesh(writer, f"{name}_{typ}", mesh) is not None:
+                    n_nodes += 1
+    except BaseException:
+        abort_glb(writer)
+        raise
+
+    close_glb(writer, extras)
+    print(f"Streamed export : {n_tiles} tiles, {n_nodes} nodes → {path}")
+    return path